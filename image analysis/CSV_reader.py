@@ -32,8 +32,17 @@ This code was used to perform the analysis presented in "A thalamo-amygdalar cir
 of remote fear memories" (Silva et al., Nature Neuroscience, 2021).
 """
 
-# import functions in the file QuPath.py:
-from QuPath import import_files, calculate_ratio, get_chance_ratio, write_results_to_csv, output_raw_numbers
+import os
+
+# import functions in the file qupath_ratios/QuPath.py:
+from qupath_ratios.QuPath import write_results_to_csv, output_raw_numbers
+# vectorized versions of calculate_ratio and get_chance_ratio in QuPath.py (see ratio_engine.py):
+from qupath_ratios.ratio_engine import calculate_ratio_vectorized, get_chance_ratio_vectorized
+# import_files_compact stores the counts in a compact SliceStore (see slice_store.py). With a cache folder
+# (cache_dir below), it only re-reads the .csv files that changed since the last run (see slice_cache.py):
+from qupath_ratios.slice_store import import_files_compact
+# opt-in timing of the stages of this script (see profiling.py):
+from qupath_ratios.profiling import start_profiling, stop_profiling
 
 #%%
 '''----------------------------PARAMETERS THAT YOU HAVE TO SET----------------------------'''
@@ -42,6 +51,7 @@ from QuPath import import_files, calculate_ratio, get_chance_ratio, write_result
 experiment = 'WT48'      # Experiment name.
 region_name = 'mPFC'     # Is only used in the title of the output file. Choose whatever you like.
 tracer = 'BLA'           # 'BLA' or 'NRe'
+# (To analyse several tracers and 'combine' dictionaries in one run, use analyse_combinations in multi_analysis.py.)
 
 # where are the .csv files stored?
 root = './example data/cell counts in mPFC'
@@ -49,6 +59,17 @@ root = './example data/cell counts in mPFC'
 # Path and name of the directory where you want to output. If it is a path to a folder that doesn't exist yet, it will be created automatically.
 output_directory = './example data/ratios in mPFC' 
 
+# To only re-read the .csv files that changed since the last run, give a folder for the cache (see slice_cache.py),
+# e.g. os.path.expanduser('~/.cache/qupath_csv_reader'). Leave it None to read all files every time (nothing is written).
+cache_dir = None
+
+# Set to False to not show the number of .csv files read so far.
+show_progress = True
+
+# To time the stages of this script (importing, ratios, writing), give the name of a .json file for the run report, e.g. 'run_report.json'.
+# Leave it None to switch timing off.
+profile_report = None
+
 # which mice are in which groups?
 recall = []
 # WT48
@@ -165,33 +186,61 @@ combine = {'GI': ['GI'],
 #%%
 '''-------------------------------START CODE------------------------------------'''
 
-# Output files
-output_file = experiment + '_results_' + region_name + '_' + tracer + '.csv'    # name of the output file
-title = experiment + ' ' + region_name + '->' + tracer  # title (will appear on the first line of the output file)
-
-# Lists of parameters, whole regions and all mice
-param_list = ['DAPI','cFos',tracer,'area',tracer + '_cFos']
-whole_regs = list(combine.keys())
-full_mouse_list = recall + extinction + control 
-
-# only consider regions where we have at least x amount of traced cells:
-traced_cell_thresh_VMT = 5
-traced_cell_thresh_single_region = 4
-
-#%% import all files in the channel folders into the mouse dictionary and, if necessary, combine regions.
-m_dict = import_files(root,combine,param_list)
- 
-#%% analyse cFos/tracer cell counts
-[cFos_ratio_df, cFos_SEM_df] = calculate_ratio('cFos', 'DAPI', m_dict, full_mouse_list, whole_regs, traced_cell_thresh_single_region)
-[Doublepos_ratio_df, Doublepos_SEM_df] = calculate_ratio(tracer+'_cFos', tracer, m_dict, full_mouse_list, whole_regs, traced_cell_thresh_single_region)
-
-#%% tracer+cFos chance ratio
-[BLA_chance_df,BLA_chance_SEM_df] = get_chance_ratio(tracer, m_dict, full_mouse_list, whole_regs, traced_cell_thresh_single_region) 
-
-#%% Write output to csv file
-write_results_to_csv(output_directory, output_file, title, recall, extinction, control, tracer,
-                     BLA_chance_df, BLA_chance_SEM_df, 
-                     cFos_ratio_df, cFos_SEM_df, 
-                     Doublepos_ratio_df, Doublepos_SEM_df)
-
-output_raw_numbers(output_directory, m_dict, tracer, region_name)
+def main(cache_dir=cache_dir, progress=show_progress):
+    '''
+    Runs the analysis with the parameters above. Returns the counts (m_dict) and the ratio dataframes.
+    cache_dir: folder of the cache of the .csv files (see slice_cache.py). If None, the cache is not used.
+    progress: if False, the number of .csv files read so far is not shown.
+    To use the analysis from other code or from the command line, see qupath_ratios/analysis_session.py and qupath_ratios/cli.py.
+    '''
+    # Output files
+    output_file = experiment + '_results_' + region_name + '_' + tracer + '.csv'    # name of the output file
+    title = experiment + ' ' + region_name + '->' + tracer  # title (will appear on the first line of the output file)
+
+    # Lists of parameters, whole regions and all mice
+    param_list = ['DAPI','cFos',tracer,'area',tracer + '_cFos']
+    whole_regs = list(combine.keys())
+    full_mouse_list = recall + extinction + control 
+
+    # only consider regions where we have at least x amount of traced cells:
+    traced_cell_thresh_VMT = 5
+    traced_cell_thresh_single_region = 4
+
+    if profile_report is not None:
+        start_profiling()
+    # (profiling is switched off again if the analysis stops with an error)
+    try:
+        # import all files in the channel folders into the mouse dictionary and, if necessary, combine regions.
+        m_dict = import_files_compact(root,combine,param_list,cache_dir,progress)
+
+        # analyse cFos/tracer cell counts
+        [cFos_ratio_df, cFos_SEM_df] = calculate_ratio_vectorized('cFos', 'DAPI', m_dict, full_mouse_list, whole_regs, traced_cell_thresh_single_region)
+        [Doublepos_ratio_df, Doublepos_SEM_df] = calculate_ratio_vectorized(tracer+'_cFos', tracer, m_dict, full_mouse_list, whole_regs, traced_cell_thresh_single_region)
+
+        # tracer+cFos chance ratio
+        [BLA_chance_df,BLA_chance_SEM_df] = get_chance_ratio_vectorized(tracer, m_dict, full_mouse_list, whole_regs, traced_cell_thresh_single_region) 
+
+        # Write output to csv file
+        write_results_to_csv(output_directory, output_file, title, recall, extinction, control, tracer,
+                             BLA_chance_df, BLA_chance_SEM_df, 
+                             cFos_ratio_df, cFos_SEM_df, 
+                             Doublepos_ratio_df, Doublepos_SEM_df)
+
+        output_raw_numbers(output_directory, m_dict, tracer, region_name)
+        # (To also write the results and raw numbers to one columnar file, use write_results_columnar in columnar_output.py.)
+    finally:
+        if profile_report is not None:
+            profile = stop_profiling()
+
+    if profile_report is not None:
+        profile.write_report(os.path.join(output_directory, profile_report))
+        profile.print_summary()
+
+    return {'m_dict': m_dict,
+            'cFos_ratio_df': cFos_ratio_df, 'cFos_SEM_df': cFos_SEM_df,
+            'Doublepos_ratio_df': Doublepos_ratio_df, 'Doublepos_SEM_df': Doublepos_SEM_df,
+            'chance_df': BLA_chance_df, 'chance_SEM_df': BLA_chance_SEM_df}
+
+# Importing this file (e.g. 'from CSV_reader import main') does not run the analysis
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This script compares the speed of the functions in QuPath.py.
+
+The .csv files are either copies of the example .csv files (in 'example data/cell counts in mPFC'), so that it
+looks like an experiment with many mice, or synthetic QuPath exports made by make_synthetic_cohort: files with the
+same columns as the output of qps-multiChannels_PositiveCells_Analysis.groovy, for any number of mice, slices per mouse
+and regions, with or without hemispheres, and with the columns of a 1, 2 or 3 channel analysis (see LAYOUTS).
+
+For each cohort, the script times:
+- importing: import_files (one file at a time), import_files_batched (all files at once), import_files_parallel
+  (all files at once, in several processes), import_files_cached (a second run, with all files in the cache),
+  import_files_compact (into a SliceStore, see slice_store.py) and import_files_streaming (see stream_reader.py);
+- ratios: calculate_ratio and get_chance_ratio against their vectorized versions in ratio_engine.py;
+- writing: write_results_to_csv, output_raw_numbers and write_results_columnar (see columnar_output.py).
+It checks that all import functions give the same counts and all ratio functions the same ratios,
+and compares how much memory the mouse dictionary (one dataframe per slice) and a SliceStore need.
+import_files, the loops over mice and import_files_streaming (which is made for a few very large files, not for many
+small ones) are slow for large cohorts, so they are only run up to --max-loop-files files (then import_files_batched
+is the reference for the other import functions).
+
+The results can be added to a history file (--history, one json line per run, with the git commit), so that
+the speed of new versions can be compared with older ones: every run prints the change since the last run
+with the same settings.
+
+Usage:
+    python benchmark_QuPath.py 20                      (20 copies of the example data)
+    python benchmark_QuPath.py --scale 10k --layout cFos+BLA+NRe --history benchmark_history.jsonl
+    python benchmark_QuPath.py --mice 100 --slices 30 --no-hemispheres
+    python benchmark_QuPath.py --scale 1k --regions 40        (40 whole regions of 3 subregions each)
+    python benchmark_QuPath.py --scale 1k --combine my_combine.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from qupath_ratios.QuPath import (import_files, import_files_batched, import_files_parallel, list_csv_files,
+                    read_raw_counts, make_slice_table, table_to_dict, calculate_ratio, get_chance_ratio,
+                    write_results_to_csv, output_raw_numbers)
+from qupath_ratios.columnar_output import write_results_columnar
+from qupath_ratios.ratio_engine import as_store, calculate_ratio_vectorized, get_chance_ratio_vectorized
+from qupath_ratios.slice_cache import import_files_cached
+from qupath_ratios.slice_store import SliceStore, import_files_compact
+from qupath_ratios.stream_reader import import_files_streaming
+
+#%%
+'''----------------------------PARAMETERS----------------------------'''
+
+example_root = './example data/cell counts in mPFC'
+tracer = 'BLA'
+param_list = ['DAPI', 'cFos', tracer, 'area', tracer + '_cFos']
+combine = {'IL': ['IL23', 'IL5', 'IL6'],
+           'PL': ['PL23', 'PL5', 'PL6'],
+           'AC': ['AC23', 'AC5', 'AC6'],
+          }
+
+# The classes of detected cells in the .csv files of each layout (one 'Num ...' column per class; N = negative).
+# Channel A is cFos, channel B is the NRe tracer and channel C is the BLA tracer (see csv_to_dataframe).
+LAYOUTS = {'cFos':         {'classes': ['A', 'N'],
+                            'tracer': None,
+                            'param_list': ['DAPI', 'cFos', 'area']},
+           'cFos+NRe':     {'classes': ['A', 'AB', 'B', 'N'],
+                            'tracer': 'NRe',
+                            'param_list': ['DAPI', 'cFos', 'NRe', 'area', 'NRe_cFos']},
+           'cFos+BLA':     {'classes': ['A', 'ABC', 'AC', 'C', 'N'],
+                            'tracer': 'BLA',
+                            'param_list': ['DAPI', 'cFos', 'BLA', 'area', 'BLA_cFos']},
+           'cFos+BLA+NRe': {'classes': ['A', 'AB', 'ABC', 'AC', 'B', 'BC', 'C', 'N'],
+                            'tracer': 'BLA',
+                            'param_list': ['DAPI', 'cFos', 'BLA', 'NRe', 'area', 'BLA_cFos', 'NRe_cFos']}}
+
+# Fraction of the detected cells of each class (the rest is negative)
+CLASS_FRACTIONS = {'A': 0.2, 'B': 0.02, 'C': 0.015, 'AB': 0.005, 'AC': 0.006, 'BC': 0.001, 'ABC': 0.001}
+
+# Number of mice and slices per mouse for --scale (about 50, 1000, 10000 and 100000 files)
+SCALES = {'example': (12, 4), '1k': (50, 20), '10k': (250, 40), '100k': (1000, 100)}
+
+#%%
+def make_combine(n_regions, n_subregions=3):
+    '''
+    Returns a 'combine' dictionary with n_regions whole regions of n_subregions subregions each,
+    e.g. {'R01': ['R01a', 'R01b', 'R01c'], 'R02': [...], ...}, for synthetic cohorts with many regions.
+    '''
+    width = len(str(n_regions))
+    return {'R{i:0{w}d}'.format(i=i + 1, w=width): ['R{i:0{w}d}{s}'.format(i=i + 1, w=width, s=chr(ord('a') + j))
+                                                     for j in range(n_subregions)]
+            for i in range(n_regions)}
+
+def load_combine(file_name):
+    '''
+    Reads a 'combine' dictionary from a .json file ({"IL": ["IL23", "IL5", "IL6"], ...}).
+    '''
+    with open(file_name, encoding='utf-8') as f:
+        loaded = json.load(f)
+    if not isinstance(loaded, dict) or not all(isinstance(subregs, list) for subregs in loaded.values()):
+        raise ValueError('"{f}" must have a list of subregions for every whole region.'.format(f=file_name))
+    return loaded
+
+def make_cohort(example_root, target_root, n_copies):
+    '''
+    Copies the example .csv files n_copies times into target_root.
+    Every copy gets new mouse names, e.g. 14025_01.csv becomes 1014025_01.csv in the first copy.
+    '''
+    file_list = list_csv_files(example_root)
+    for copy in range(n_copies):
+        for file in file_list:
+            mouse_name, rest = file.split('_', 1)
+            new_name = '{c}{m}_{r}'.format(c=copy + 1, m=mouse_name, r=rest)
+            shutil.copyfile(os.path.join(example_root, file), os.path.join(target_root, new_name))
+    return len(file_list) * n_copies
+
+def make_synthetic_cohort(target_root, n_mice, n_slices, combine=combine, layout='cFos+BLA', hemispheres=True,
+                          p_missing=0.15, p_one_hemisphere=0.1, p_empty=0.02, seed=0):
+    '''
+    Writes synthetic QuPath .csv files into target_root: n_slices files for each of n_mice mice
+    (e.g. 100001_01.csv, 100001_02.csv, ...), with the columns of the .groovy script for the given layout.
+    Every subregion in 'combine' is in a slice with probability 1-p_missing. With hemispheres=True, it has a left
+    and a right row (or only one of them, with probability p_one_hemisphere), otherwise one row without hemisphere.
+    A fraction p_empty of the rows have no detections. Returns the number of files.
+    '''
+    rng = np.random.default_rng(seed)
+    classes = LAYOUTS[layout]['classes']
+    header = (['Name', 'Class', 'Parent', 'ROI', 'Centroid X µm', 'Centroid Y µm', 'Num Annotations', 'Num Detections']
+              + ['Num ' + c for c in classes] + ['Area um^2', 'Perimeter µm', 'Max length µm'])
+    subregions = list(dict.fromkeys(subreg for subregs in combine.values() for subreg in subregs))
+
+    # Region names of every file
+    names = []
+    for i in range(n_mice * n_slices):
+        present = [subreg for subreg in subregions if rng.random() >= p_missing]
+        file_names = []
+        for subreg in present:
+            if not hemispheres:
+                file_names.append(subreg)
+            elif rng.random() < p_one_hemisphere:
+                file_names.append(subreg + rng.choice([' left', ' right']))
+            else:
+                file_names.extend([subreg + ' left', subreg + ' right'])
+        names.append(file_names)
+
+    # Counts of all rows of all files at once
+    n_rows = sum(len(file_names) for file_names in names)
+    area = rng.uniform(0.05e6, 1.5e6, n_rows)
+    detections = rng.poisson(area / 250)
+    detections[rng.random(n_rows) < p_empty] = 0
+    fractions = [CLASS_FRACTIONS.get(c, 0) for c in classes if c != 'N']
+    positives = rng.multinomial(detections, fractions + [1 - sum(fractions)])[:, :-1]
+    class_counts = np.column_stack([positives, detections - positives.sum(axis=1)])
+    centroids = rng.uniform(0, 5000, (n_rows, 2))
+
+    rows = ['{n},mPFC,Image,Polygon,{x:.1f},{y:.1f},0,{d},{c},{a:.1f},{p:.1f},{m:.1f}'.format(
+                n=name, x=centroids[r, 0], y=centroids[r, 1], d=detections[r], c=','.join(map(str, class_counts[r])),
+                a=area[r], p=4 * np.sqrt(area[r]), m=1.5 * np.sqrt(area[r]))
+            for r, name in enumerate(name for file_names in names for name in file_names)]
+
+    start = 0
+    for i, file_names in enumerate(names):
+        mouse, s = divmod(i, n_slices)
+        file = '{m}_{s:02d}.csv'.format(m=100001 + mouse, s=s + 1)
+        with open(os.path.join(target_root, file), 'w', encoding='latin1') as f:
+            f.write(','.join(header) + '\n')
+            for row in rows[start:start + len(file_names)]:
+                f.write(row + '\n')
+        start = start + len(file_names)
+    return n_mice * n_slices
+
+#%%
+def time_import(function, root, combine=combine, param_list=param_list):
+    '''
+    Runs function(root, combine, param_list) without printing, and returns the result and the wall time.
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        m_dict = function(root, combine, param_list)
+        duration = time.perf_counter() - start
+    return m_dict, duration
+
+def check_equal(m_dict_a, m_dict_b):
+    '''
+    Checks that two mouse dictionaries contain exactly the same dataframes.
+    '''
+    assert list(m_dict_a.keys()) == list(m_dict_b.keys())
+    for mouse in m_dict_a:
+        assert len(m_dict_a[mouse]) == len(m_dict_b[mouse])
+        for df_a, df_b in zip(m_dict_a[mouse], m_dict_b[mouse]):
+            pd.testing.assert_frame_equal(df_a, df_b)
+
+def check_same_counts(m_dict_a, m_dict_b):
+    '''
+    Checks that two mouse dictionaries (or SliceStores) have the same counts, by comparing them as one tidy table.
+    This is much faster than check_equal for large cohorts.
+    '''
+    store_a, store_b = as_store(m_dict_a), as_store(m_dict_b)
+    assert list(store_a.mice) == list(store_b.mice)
+    assert list(store_a.n_slices) == list(store_b.n_slices)
+    table_a, table_b = store_a.to_table(), store_b.to_table()
+    for table in [table_a, table_b]:
+        table['mouse'] = table['mouse'].astype(str)
+        table['region'] = table['region'].astype(str)
+    pd.testing.assert_frame_equal(table_a.astype({p: float for p in store_a.param_list}),
+                                  table_b.astype({p: float for p in store_b.param_list}))
+
+def time_ratios(ratio_function, chance_function, m_dict, combine=combine, tracer=tracer):
+    '''
+    Calculates the cFos ratio, double-positive ratio and chance ratio of all mice, and returns the results and the wall time.
+    Without tracer (a 1 channel analysis), only the cFos ratio is calculated.
+    '''
+    mouse_list = list(m_dict.keys())
+    whole_regs = list(combine.keys())
+    start = time.perf_counter()
+    results = ratio_function('cFos', 'DAPI', m_dict, mouse_list, whole_regs, 4)
+    if tracer is not None:
+        results = (results
+                   + ratio_function(tracer + '_cFos', tracer, m_dict, mouse_list, whole_regs, 4)
+                   + chance_function(tracer, m_dict, mouse_list, whole_regs, 4))
+    duration = time.perf_counter() - start
+    return results, duration
+
+def time_outputs(output_directory, results, m_dict, tracer):
+    '''
+    Writes the ratios (the output of time_ratios) and raw numbers with write_results_to_csv, output_raw_numbers
+    and write_results_columnar, and returns the wall time of each, without printing.
+    '''
+    mouse_list = list(m_dict.keys())
+    if len(results) == 2:
+        # Only a cFos ratio: write it in all sections
+        results = results * 3
+    [cFos_ratio_df, cFos_SEM_df, Doublepos_ratio_df, Doublepos_SEM_df, chance_df, chance_SEM_df] = results
+    arguments = ('Benchmark', [], mouse_list, [], str(tracer),
+                 chance_df, chance_SEM_df, cFos_ratio_df, cFos_SEM_df, Doublepos_ratio_df, Doublepos_SEM_df)
+    durations = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        write_results_to_csv(output_directory, 'benchmark_results.csv', *arguments)
+        durations['write_results_to_csv'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        output_raw_numbers(output_directory, m_dict, str(tracer), 'benchmark')
+        durations['output_raw_numbers'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        write_results_columnar(output_directory, 'benchmark_results.npz', *arguments, m_dict=m_dict)
+        durations['write_results_columnar'] = time.perf_counter() - start
+    return durations
+
+def measure_memory(build):
+    '''
+    Runs build() and returns the result and the memory (in bytes) that is still in use by the result.
+    '''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+def measure_peak(run):
+    '''
+    Runs run() and returns the peak memory (in bytes) that was allocated while it ran.
+    '''
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+#%%
+def run_benchmark(root, combine, layout, max_loop_files, n_workers=None, track_memory=True):
+    '''
+    Runs all timings (see the description at the top of this file) on the .csv files in root.
+    Returns a dictionary with the wall time ('seconds'), throughput ('files_per_second') and, with track_memory,
+    the peak memory ('peak_bytes') of every function, and the memory of the mouse dictionary and the SliceStore.
+    '''
+    param_list = LAYOUTS[layout]['param_list']
+    tracer = LAYOUTS[layout]['tracer']
+    n_files = len(list_csv_files(root))
+    run_loops = n_files <= max_loop_files
+    seconds = {}
+
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as output_directory:
+        import_cached = lambda root, combine, param_list: import_files_cached(root, combine, param_list, cache_dir=cache_dir)
+        import_compact = lambda root, combine, param_list: import_files_compact(root, combine, param_list, cache_dir=None)
+        import_parallel = lambda root, combine, param_list: import_files_parallel(root, combine, param_list, n_workers=n_workers)
+        functions = [('import_files_batched', import_files_batched), ('import_files_parallel', import_parallel),
+                     ('import_files_compact', import_compact)]
+        if run_loops:
+            functions = ([('import_files', import_files)] + functions
+                         + [('import_files_streaming', import_files_streaming)])
+
+        # Importing; the first function is the reference for the others
+        reference = None
+        for name, function in functions:
+            m_dict, seconds[name] = time_import(function, root, combine, param_list)
+            if reference is None:
+                reference = m_dict
+            else:
+                check_same_counts(reference, m_dict)
+        time_import(import_cached, root, combine, param_list)  # fill the cache
+        m_dict, seconds['import_files_cached'] = time_import(import_cached, root, combine, param_list)
+        check_same_counts(reference, m_dict)
+        if run_loops:
+            check_equal(reference, m_dict)
+
+        # Memory: mouse dictionary vs SliceStore, made from the same slice table
+        file_list = list_csv_files(root)
+        with contextlib.redirect_stdout(io.StringIO()):
+            table = make_slice_table(read_raw_counts(root, file_list), file_list, combine, param_list)
+        m_dict, mem_dict = measure_memory(lambda: table_to_dict(table, file_list, param_list))
+        store, mem_store = measure_memory(lambda: SliceStore.from_table(table, file_list, param_list, list(combine.keys())))
+
+        # Ratios: loop over mice vs vectorized
+        ratios, seconds['ratios_vectorized'] = time_ratios(calculate_ratio_vectorized, get_chance_ratio_vectorized, store,
+                                                          combine, tracer)
+        if run_loops:
+            ratios_loop, seconds['ratios_loop'] = time_ratios(calculate_ratio, get_chance_ratio, m_dict, combine, tracer)
+            for df_loop, df_vectorized in zip(ratios_loop, ratios):
+                pd.testing.assert_frame_equal(df_loop, df_vectorized)
+
+        # Writing outputs
+        seconds.update(time_outputs(output_directory, ratios, store, tracer))
+
+        peak = {}
+        if track_memory:
+            # A second run of the main functions, with tracemalloc (which makes them slower)
+            peak['import_files_batched'] = measure_peak(lambda: import_files_batched(root, combine, param_list))
+            peak['import_files_compact'] = measure_peak(lambda: import_compact(root, combine, param_list))
+            if run_loops:
+                peak['import_files_streaming'] = measure_peak(lambda: import_files_streaming(root, combine, param_list))
+            peak['ratios_vectorized'] = measure_peak(lambda: time_ratios(calculate_ratio_vectorized, get_chance_ratio_vectorized,
+                                                                         store, combine, tracer))
+            peak['write_outputs'] = measure_peak(lambda: time_outputs(output_directory, ratios, store, tracer))
+
+    return {'n_files': n_files, 'n_mice': len(store), 'n_rows': len(store.mouse_codes),
+            'seconds': seconds,
+            'files_per_second': {name: n_files / t for name, t in seconds.items() if t > 0},
+            'peak_bytes': peak,
+            'memory_bytes': {'mouse_dictionary': mem_dict, 'SliceStore': mem_store}}
+
+#%%
+def git_commit():
+    '''
+    Returns the current git commit of this folder (None if it is not a git repository).
+    '''
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return output.stdout.strip() or None
+
+def last_run(history_file, settings):
+    '''
+    Returns the last run in the history file with the same settings (None if there is none).
+    '''
+    if not os.path.isfile(history_file):
+        return None
+    last = None
+    with open(history_file) as f:
+        for line in f:
+            run = json.loads(line)
+            if run.get('settings') == settings:
+                last = run
+    return last
+
+def print_results(results, previous=None):
+    '''
+    Prints the results of run_benchmark, with the change since the previous run (if given).
+    '''
+    print('{n} files, {m} mice, {r} region rows, {c} CPUs'.format(n=results['n_files'], m=results['n_mice'],
+                                                                  r=results['n_rows'], c=os.cpu_count()))
+    seconds = results['seconds']
+    for name, t in seconds.items():
+        line = '{f:24s} {t:9.3f} s ({r:9.1f} files/s)'.format(f=name + ':', t=t, r=results['files_per_second'].get(name, 0))
+        if 'import_files' in seconds and name.startswith('import_files'):
+            line = line + ' speedup {s:6.1f} x'.format(s=seconds['import_files'] / t)
+        if name == 'ratios_vectorized' and 'ratios_loop' in seconds:
+            line = line + ' speedup {s:6.1f} x'.format(s=seconds['ratios_loop'] / t)
+        if previous is not None and name in previous['results']['seconds']:
+            line = line + ' ({c:+.0%} since {g})'.format(c=t / previous['results']['seconds'][name] - 1,
+                                                         g=previous.get('commit') or previous['date'])
+        print(line)
+    for name, peak in results['peak_bytes'].items():
+        print('peak memory {f:24s} {p:10.0f} kB'.format(f=name + ':', p=peak / 1e3))
+    memory = results['memory_bytes']
+    print('memory of the mouse dictionary: {d:10.0f} kB'.format(d=memory['mouse_dictionary'] / 1e3))
+    print('memory of the SliceStore:       {s:10.0f} kB ({r:.0f} x smaller)'.format(
+        s=memory['SliceStore'] / 1e3, r=memory['mouse_dictionary'] / memory['SliceStore']))
+
+def parse_arguments(arguments):
+    parser = argparse.ArgumentParser(description='Benchmark of the import, ratio and output functions of QuPath.py.')
+    parser.add_argument('copies', nargs='?', type=int,
+                        help='number of copies of the example data (if no synthetic cohort is asked for; default 20)')
+    parser.add_argument('--scale', choices=list(SCALES), help='synthetic cohort of about 50, 1000, 10000 or 100000 files')
+    parser.add_argument('--mice', type=int, help='number of mice of the synthetic cohort')
+    parser.add_argument('--slices', type=int, default=20, help='number of slices per mouse of the synthetic cohort')
+    parser.add_argument('--layout', choices=list(LAYOUTS), default='cFos+BLA', help='channels of the synthetic cohort')
+    parser.add_argument('--no-hemispheres', action='store_true', help='synthetic regions without left/right hemispheres')
+    parser.add_argument('--regions', type=int, help='number of whole regions (of 3 subregions) of the synthetic cohort')
+    parser.add_argument('--combine', help='.json file with the combine dictionary to use (instead of the mPFC regions)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic cohort')
+    parser.add_argument('--max-loop-files', type=int, default=2000,
+                        help='only run import_files, import_files_streaming and the loops over mice up to this number of files')
+    parser.add_argument('--workers', type=int, help='number of processes of import_files_parallel')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory (faster)')
+    parser.add_argument('--history', help='json lines file to which the results are added')
+    return parser.parse_args(arguments)
+
+#%%
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    synthetic = args.scale is not None or args.mice is not None
+    layout = args.layout if synthetic else 'cFos+BLA'
+    if args.regions is not None and args.combine is not None:
+        sys.exit('Use --regions or --combine, not both.')
+    if args.regions is not None and not synthetic:
+        sys.exit('--regions is only used for synthetic cohorts (--scale or --mice).')
+    if args.regions is not None:
+        combine = make_combine(args.regions)
+    elif args.combine is not None:
+        combine = load_combine(args.combine)
+
+    with tempfile.TemporaryDirectory() as root:
+        start = time.perf_counter()
+        if synthetic:
+            n_mice, n_slices = SCALES[args.scale] if args.scale is not None else (args.mice, args.slices)
+            settings = {'cohort': 'synthetic', 'mice': n_mice, 'slices': n_slices, 'layout': layout,
+                        'hemispheres': not args.no_hemispheres, 'seed': args.seed}
+            make_synthetic_cohort(root, n_mice, n_slices, combine, layout, hemispheres=not args.no_hemispheres, seed=args.seed)
+        else:
+            n_copies = args.copies if args.copies is not None else 20
+            settings = {'cohort': 'example', 'copies': n_copies}
+            make_cohort(example_root, root, n_copies)
+        if args.regions is not None or args.combine is not None:
+            settings['combine'] = combine
+        print('made the cohort in {t:.1f} s'.format(t=time.perf_counter() - start))
+
+        results = run_benchmark(root, combine, layout, args.max_loop_files, args.workers, not args.no_memory)
+
+    previous = last_run(args.history, settings) if args.history is not None else None
+    print_results(results, previous)
+    if args.history is not None:
+        run = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': git_commit(), 'settings': settings, 'results': results}
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(run) + '\n')
@@ -0,0 +1,593 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Mar  5 07:16:32 2020
+
+@author: lukasvdh
+"""
+
+import numpy as np
+import pandas as pd
+import csv
+import io
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from .profiling import (profiled, profile_step, Progress, count_imported, count_raw_counts, count_ratio_input,
+                       count_results, count_raw_numbers, rows_of)
+from .region_index import RegionIndex, as_region_index
+from .prefetch import prefetch_files, DEFAULT_IO_THREADS
+from .csv_schema import required_columns, parse_header, validate_csv_files, COUNT_COLUMNS, COLUMN_DTYPES
+
+#%%
+
+def init_dict(mouse_list):
+    '''
+    This function initializes an empty dictionary with mouse names as keys.
+    The dictionary will later be filled with dataframes (one dataframe per slice).
+    ''' 
+    m_dict = {}
+    for mouse_name in mouse_list:
+        m_dict[mouse_name] = []
+    return m_dict
+
+#%%
+
+@profiled('find_regs_in_current_slice', count=rows_of('df'))
+def find_regs_in_current_slice(df, combine):
+    '''
+    This function finds:
+    - the regions that are present in the current slice;
+    - which of the whole regions and subregions are present.
+    The current regions are put in a list curr_regs 
+    and whole regions with corresponding subregions are put in a dictionary curr_whole_regs.
+    
+    Example: 
+    The regions present in the .csv file of the slice are 'Re', 'Xi' and 'MD left', 
+    and Re and Xi must be combined into NRe (as specified in 'combine').
+    Then curr_regs = ['Re', 'Xi', 'MD'],
+    and curr_whole_regs =  {'NRe': ['Re', 'Xi']
+                            'MD': ['MD']}
+    '''
+    curr_whole_regs = {}
+
+    # combine can also be a RegionIndex made before (see region_index.py), so that it is not made again for every slice
+    index = as_region_index(combine)
+    subregions, hemispheres, regions = index.parse(df.index)
+
+    # Find current regions, and check if the regions in the csv file are valid (the subregions that appear in 'combine'):
+    for reg in df.index[subregions < 0]:
+        print('WARNING: csv file contains invalid region {r}!'.format(r = reg))
+    curr_regs = list(dict.fromkeys(regions))
+
+    # Find current whole regions and subregions:
+    present = set(subregions[subregions >= 0])
+    for whole_reg, subregs in index.combine.items():
+        curr_subregs = [subreg for subreg in subregs if index.subregion_codes[subreg] in present]
+        if len(curr_subregs) != 0:
+            curr_whole_regs[whole_reg] = curr_subregs
+
+    return curr_regs, curr_whole_regs
+
+#%%
+
+def find_current_mice(file_list): 
+    '''
+    This function makes a list of all mice that have a file in the dictionary 'root'.
+    '''
+    curr_mouse_list = []
+    for file_name in file_list:
+        curr_mouse_list.append(file_name.split('_')[0])
+
+    curr_mouse_list = list(dict.fromkeys(curr_mouse_list))
+    return curr_mouse_list
+
+#%%
+@profiled('csv_to_dataframe', count=rows_of('data'))
+def csv_to_dataframe(data, param_list):
+    '''
+    This function takes as input raw data from a csv file (data = a dataframe created with pd.read_csv).
+    It converts counts (Num A, Num B, etc) to number of detected cells ('DAPI, cFos', etc).
+    To do this it sums the relevant counts, depending on what kind of analysis was done (1, 2 or 3 channel).
+    
+    param_list is a list with relevant parameters, e.g. ['DAPI, cFos, BLA, BLA_cFos']
+    '''    
+    # Make an empty table with rows = all regions in current slice, columns = param_list
+    df = pd.DataFrame(np.nan, index=data.index, columns=param_list)
+    
+    # Determine which channels are counted:
+    channels = data.columns 
+        
+    # Fill the dataframe
+    #if 'Num C' not in channels and 'Num B' not in channels:  # 1 channel analysis (cFos only)
+    if 'BLA' not in param_list and 'NRe' not in param_list:
+        df['DAPI'] = data['Num Detections']
+        df['cFos'] = data['Num A'] 
+        df['area'] = data['Area um^2'] / 1e6
+    #elif 'Num C' not in channels and 'Num B' in channels:    # 2 channel analysis (cFos+Re) with channel B --> NRe
+    elif 'NRe' in param_list and 'BLA' not in param_list:
+        df['DAPI'] = data['Num Detections']
+        df['cFos'] = data['Num A'] + data['Num AB']
+        df['NRe'] = data['Num B'] + data['Num AB']
+        df['NRe_cFos'] = data['Num AB']
+        df['area'] = data['Area um^2'] / 1e6
+    #elif 'Num C' in channels and 'Num B' not in channels:    # 2 channel analysis (cFos+BLA) with channel C --> BLA
+    elif 'NRe' not in  param_list and 'BLA' in param_list:
+        df['DAPI'] = data['Num Detections']
+        df['cFos'] = data['Num A'] + data['Num AC']
+        df['BLA'] = data['Num C'] + data['Num AC']
+        df['BLA_cFos'] = data['Num AC']
+        df['area'] = data['Area um^2'] / 1e6
+    #elif 'Num C' in channels and 'Num B' in channels:        # 3 channel analysis (cFos+BLA+Re) with channel B --> Re and channel C --> BLA
+    elif 'NRe' in param_list and 'BLA' in param_list:
+        df['DAPI'] = data['Num Detections']
+        df['cFos'] = data['Num A'] + data['Num AC'] + data['Num AB']
+        df['BLA'] = data['Num C'] + data['Num AC']
+        df['BLA_cFos'] = data['Num AC']
+        df['NRe'] = data['Num B'] + data['Num AB']
+        df['NRe_cFos'] = data['Num AB']
+        df['area'] = data['Area um^2'] / 1e6
+    
+    # Filter the regions that have no detections:
+    df = df[df['DAPI']>0]
+
+    return df
+
+#%%
+@profiled('sum_hemispheres', count=rows_of('df'))
+def sum_hemispheres(df, curr_regs, index=None):
+    '''
+    This function sums up the hemispheres of all regions in the dataframe, 
+    but only if there are multiple hemispheres for that region.
+    If a region has a left and/or right hemisphere, those are used, otherwise the region itself.
+    Raises a ValueError for rows of regions in curr_regs with another hemisphere (e.g. 'IL6 middle').
+    
+    Input: df = dataframe with all cell counts of a slice, curr_regs = a list with the regions present in the slice,
+    index = a RegionIndex (optional; it remembers the region names it has split before).
+    Output: hem_df = a dataframe with hemispheres summed.
+    '''
+    if index is None:
+        index = RegionIndex({})
+    subregions, hemispheres, regions = index.parse(df.index)
+
+    # Position of the region of every row in curr_regs
+    group = pd.Index(curr_regs).get_indexer(regions)
+    index.check_hemispheres(df.index, hemispheres, group >= 0)
+    keep = index.hemisphere_rows(np.zeros(len(df), dtype=int), group, hemispheres) & (group >= 0)
+    # As floats: the columns of a file without rows are not numbers, and would be left out of the sum
+    sums = df.iloc[keep].astype(float).groupby(group[keep]).sum()
+
+    hem_df = pd.DataFrame(np.nan, index=curr_regs, columns=df.columns)
+    hem_df.iloc[sums.index.to_numpy()] = sums.to_numpy(dtype=float)
+    return hem_df
+
+#%%
+def list_csv_files(root):
+    '''
+    This function makes a list of all files in the folder 'root', sorted on the digits in the file name
+    (so that the slices of one mouse are in order, e.g. 14025_01.csv, 14025_02.csv, ...).
+    '''
+    file_list = os.listdir(root)
+    # A file '.DS_store' might appear in your list. Remove it:
+    if '.DS_Store' in file_list:
+        file_list.remove('.DS_Store')
+    # Sort the file list
+    file_list.sort(key=lambda f: int(''.join(filter(str.isdigit, f))))
+    return file_list
+
+#%%
+@profiled('import_files', count=count_imported)
+def import_files(root, combine, param_list, n_threads=DEFAULT_IO_THREADS, progress=True):
+    """
+    This function imports .csv files in the folder specified by 'root', and stores the relevant values into a dictionary called 'mice_dict'.
+    Inputs:
+        root: path to the folder where all .csv files are located.
+        combine: a dictionary with whole regions as keys and a list of subregions as values.
+        param_list: list of measured parameters for each region, e.g. ['DAPI','cFos','BLA','area','BLA_cFos'].
+        n_threads: number of threads that read the next files while a file is parsed (see prefetch.py). 1: no threads.
+        progress: if False, the number of files read so far is not shown.
+    Output:
+        mice_dict: a dictionary with all cell counts.
+    """
+    
+    # Make a sorted list of all files in root
+    file_list = list_csv_files(root)
+    
+    # Check the headers of all files first, so that missing columns are found before anything is parsed
+    validate_csv_files(root, file_list, param_list, n_threads)
+    
+    # Find the mice that have a file in 'root'
+    curr_mouse_list = find_current_mice(file_list)
+    
+    # Initialize mice_dict
+    m_dict = init_dict(curr_mouse_list)
+
+    # Codes of the subregions and whole regions in 'combine' (see region_index.py)
+    index = RegionIndex(combine)
+    
+    # Shows the number of files read so far (on one line)
+    counter = Progress(len(file_list), 'Importing .csv files', quiet=not progress)
+    
+    # Loop through csv files in folder (the next files are read ahead in other threads):
+    for file, text in prefetch_files(root, file_list, n_threads):
+        counter.update()
+        mouse_name = file.split('_')[0]
+        
+        # load data
+        with profile_step('read_csv'):
+            data = pd.read_csv(io.StringIO(text), index_col = "Name", delimiter=',')
+        
+        # store raw data in a temporary dataframe
+        temp_df = csv_to_dataframe(data, param_list)
+        
+        # Find the regions and whole regions present in the current slice
+        [curr_regs, curr_whole_regs] = find_regs_in_current_slice(temp_df, index)
+        
+        # sum hemispheres
+        hem_df = sum_hemispheres(temp_df, curr_regs, index)
+    
+        # Make an empty table with rows = whole regions in current slice, columns = param_list
+        df = pd.DataFrame(np.nan, index=curr_whole_regs, columns=param_list)
+        
+        # To fill df (=dataframe), subregions are summed
+        with profile_step('sum_subregions'):
+            for curr_whole_reg, curr_subregs in curr_whole_regs.items():
+                sum_regs = hem_df.loc[curr_subregs]
+                df.loc[curr_whole_reg] = sum_regs.sum(axis=0)
+    
+        m_dict[mouse_name].append(df)
+
+    return m_dict
+
+#%%
+@profiled('read_raw_counts', count=count_raw_counts)
+def read_raw_counts(root, file_list, n_threads=DEFAULT_IO_THREADS, columns=COUNT_COLUMNS, progress=False):
+    '''
+    This function reads all .csv files in file_list (located in the folder 'root') into one long dataframe.
+    The rows are indexed by (file, Name), where 'file' is the position of the file in file_list
+    and 'Name' is the region name in the .csv file (e.g. 'IL6 left').
+
+    Instead of calling pd.read_csv once per file, the files are glued together (with the file position
+    as an extra first column) and parsed with a single pd.read_csv call for each distinct header.
+    The files are read in n_threads threads (see prefetch.py); with n_threads=1, they are read one by one.
+    Only the columns in 'columns' (that are in the file) are parsed, with the types in COLUMN_DTYPES (see csv_schema.py);
+    with columns=None, all columns are parsed.
+    If progress is True, the number of files read so far is shown (see Progress in profiling.py).
+    '''
+    counter = Progress(len(file_list), 'Reading .csv files', quiet=not progress)
+    # Group the bodies of the files by header (the columns can differ between QuPath versions)
+    bodies = {}
+    for pos, (file, text) in enumerate(prefetch_files(root, file_list, n_threads)):
+        counter.update()
+        header, _, body = text.partition('\n')
+        body = body.rstrip('\n')
+        if body:
+            prefix = str(pos) + ','
+            bodies.setdefault(header, []).append(prefix + body.replace('\n', '\n' + prefix))
+        else:
+            bodies.setdefault(header, [])
+
+    frames = []
+    for header, chunks in bodies.items():
+        if len(chunks) == 0:
+            continue
+        text = '_file,' + header + '\n' + '\n'.join(chunks)
+        usecols = None if columns is None else ['_file', 'Name'] + [c for c in columns if c in parse_header(header)]
+        data = pd.read_csv(io.StringIO(text), index_col = ['_file', 'Name'], delimiter=',', usecols=usecols,
+                           dtype=COLUMN_DTYPES if columns is not None else None)
+        frames.append(data)
+
+    if len(frames) == 0:
+        return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=['file', 'Name']))
+    raw = pd.concat(frames, sort=False)
+    raw.index = raw.index.set_names(['file', 'Name'])
+    # Put the rows back in the order of file_list (keeping the order of the rows within each file)
+    order = np.argsort(raw.index.get_level_values('file').to_numpy(), kind='stable')
+    return raw.iloc[order]
+
+def make_slice_table(raw, file_list, combine, param_list):
+    '''
+    This function converts raw counts of all slices (the output of read_raw_counts) into one tidy table
+    with one row per whole region per slice. It does the same as the loop in import_files
+    (csv_to_dataframe, sum_hemispheres and summing subregions into whole regions),
+    but with a single groupby over all slices at once.
+
+    Output: a dataframe with columns mouse, slice, file, region and the parameters in param_list.
+    'slice' is the number of the slice of that mouse (1, 2, ...), 'file' the position of the file in file_list.
+    Within a slice, the rows are in the order of the whole regions in 'combine'.
+    '''
+    # Convert counts to number of detected cells and filter the regions that have no detections:
+    counts = csv_to_dataframe(raw, param_list)
+    return combine_regions(counts, file_list, combine, param_list)
+
+@profiled('combine_regions', count=rows_of('counts'))
+def combine_regions(counts, file_list, combine, param_list):
+    '''
+    This function does the second half of make_slice_table: it sums hemispheres and subregions of
+    counts (= csv_to_dataframe applied to the output of read_raw_counts) for all slices at once.
+    Use it directly to combine the same counts in several ways without calling csv_to_dataframe again.
+    '''
+    index = as_region_index(combine)
+    file_idx = counts.index.get_level_values('file').to_numpy()
+    names = counts.index.get_level_values('Name')
+
+    # Check if the regions in the csv files are valid
+    subregions, hemispheres, regions = index.parse(names)
+    for i in np.flatnonzero(subregions < 0):
+        print('WARNING: csv file {f} contains invalid region {r}!'.format(f=file_list[file_idx[i]], r=names[i]))
+
+    # Sum hemispheres and subregions of all slices (see RegionIndex.combine_rows)
+    files, wholes, values = index.combine_rows(file_idx, names, counts[param_list].to_numpy(dtype=float))
+    table = pd.DataFrame(values, columns=param_list)
+    table.insert(0, 'region', np.array(index.whole_regs, dtype=object)[wholes])
+    table.insert(0, 'file', files)
+
+    # Add mouse names and slice numbers
+    table = number_slices(table, file_list)
+
+    return table[['mouse', 'slice', 'file', 'region'] + list(param_list)]
+
+def number_slices(table, file_list):
+    '''
+    This function (re)sets the columns 'mouse' and 'slice' of a slice table from the column 'file'
+    (the position of the file in file_list). Slices are numbered 1, 2, ... for each mouse.
+    '''
+    mice = np.array([file.split('_')[0] for file in file_list], dtype=object)
+    slice_numbers = pd.Series(mice, dtype=object).groupby(mice).cumcount().to_numpy() + 1
+    file_pos = table['file'].to_numpy(dtype=int)
+    table = table.copy()
+    table['mouse'] = mice[file_pos]
+    table['slice'] = slice_numbers[file_pos]
+    return table
+
+def table_to_dict(table, file_list, param_list):
+    '''
+    This function converts a tidy slice table (the output of make_slice_table) into a mouse dictionary,
+    with the same layout as the output of import_files (one dataframe per slice for each mouse).
+    Slices without any whole region get an empty dataframe, just like in import_files.
+    '''
+    m_dict = init_dict(find_current_mice(file_list))
+
+    values = table[param_list].to_numpy(dtype=float)
+    regions = table['region'].to_numpy(dtype=object)
+    file_pos = table['file'].to_numpy(dtype=int)
+
+    # The table is sorted by file, so the rows of each file are contiguous
+    starts = np.searchsorted(file_pos, np.arange(len(file_list)), side='left')
+    stops = np.searchsorted(file_pos, np.arange(len(file_list)), side='right')
+
+    for i, file in enumerate(file_list):
+        mouse_name = file.split('_')[0]
+        if stops[i] > starts[i]:
+            df = pd.DataFrame(values[starts[i]:stops[i]], index=list(regions[starts[i]:stops[i]]), columns=param_list)
+        else:
+            df = pd.DataFrame(np.nan, index=[], columns=param_list)
+        m_dict[mouse_name].append(df)
+
+    return m_dict
+
+@profiled('import_files_batched', count=count_imported)
+def import_files_batched(root, combine, param_list, n_threads=DEFAULT_IO_THREADS):
+    '''
+    This function does the same as import_files, but reads all .csv files into one long table
+    and sums hemispheres and subregions for all slices at once.
+    This is much faster for folders with many .csv files.
+    n_threads: number of threads that read the files (see prefetch.py).
+    Output: m_dict, with the same layout as the output of import_files.
+    '''
+    file_list = list_csv_files(root)
+    validate_csv_files(root, file_list, param_list, n_threads)
+    raw = read_raw_counts(root, file_list, n_threads, required_columns(param_list))
+    table = make_slice_table(raw, file_list, combine, param_list)
+    return table_to_dict(table, file_list, param_list)
+
+def import_chunk(root, file_chunk, combine, param_list):
+    '''
+    This function reads a chunk of .csv files and returns their slice table (see make_slice_table).
+    It is run in a worker process by import_files_parallel.
+    '''
+    raw = read_raw_counts(root, file_chunk, columns=required_columns(param_list))
+    return make_slice_table(raw, file_chunk, combine, param_list)
+
+@profiled('import_files_parallel', count=count_imported)
+def import_files_parallel(root, combine, param_list, n_workers=None, chunk_size=None):
+    '''
+    This function does the same as import_files_batched, but parses the .csv files in n_workers processes.
+    The files are split in chunks of chunk_size files (in the sorted order of list_csv_files),
+    and the results are put back together in that same order, so m_dict is identical to the serial result.
+    Inputs:
+        n_workers: number of worker processes (default: the number of CPUs). With 1 worker, no processes are started.
+        chunk_size: number of files per chunk (default: enough chunks to give every worker about 4 chunks).
+    Output: m_dict, with the same layout as the output of import_files.
+
+    Note: on Windows and macOS, worker processes re-import the main script,
+    so call this function from within an "if __name__ == '__main__':" block.
+    '''
+    file_list = list_csv_files(root)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if n_workers <= 1 or len(file_list) == 0:
+        return import_files_batched(root, combine, param_list)
+    validate_csv_files(root, file_list, param_list)
+    if chunk_size is None:
+        chunk_size = max(1, int(np.ceil(len(file_list) / (4 * n_workers))))
+
+    starts = range(0, len(file_list), chunk_size)
+    chunks = [file_list[start:start + chunk_size] for start in starts]
+
+    # executor.map returns the results in the order of the chunks
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        tables = list(executor.map(import_chunk, [root] * len(chunks), chunks,
+                                   [combine] * len(chunks), [param_list] * len(chunks)))
+
+    # Make the file positions relative to the full file list, and renumber the slices
+    for start, table in zip(starts, tables):
+        table['file'] = table['file'] + start
+    table = pd.concat(tables, ignore_index=True)
+    table = number_slices(table, file_list)
+
+    return table_to_dict(table, file_list, param_list)
+
+#%%
+@profiled('calculate_ratio', count=count_ratio_input)
+def calculate_ratio(num, den, m_dict, full_mouse_list, whole_regs, thres):
+    '''
+    This function calculates the average ratio between num (=numerator) and den (=denominator), so ratio = num/den.
+    The average is taken over all brain slices in which a brain region appears and which have den above a threshold thres.
+    The SEM (variance) is calculated and outputted.
+    '''
+    # Create empty dataframes for ratios and SEMs.
+    ratio_df = pd.DataFrame(np.nan, index=whole_regs, columns=full_mouse_list)
+    SEM_df =  pd.DataFrame(np.nan, index=whole_regs, columns=full_mouse_list)
+    
+    for mouse, df_list in m_dict.items():
+        if len(df_list) != 0:
+            # Combine slices into a single dataframe
+            temp_df = pd.concat([df[[num, den]] for df in df_list])
+            # Filter the slices where den is smaller than the threshold
+            temp_df = temp_df[temp_df[den] > thres]
+
+            # Fill a dataframe with the ratios
+            ratios = pd.DataFrame(np.nan, index=temp_df.index, columns=['ratio'])
+            ratios['ratio'] = temp_df[num] / temp_df[den]
+
+            # Take the mean ratio of the slices for each region, and calculate the SEM.
+            grouped_ratios = ratios.groupby(ratios.index)
+            means = grouped_ratios.mean()
+            SEM = grouped_ratios.std(ddof=0) / len(df_list)
+            
+            # Store ratios and SEMs in the large dataframe
+            for region in ratios.index:
+                ratio_df.at[region, mouse] = means.loc[region]
+                SEM_df.at[region, mouse] = SEM.loc[region]
+    
+    return ratio_df, SEM_df
+
+#%%
+def calculate_chance_ratio(df, tracer):
+    '''
+    Calculates chance ratio of one slice (dataframe) and stores it in a dataframe 'ratios'.
+    '''
+    doublepos = tracer + '_cFos'
+    ratios = pd.DataFrame(np.nan, index=df.index, columns=['ratio'])
+    ratios['ratio'] = (df[doublepos] / df['DAPI']) / ((df['cFos']*df[tracer]) / (df['DAPI']**2))
+    return ratios
+    
+@profiled('get_chance_ratio', count=count_ratio_input)
+def get_chance_ratio(tracer, m_dict, full_mouse_list, whole_regs, thres):
+    '''
+    This function calculates the average chance ratio of the 'tracer'. 
+    Example: if the tracer is 'BLA', the chance_ratio = ([BLA_cFos]/[DAPI]) / ([cFos]*[BLA])/([DAPI]^2).
+    
+    The average is taken over all brain slices in which a brain region appears and which have tracer count above a threshold thres.
+    The SEM (variance) is calculated and outputted.
+    '''
+    doublepos = tracer + '_cFos'
+
+    # Create empty dataframes for ratios and SEMs.
+    chance_df = pd.DataFrame(np.nan, index=whole_regs, columns=full_mouse_list)
+    SEM_df =  pd.DataFrame(np.nan, index=whole_regs, columns=full_mouse_list)
+
+    for mouse, df_list in m_dict.items():
+        if len(df_list) != 0:
+            # Combine slices into a single dataframe
+            temp_df = pd.concat([df[[tracer, doublepos, 'cFos', 'DAPI']] for df in df_list])
+            # Filter the slices where the tracer count is smaller than the threshold
+            df = temp_df[temp_df[tracer] >= thres]
+            
+            # Calculate the chance ratios
+            chance = calculate_chance_ratio(df, tracer)
+
+            # Take the mean chance of the slices for each region, and calculate the SEM.
+            grouped_chance = chance.groupby(chance.index)
+            means = grouped_chance.mean()
+            SEM = grouped_chance.std(ddof=0) / len(df_list)
+
+            # Store ratios and SEMs in the large dataframe
+            for region in means.index:
+                chance_df.at[region, mouse] = means.loc[region]
+                SEM_df.at[region, mouse] = SEM.loc[region]
+
+    return chance_df, SEM_df
+#%%  
+@profiled('write_results_to_csv', count=count_results)
+def write_results_to_csv(output_directory, output_file, title, recall, extinction, control, tracer,
+                         chance_df, chance_SEM_df, 
+                         cFos_ratio_df, cFos_SEM_df, 
+                         Doublepos_ratio_df, Doublepos_SEM_df):
+    '''
+    Writes results to an output .csv file.
+    '''  
+    if not os.path.isdir(output_directory):
+        os.mkdir(output_directory)
+      
+    output_file = os.path.join(output_directory, output_file)
+    
+    if os.path.isfile(output_file):
+        print('WARNING: Output file "{f}" already existed and is overwritten.'.format(f=output_file))
+    
+    # Everything is written into a buffer first, so that the file is opened only once
+    buffer = io.StringIO()
+    wr = csv.writer(buffer, quoting=csv.QUOTE_ALL, delimiter=',')
+    wr.writerow([title])
+    wr.writerow('\n')
+    wr.writerow(['Recall:']+recall)
+    wr.writerow(['Extinction:']+extinction)
+    wr.writerow(['Control:']+control)
+
+    sections = [(' {i} chance ratio '.format(i=tracer), chance_df),
+                (' {i} chance ratio SEM '.format(i=tracer), chance_SEM_df),
+                (' cFos ratio ', cFos_ratio_df),
+                (' cFos ratio SEM ', cFos_SEM_df),
+                (' {i}_cFos/{i} (doublepos) ratio '.format(i=tracer), Doublepos_ratio_df),
+                (' {i}_cFos/{i} (doublepos) SEM '.format(i=tracer), Doublepos_SEM_df)]
+    for header, df in sections:
+        buffer.write('\n' + header + '\n')
+        df.to_csv(buffer)
+
+    with open(output_file, 'w', newline='') as f:
+        f.write(buffer.getvalue())
+#%%
+@profiled('output_raw_numbers', count=count_raw_numbers)
+def output_raw_numbers(output_directory, m_dict, tracer, region_name):
+    '''
+    Outputs raw numbers (the numbers used for caclulating the chance ratio).
+    '''
+    
+    if not os.path.isdir(output_directory):
+        os.mkdir(output_directory)
+    
+    raw_number_directory = os.path.join(output_directory, 'Raw_numbers'+'_'+region_name+'_'+tracer)
+    
+    if os.path.isdir(raw_number_directory):
+        shutil.rmtree(raw_number_directory)
+        print('WARNING: directory "{d}" already existed and is overwritten'.format(d=raw_number_directory))
+        
+    os.mkdir(raw_number_directory)
+    
+    for mouse, df_list in m_dict.items():
+        file_name = os.path.join(raw_number_directory, mouse + '.csv')
+        write_raw_numbers(file_name, mouse, df_list)
+
+def write_raw_numbers(file_name, mouse, df_list):
+    '''
+    Writes the raw numbers of one mouse (df_list = one dataframe per slice) to the file file_name.
+    '''
+    buffer = io.StringIO()
+    wr = csv.writer(buffer, quoting=csv.QUOTE_ALL, delimiter=',')
+    wr.writerow([mouse])
+    wr.writerow('\n')
+
+    s = 0
+    for df in df_list:
+        s = s + 1
+        df = df.drop(columns='area')
+        buffer.write('\n slice {i} \n'.format(i=s))
+        df.to_csv(buffer, header=True)
+
+    with open(file_name, 'w', newline='') as f:
+        f.write(buffer.getvalue())
+    
+    
+    
\ No newline at end of file
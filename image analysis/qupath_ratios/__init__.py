@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The functions behind CSV_reader.py: importing the QuPath .csv files, the cFos, double-positive and chance ratios,
+and writing the outputs. Import the modules themselves, e.g.
+    from qupath_ratios.slice_store import import_files_compact
+    from qupath_ratios.ratio_engine import calculate_ratio_vectorized
+Nothing is imported here, so that the command line interface (cli.py) starts without importing pandas.
+"""
@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+'python -m qupath_ratios' does the same as the command 'qupath-ratios' (see cli.py).
+"""
+
+import sys
+
+from .cli import main
+
+if __name__ == '__main__':
+    sys.exit(main())
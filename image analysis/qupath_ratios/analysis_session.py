@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A long-lived analysis session, for running many analyses in one Python process (a notebook, a service, or
+'qupath-ratios serve'), without reading the .csv files and converting the counts again for every analysis.
+
+An AnalysisSession keeps, for every folder with .csv files ('root'):
+    - the raw counts of all files (see multi_analysis.read_counts; the on-disk cache of slice_cache.py is used too),
+    - the counts of every tracer (the output of csv_to_dataframe),
+    - the results of analyse_counts and the CohortQuery (see ratio_query.py) of every (tracer, combine).
+Before the counts of a folder are used, the list of files and their sizes and modification times are checked
+(this is only os.stat, no file is read). When something changed, the folder is read again (only the changed
+files are parsed, see slice_cache.py) and everything that was kept for that folder is forgotten.
+
+Example:
+    session = AnalysisSession()
+    result = session.analyse(root, 'BLA', combine, extinction + control, 4)     # reads the folder
+    result = session.analyse(root, 'BLA', combine, extinction + control, 5)     # only computes the ratios
+    IL = session.query(root, 'BLA', combine, {'extinction': extinction}).regions('IL').ratio('chance')
+    session.run_experiment(experiment, combines)     # an experiment of a batch_runner.py config file
+"""
+
+import os
+
+from .default_paths import DEFAULT_CACHE_DIR
+from .multi_analysis import make_param_list, analyse_counts, analyse_read_counts, read_counts
+from .QuPath import list_csv_files, csv_to_dataframe, combine_regions
+from .csv_schema import required_columns
+from .ratio_query import CohortQuery
+from .slice_cache import file_stats
+from .slice_store import SliceStore
+
+#%%
+def combine_key(combine):
+    '''
+    Returns a key for a 'combine' dictionary, that can be used in a dictionary (in the order of the whole regions).
+    '''
+    return tuple((region, tuple(subregs)) for region, subregs in combine.items())
+
+class AnalysisSession:
+    '''
+    Keeps the counts and results of folders in memory. See the description at the top of this file.
+    Inputs:
+        cache_dir: folder of the cache (see slice_cache.py). If None, the cache is not used.
+        check_files: if False, the files of a folder are not checked again once the folder was read.
+    '''
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, check_files=True):
+        self.cache_dir = cache_dir
+        self.check_files = check_files
+        self.folders = {}   # root -> dictionary with the file stats, raw counts, file list and everything computed
+        self.n_reads = 0    # number of times a folder was read
+
+    def folder(self, root):
+        '''
+        Returns what is kept for root, after reading the folder if it is new or if its files changed.
+        '''
+        folder = self.folders.get(root)
+        if folder is not None and not self.check_files:
+            return folder
+        stats = None
+        if self.check_files:
+            stats = file_stats(root, list_csv_files(root), 'mtime')
+            if folder is not None and folder['stats'].equals(stats):
+                return folder
+
+        raw, file_list = read_counts(root, self.cache_dir)
+        self.n_reads += 1
+        folder = {'stats': stats, 'raw': raw, 'file_list': file_list,
+                  'counts': {},       # tracer -> output of csv_to_dataframe
+                  'results': {},      # (tracer, combine, mice, thres) -> output of analyse_counts
+                  'queries': {}}      # (tracer, combine) -> CohortQuery
+        self.folders[root] = folder
+        return folder
+
+    def forget(self, root=None):
+        '''
+        Forgets everything that was kept for root (for all folders if root is None).
+        '''
+        if root is None:
+            self.folders.clear()
+        else:
+            self.folders.pop(root, None)
+
+    #%%
+    def counts(self, root):
+        '''
+        Returns the raw counts of all .csv files in root and the list of files (like multi_analysis.read_counts).
+        '''
+        folder = self.folder(root)
+        return folder['raw'], folder['file_list']
+
+    def tracer_counts(self, root, tracer):
+        '''
+        Returns the counts of root converted to cell numbers for a tracer (the output of csv_to_dataframe).
+        '''
+        folder = self.folder(root)
+        if tracer not in folder['counts']:
+            param_list = make_param_list(tracer)
+            missing = [c for c in required_columns(param_list) if c not in folder['raw'].columns]
+            if len(missing) != 0:
+                raise ValueError('The .csv files in "{r}" have no columns {c} (needed for tracer {t}).'.format(r=root, c=missing, t=tracer))
+            folder['counts'][tracer] = csv_to_dataframe(folder['raw'], param_list)
+        return folder['counts'][tracer]
+
+    def analyse(self, root, tracer, combine, full_mouse_list, thres):
+        '''
+        Returns the output of analyse_counts (the counts in a SliceStore, under the key 'm_dict', and all ratio
+        dataframes) for the .csv files in root. The results are kept, so asking again costs nothing.
+        '''
+        key = (tracer, combine_key(combine), tuple(full_mouse_list), thres)
+        counts = self.tracer_counts(root, tracer)
+        folder = self.folders[root]
+        if key not in folder['results']:
+            folder['results'][key] = analyse_counts(counts, folder['file_list'], tracer, combine, full_mouse_list, thres)
+        return folder['results'][key]
+
+    def query(self, root, tracer, combine, groups=None):
+        '''
+        Returns cohort.query() for the counts of root (see ratio_query.py). The CohortQuery is kept, so later
+        queries on the same (tracer, combine) reuse everything it computed. groups are added to the groups of the
+        CohortQuery (e.g. {'extinction': extinction}).
+        '''
+        key = (tracer, combine_key(combine))
+        counts = self.tracer_counts(root, tracer)
+        folder = self.folders[root]
+        if key not in folder['queries']:
+            param_list = make_param_list(tracer)
+            table = combine_regions(counts, folder['file_list'], combine, param_list)
+            store = SliceStore.from_table(table, folder['file_list'], param_list, list(combine.keys()))
+            folder['queries'][key] = CohortQuery(store, None, tracer)
+        folder['queries'][key].groups.update(groups or {})
+        return folder['queries'][key].query()
+
+    #%%
+    def run_experiment(self, experiment, combines):
+        '''
+        Runs one experiment of a batch_runner.py config file (a dictionary with all settings, see load_config),
+        and writes its outputs like CSV_reader.py. Returns the names of the results files that were written.
+        '''
+        root = experiment['root']
+        raw, file_list = self.counts(root)
+        experiment_combines = {name: combines[name] for name in experiment['regions']}
+        analyse_read_counts(raw, file_list, root, experiment['tracers'], experiment_combines, experiment['experiment'],
+                            experiment['output_directory'], experiment['recall'], experiment['extinction'],
+                            experiment['control'], experiment['threshold'], self.folders[root]['counts'])
+        output_files = []
+        for region_name in experiment['regions']:
+            for tracer in experiment['tracers']:
+                output_file = experiment['experiment'] + '_results_' + region_name + '_' + tracer + '.csv'
+                output_files.append(os.path.join(experiment['output_directory'], output_file))
+        return output_files
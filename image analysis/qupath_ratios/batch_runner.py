@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runs the analysis of CSV_reader.py for many experiments at once, from a config file instead of editing CSV_reader.py.
+
+The config file is a .json file with named 'combine' dictionaries, default settings, and a list of experiments.
+Each experiment has a folder with .csv files ('root'), the groups of mice, and the tracers and 'combine' dictionaries
+(by name, under 'regions') to analyse. Settings that are not given for an experiment are taken from 'defaults'.
+Relative paths are relative to the folder of the config file.
+
+Example (see 'example data/batch_config.json'):
+{
+  "combines": {"mPFC": {"IL": ["IL23", "IL5", "IL6"], "PL": ["PL23", "PL5", "PL6"], "AC": ["AC23", "AC5", "AC6"]}},
+  "defaults": {"output_directory": "ratios in mPFC", "threshold": 4, "tracers": ["BLA"], "regions": ["mPFC"]},
+  "experiments": [
+    {"experiment": "WT48", "root": "cell counts in mPFC", "recall": [],
+     "extinction": ["14031", "14032", "14033", "14034", "14035", "14036"],
+     "control": ["14025", "14026", "14027", "14028", "14029", "14030"]}
+  ]
+}
+
+Every experiment writes one results file and one raw numbers folder per (region, tracer), with the same names as
+CSV_reader.py (e.g. WT48_results_mPFC_BLA.csv). The config is checked completely before anything is run.
+The experiments are grouped by folder: the .csv files of a folder are read once (see multi_analysis.read_counts),
+and all experiments on that folder share the counts. The folders are divided over a pool of worker processes.
+
+Usage: python -m qupath_ratios.batch_runner config.json [--workers 4] [--check]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# pandas is only imported when an experiment is run (see run_root), so that checking a config file is fast
+from .default_paths import DEFAULT_CACHE_DIR
+
+TRACERS = ['BLA', 'NRe']
+DEFAULTS = {'recall': [], 'extinction': [], 'control': [], 'threshold': 4, 'output_directory': '.',
+            'cache_dir': DEFAULT_CACHE_DIR}
+
+#%%
+def load_config(file_name):
+    '''
+    Reads a config file (see the description at the top of this file).
+    Output: the named 'combine' dictionaries, and the list of experiments (every experiment is a dictionary with
+    all settings, and with absolute paths).
+    '''
+    with open(file_name, encoding='utf-8') as f:
+        config = json.load(f)
+    folder = os.path.dirname(os.path.abspath(file_name))
+
+    combines = config.get('combines', {})
+    defaults = dict(DEFAULTS)
+    defaults.update(config.get('defaults', {}))
+
+    experiments = [make_experiment(settings, defaults, folder) for settings in config.get('experiments', [])]
+    return combines, experiments
+
+def make_experiment(settings, defaults, folder):
+    '''
+    Returns the settings of one experiment, with the defaults for the settings that are not given,
+    and with the paths relative to folder made absolute.
+    '''
+    experiment = dict(defaults)
+    experiment.update(settings)
+    for key in ['root', 'output_directory', 'cache_dir']:
+        if isinstance(experiment.get(key), str):
+            experiment[key] = os.path.join(folder, os.path.expanduser(experiment[key]))
+    return experiment
+
+def check_config(combines, experiments):
+    '''
+    Checks the settings of all experiments, without reading any .csv file.
+    Returns a list of errors (empty if everything is fine).
+    '''
+    errors = []
+    for name, combine in combines.items():
+        if not isinstance(combine, dict) or not all(isinstance(subregs, list) for subregs in combine.values()):
+            errors.append('combine "{n}" must be a dictionary with a list of subregions for every whole region'.format(n=name))
+    if len(experiments) == 0:
+        errors.append('the config file has no experiments')
+
+    names = set()
+    raw_numbers = {}
+    for i, experiment in enumerate(experiments):
+        name = experiment.get('experiment', 'experiment {i}'.format(i=i + 1))
+        if 'experiment' not in experiment:
+            errors.append('{n}: no experiment name'.format(n=name))
+        if 'root' not in experiment:
+            errors.append('{n}: no root folder'.format(n=name))
+        elif not os.path.isdir(experiment['root']):
+            errors.append('{n}: root folder "{r}" does not exist'.format(n=name, r=experiment['root']))
+        for tracer in experiment.get('tracers', []):
+            if tracer not in TRACERS:
+                errors.append('{n}: unknown tracer "{t}" (use {a})'.format(n=name, t=tracer, a=' or '.join(TRACERS)))
+        if len(experiment.get('tracers', [])) == 0:
+            errors.append('{n}: no tracers'.format(n=name))
+        for region_name in experiment.get('regions', []):
+            if region_name not in combines:
+                errors.append('{n}: unknown regions "{r}" (not in "combines")'.format(n=name, r=region_name))
+        if len(experiment.get('regions', [])) == 0:
+            errors.append('{n}: no regions'.format(n=name))
+        for group in ['recall', 'extinction', 'control']:
+            if not isinstance(experiment[group], list):
+                errors.append('{n}: "{g}" must be a list of mice'.format(n=name, g=group))
+        if not isinstance(experiment['threshold'], (int, float)):
+            errors.append('{n}: "threshold" must be a number'.format(n=name))
+
+        # Two experiments with the same name and output folder would overwrite each other's files
+        key = (name, experiment['output_directory'])
+        if key in names:
+            errors.append('{n}: there is another experiment with the same name and output directory'.format(n=name))
+        names.add(key)
+
+        # The raw numbers folders are named after the regions and tracer only (like in CSV_reader.py), so
+        # experiments on other folders must not write them into the same output directory
+        for region_name in experiment.get('regions', []):
+            for tracer in experiment.get('tracers', []):
+                key = (experiment['output_directory'], region_name, tracer)
+                if raw_numbers.setdefault(key, experiment.get('root')) != experiment.get('root'):
+                    errors.append('{n}: another experiment on another root folder writes Raw_numbers_{r}_{t} '
+                                  'into the same output directory'.format(n=name, r=region_name, t=tracer))
+    return errors
+
+def check_config_file(file_name):
+    '''
+    Checks a config file, and prints the errors. Returns 1 if there are errors, otherwise 0.
+    '''
+    combines, experiments = load_config(file_name)
+    errors = check_config(combines, experiments)
+    for error in errors:
+        print('ERROR: ' + error)
+    if len(errors) == 0:
+        print('{n} experiments in {r} folders, no errors.'.format(n=len(experiments), r=len(group_by_root(experiments))))
+    return 1 if len(errors) else 0
+
+def group_by_root(experiments):
+    '''
+    Groups the experiments by folder, in the order of the config file.
+    The cache folder of the first experiment of a folder is used for the whole folder.
+    '''
+    groups = {}
+    for experiment in experiments:
+        groups.setdefault(experiment['root'], []).append(experiment)
+    return {(root, group[0]['cache_dir']): group for root, group in groups.items()}
+
+#%%
+def run_root(root, cache_dir, experiments, combines):
+    '''
+    Reads the .csv files in root once, and runs all experiments on them (in one AnalysisSession).
+    Returns the names of the results files that were written.
+    '''
+    from .analysis_session import AnalysisSession
+
+    session = AnalysisSession(cache_dir, check_files=False)
+    output_files = []
+    for experiment in experiments:
+        output_files.extend(session.run_experiment(experiment, combines))
+    return output_files
+
+def run_batch(config_file, n_workers=None):
+    '''
+    Runs all experiments of a config file, with one folder per task in n_workers processes
+    (default: the number of CPUs, but not more than the number of folders). With 1 worker, no processes are started.
+    Returns the names of the results files that were written.
+    '''
+    combines, experiments = load_config(config_file)
+    errors = check_config(combines, experiments)
+    if len(errors) != 0:
+        raise ValueError('Errors in config file "{f}":\n'.format(f=config_file) + '\n'.join(errors))
+
+    groups = group_by_root(experiments)
+    # Make the output directories first, so that the workers do not try to make the same directory at the same time
+    for experiment in experiments:
+        os.makedirs(experiment['output_directory'], exist_ok=True)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(groups))
+
+    output_files = []
+    start = time.perf_counter()
+    if n_workers <= 1:
+        for (root, cache_dir), group in groups.items():
+            output_files.extend(run_root(root, cache_dir, group, combines))
+            print('{r}: done ({n} experiments)'.format(r=root, n=len(group)))
+    else:
+        # Note: on Windows and macOS, call run_batch from within an "if __name__ == '__main__':" block.
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(run_root, root, cache_dir, group, combines): (root, len(group))
+                       for (root, cache_dir), group in groups.items()}
+            for future in as_completed(futures):
+                output_files.extend(future.result())
+                print('{r}: done ({n} experiments)'.format(r=futures[future][0], n=futures[future][1]))
+    print('{n} results files written in {t:.1f} s'.format(n=len(output_files), t=time.perf_counter() - start))
+    return output_files
+
+#%%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the analysis of CSV_reader.py for all experiments in a config file.')
+    parser.add_argument('config', help='.json config file')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: the number of CPUs)')
+    parser.add_argument('--check', action='store_true', help='only check the config file')
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(check_config_file(args.config))
+
+    run_batch(args.config, args.workers)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line interface of the analysis of CSV_reader.py (installed as 'qupath-ratios', see pyproject.toml).
+
+Commands:
+    qupath-ratios check config.json                  checks a config file of batch_runner.py (nothing is read or run)
+    qupath-ratios batch config.json [--workers 4]    runs all experiments of a config file (like batch_runner.py)
+    qupath-ratios serve [config.json]                keeps running, and answers analysis requests from stdin
+
+pandas and NumPy are only imported when an analysis is run, so --help and 'check' start at once.
+
+'serve' keeps one AnalysisSession (see analysis_session.py) for all requests, so a folder is only read the first time,
+and again only when its files changed. Every line on stdin is one request: the settings of one experiment as
+a .json dictionary, with the same keys as in a config file. When the config file has an experiment with the same
+name, its settings are used for everything that is not in the request; otherwise the defaults of batch_runner.py.
+A request can also have named 'combine' dictionaries under 'combines'. Relative paths in requests are relative
+to the current folder; the cache folder is that of the session (--cache-dir). Every request is answered with one line of .json on stdout, e.g.
+    {"experiment": "WT48", "threshold": 5}
+    -> {"ok": true, "output_files": ["/.../WT48_results_mPFC_BLA.csv"], "seconds": 0.05, "folder_reads": 1}
+or {"ok": false, "error": "..."} when the request has errors. Other output of the analysis goes to stderr.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+from .batch_runner import load_config, make_experiment, check_config, check_config_file, run_batch, DEFAULTS
+from .default_paths import DEFAULT_CACHE_DIR
+
+#%%
+def answer(session, request, combines, experiments):
+    '''
+    Runs one request of 'serve' in session. Returns the answer (a dictionary).
+    combines and experiments are those of the config file (empty if there is none).
+    '''
+    if not isinstance(request, dict):
+        return {'ok': False, 'error': 'a request must be a dictionary with the settings of an experiment'}
+    request = dict(request)
+    combines = dict(combines, **request.pop('combines', {}))
+    known = [experiment for experiment in experiments if experiment['experiment'] == request.get('experiment')]
+    experiment = make_experiment(request, known[0] if len(known) else DEFAULTS, os.getcwd())
+    errors = check_config(combines, [experiment])
+    if len(errors) != 0:
+        return {'ok': False, 'error': '\n'.join(errors)}
+
+    start = time.perf_counter()
+    os.makedirs(experiment['output_directory'], exist_ok=True)
+    output_files = session.run_experiment(experiment, combines)
+    return {'ok': True, 'output_files': output_files, 'seconds': round(time.perf_counter() - start, 3),
+            'folder_reads': session.n_reads}
+
+def serve(config_file=None, cache_dir=DEFAULT_CACHE_DIR, requests=sys.stdin, answers=sys.stdout):
+    '''
+    Answers requests (one .json dictionary per line) until the end of requests, in one AnalysisSession.
+    See the description at the top of this file. Returns the exit code.
+    '''
+    if config_file is None:
+        combines, experiments = {}, []
+    else:
+        combines, experiments = load_config(config_file)
+    from .analysis_session import AnalysisSession
+    session = AnalysisSession(cache_dir)
+
+    for line in requests:
+        if line.strip() == '':
+            continue
+        try:
+            # The answers are the only output on stdout, so that they can be read by another program
+            with contextlib.redirect_stdout(sys.stderr):
+                result = answer(session, json.loads(line), combines, experiments)
+        except Exception as error:
+            result = {'ok': False, 'error': '{t}: {e}'.format(t=type(error).__name__, e=error)}
+        answers.write(json.dumps(result) + '\n')
+        answers.flush()
+    return 0
+
+#%%
+def main(argv=None):
+    '''
+    Runs the command line interface (see the description at the top of this file). Returns the exit code.
+    '''
+    parser = argparse.ArgumentParser(prog='qupath-ratios',
+                                     description='cFos, double-positive and chance ratios from QuPath .csv files.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('check', help='check a config file')
+    command.add_argument('config', help='.json config file (see batch_runner.py)')
+    command = commands.add_parser('batch', help='run all experiments of a config file')
+    command.add_argument('config', help='.json config file (see batch_runner.py)')
+    command.add_argument('--workers', type=int, help='number of worker processes (default: the number of CPUs)')
+    command = commands.add_parser('serve', help='answer analysis requests from stdin, one .json dictionary per line')
+    command.add_argument('config', nargs='?', help='.json config file with combines and experiments to start from')
+    command.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='folder of the cache of the .csv files')
+    args = parser.parse_args(argv)
+
+    if args.command == 'check':
+        return check_config_file(args.config)
+    if args.command == 'batch':
+        run_batch(args.config, args.workers)
+        return 0
+    return serve(args.config, args.cache_dir)
+
+if __name__ == '__main__':
+    sys.exit(main())
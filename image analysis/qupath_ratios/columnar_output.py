@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Writes the results of CSV_reader.py (all ratios and SEMs, and the raw numbers of all mice) to one columnar file,
+and reads it back.
+
+write_results_to_csv and output_raw_numbers write a results file with six sections and one .csv file per mouse,
+which are easy to read in Excel but awkward to load again in Python. write_results_columnar writes everything
+in one go to a single NumPy .npz file, with two tidy tables:
+- results: one row per (measure, region, mouse), with the columns measure, region, mouse, group and value;
+- raw: one row per region in a slice, with the columns mouse, slice, region and the parameters (e.g. DAPI, cFos, BLA,
+  area, BLA_cFos).
+Every column is stored as one array (names are stored once, with integer codes per row), so the file is small and
+fast to write and read, also on network drives. read_results_columnar loads it back into dataframes.
+
+Example:
+    write_results_columnar(output_directory, experiment + '_results_' + region_name + '_' + tracer + '.npz',
+                           title, recall, extinction, control, tracer,
+                           BLA_chance_df, BLA_chance_SEM_df, cFos_ratio_df, cFos_SEM_df,
+                           Doublepos_ratio_df, Doublepos_SEM_df, m_dict)
+    output = read_results_columnar(file_name)
+    chance_df = results_to_wide(output['results'], 'BLA chance ratio')
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .ratio_engine import as_store
+
+#%%
+def measure_names(tracer):
+    '''
+    Returns the names of the six measures, in the order of the sections of the results file of write_results_to_csv.
+    '''
+    return ['{i} chance ratio'.format(i=tracer), '{i} chance ratio SEM'.format(i=tracer),
+            'cFos ratio', 'cFos ratio SEM',
+            '{i}_cFos/{i} (doublepos) ratio'.format(i=tracer), '{i}_cFos/{i} (doublepos) SEM'.format(i=tracer)]
+
+def encode(values):
+    '''
+    Returns the unique names in values (in order of appearance) and the integer code of every value.
+    '''
+    codes, names = pd.factorize(pd.Index(values, dtype=object).astype(str))
+    return np.array(list(names), dtype=str), codes.astype(np.int32)
+
+def results_columns(dfs, names):
+    '''
+    Stacks the region x mouse dataframes in dfs (one per name in names) into the columns of the tidy results table.
+    '''
+    regions = list(dict.fromkeys(region for df in dfs for region in df.index))
+    mice = list(dict.fromkeys(mouse for df in dfs for mouse in df.columns))
+    measure, region, mouse, value = [], [], [], []
+    for m, df in enumerate(dfs):
+        region_codes = pd.Index(regions).get_indexer(df.index)
+        mouse_codes = pd.Index(mice).get_indexer(df.columns)
+        # Rows are regions and columns are mice, so the values are stacked region by region
+        measure.append(np.full(df.size, m, dtype=np.int32))
+        region.append(np.repeat(region_codes, df.shape[1]).astype(np.int32))
+        mouse.append(np.tile(mouse_codes, df.shape[0]).astype(np.int32))
+        value.append(df.to_numpy(dtype=float).ravel())
+    return {'measures': np.array(names, dtype=str),
+            'regions': np.array([str(r) for r in regions], dtype=str),
+            'mice': np.array([str(m) for m in mice], dtype=str),
+            'results/measure': np.concatenate(measure),
+            'results/region': np.concatenate(region),
+            'results/mouse': np.concatenate(mouse),
+            'results/value': np.concatenate(value)}
+
+def raw_columns(m_dict):
+    '''
+    Returns the columns of the tidy raw numbers table of m_dict (a mouse dictionary or a SliceStore).
+    '''
+    store = as_store(m_dict)
+    columns = {'raw_mice': np.array([str(m) for m in store.mice], dtype=str),
+               'raw_regions': np.array([str(r) for r in store.regions], dtype=str),
+               'raw_params': np.array(store.param_list, dtype=str),
+               'raw_n_slices': np.asarray(store.n_slices, dtype=np.int32),
+               'raw/mouse': np.asarray(store.mouse_codes, dtype=np.int32),
+               'raw/slice': np.asarray(store.slice_ids, dtype=np.int32),
+               'raw/region': np.asarray(store.region_codes, dtype=np.int32)}
+    for param in store.param_list:
+        columns['raw/' + param] = store.columns[param]
+    return columns
+
+#%%
+def write_results_columnar(output_directory, output_file, title, recall, extinction, control, tracer,
+                           chance_df, chance_SEM_df,
+                           cFos_ratio_df, cFos_SEM_df,
+                           Doublepos_ratio_df, Doublepos_SEM_df, m_dict=None):
+    '''
+    Writes the results (the same inputs as write_results_to_csv) and, if m_dict is given, the raw numbers of all mice
+    to one .npz file (see the description at the top of this file).
+    '''
+    if not os.path.isdir(output_directory):
+        os.mkdir(output_directory)
+
+    output_file = os.path.join(output_directory, output_file)
+    if not output_file.endswith('.npz'):
+        output_file = output_file + '.npz'
+
+    if os.path.isfile(output_file):
+        print('WARNING: Output file "{f}" already existed and is overwritten.'.format(f=output_file))
+
+    dfs = [chance_df, chance_SEM_df, cFos_ratio_df, cFos_SEM_df, Doublepos_ratio_df, Doublepos_SEM_df]
+    columns = results_columns(dfs, measure_names(tracer))
+    columns.update({'title': np.array(title, dtype=str), 'tracer': np.array(tracer, dtype=str),
+                    'recall': np.array(recall, dtype=str), 'extinction': np.array(extinction, dtype=str),
+                    'control': np.array(control, dtype=str)})
+    if m_dict is not None:
+        columns.update(raw_columns(m_dict))
+
+    with open(output_file, 'wb') as f:
+        np.savez(f, **columns)
+    return output_file
+
+def read_results_columnar(file_name):
+    '''
+    Reads a file written by write_results_columnar.
+    Output: a dictionary with the title, the tracer, the lists recall, extinction and control,
+    'results' (the tidy results table) and 'raw' (the tidy raw numbers table, or None if they were not written).
+    '''
+    with np.load(file_name, allow_pickle=False) as data:
+        output = {'title': str(data['title']), 'tracer': str(data['tracer']),
+                  'recall': list(data['recall']), 'extinction': list(data['extinction']),
+                  'control': list(data['control'])}
+
+        mice = data['mice']
+        groups = {}
+        for group in ['recall', 'extinction', 'control']:
+            groups.update({mouse: group for mouse in output[group]})
+        results = pd.DataFrame({
+            'measure': pd.Categorical.from_codes(data['results/measure'], categories=data['measures']),
+            'region': pd.Categorical.from_codes(data['results/region'], categories=data['regions']),
+            'mouse': pd.Categorical.from_codes(data['results/mouse'], categories=mice)})
+        results['group'] = results['mouse'].map(groups).astype(object)
+        results['value'] = data['results/value']
+        output['results'] = results
+
+        output['raw'] = None
+        if 'raw_params' in data.files:
+            raw = pd.DataFrame({
+                'mouse': pd.Categorical.from_codes(data['raw/mouse'], categories=data['raw_mice']),
+                'slice': data['raw/slice'],
+                'region': pd.Categorical.from_codes(data['raw/region'], categories=data['raw_regions'])})
+            for param in data['raw_params']:
+                raw[param] = data['raw/' + param]
+            output['raw'] = raw
+            output['n_slices'] = dict(zip(data['raw_mice'], data['raw_n_slices']))
+    return output
+
+def results_to_wide(results, measure):
+    '''
+    Returns one measure of the tidy results table as a region x mouse dataframe (like the sections of the results file).
+    '''
+    part = results[results['measure'] == measure]
+    regions = list(dict.fromkeys(part['region']))
+    mice = list(dict.fromkeys(part['mouse']))
+    wide = part.pivot(index='region', columns='mouse', values='value')
+    wide = wide.reindex(index=regions, columns=mice)
+    wide.index.name = None
+    wide.columns = list(wide.columns)
+    return wide
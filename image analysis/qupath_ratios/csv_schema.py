@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The columns of the QuPath .csv files, and a quick check of a folder before it is imported.
+
+csv_to_dataframe uses param_list (the tracer) to decide which columns it needs, not the columns in the files.
+When a folder does not have the columns of the tracer (e.g. a cFos+BLA analysis with tracer = 'NRe'), this only
+showed up as a KeyError after the files were parsed. The functions in this file read only the first line (the header)
+of every file, in a few threads (see prefetch.py), and find the layout of every file: which channels were counted.
+
+Layouts (see the .groovy script; A = cFos, B = NRe, C = BLA):
+    'cFos':          Num A
+    'cFos+NRe':      Num A, Num B, Num AB
+    'cFos+BLA':      Num A, Num C, Num AC
+    'cFos+BLA+NRe':  Num A, Num B, Num C, Num AB, Num AC
+Other classes (e.g. Num ABC, Num BC and Num N, the cells without any marker) are not used by csv_to_dataframe.
+
+read_raw_counts only parses the columns in COUNT_COLUMNS, with the types in COLUMN_DTYPES.
+
+Example:
+    validate_csv_files(root, list_csv_files(root), param_list)     # raises a ValueError if columns are missing
+    check_csv_files(root, list_csv_files(root), param_list)        # a table with the layout of every file
+The cache (see slice_cache.py) keeps the headers of the files, so that only new or changed files are checked again.
+"""
+
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+from .prefetch import map_prefetched, DEFAULT_IO_THREADS
+
+# The columns that csv_to_dataframe can use
+BASE_COLUMNS = ['Num Detections', 'Num A', 'Area um^2']
+TRACER_COLUMNS = {'NRe': ['Num B', 'Num AB'], 'BLA': ['Num C', 'Num AC']}
+COUNT_COLUMNS = ['Num Detections', 'Num A', 'Num AB', 'Num AC', 'Num B', 'Num C', 'Area um^2']
+# Counts are read as floats, so that empty cells do not change the type of a column
+COLUMN_DTYPES = dict({'Name': str}, **{column: np.float64 for column in COUNT_COLUMNS})
+
+#%%
+def required_columns(param_list):
+    '''
+    This function returns the columns of the QuPath .csv files that csv_to_dataframe needs for param_list.
+    '''
+    columns = list(BASE_COLUMNS)
+    for tracer in ['NRe', 'BLA']:
+        if tracer in param_list:
+            columns = columns + TRACER_COLUMNS[tracer]
+    return columns
+
+def parse_header(line):
+    '''
+    Returns the column names in the first line of a .csv file.
+    '''
+    return next(csv.reader([line.rstrip('\r\n')]), [])
+
+def read_header(path):
+    '''
+    Returns the column names of a .csv file, reading only its first line.
+    '''
+    with open(path, encoding='latin1') as f:
+        return parse_header(f.readline())
+
+def classify_layout(columns):
+    '''
+    Returns the layout of a file with these columns ('cFos', 'cFos+NRe', 'cFos+BLA' or 'cFos+BLA+NRe'),
+    or None if the file does not have the columns of a QuPath cell count.
+    '''
+    if 'Name' not in columns or not all(column in columns for column in BASE_COLUMNS):
+        return None
+    tracers = [tracer for tracer in ['BLA', 'NRe'] if all(column in columns for column in TRACER_COLUMNS[tracer])]
+    return '+'.join(['cFos'] + tracers)
+
+#%%
+def read_headers(root, file_list, n_threads=DEFAULT_IO_THREADS):
+    '''
+    Returns a dictionary with the column names of every file in file_list (located in the folder 'root'),
+    reading only the first line of every file, in n_threads threads.
+    '''
+    return dict(zip(file_list, map_prefetched(lambda file: read_header(os.path.join(root, file)), file_list, n_threads)))
+
+def check_headers(headers, param_list):
+    '''
+    Output: a dataframe with, for every file in headers (a dictionary file -> column names), its layout, the columns
+    that param_list needs but the file does not have ('missing'), and the count columns ('Num ...') of the file that
+    are not used ('unused').
+    '''
+    needed = required_columns(param_list)
+    rows = []
+    for file, columns in headers.items():
+        rows.append({'file': file, 'layout': classify_layout(columns),
+                     'missing': [column for column in ['Name'] + needed if column not in columns],
+                     'unused': [column for column in columns if column.startswith('Num ') and column not in COUNT_COLUMNS
+                                and column != 'Num Annotations']})
+    return pd.DataFrame(rows, columns=['file', 'layout', 'missing', 'unused'])
+
+def check_csv_files(root, file_list, param_list, n_threads=DEFAULT_IO_THREADS):
+    '''
+    Reads the header of every file in file_list (located in the folder 'root') in n_threads threads,
+    and returns the output of check_headers.
+    '''
+    return check_headers(read_headers(root, file_list, n_threads), param_list)
+
+def raise_missing_columns(checked, root, param_list):
+    '''
+    Raises a ValueError with the files in checked (the output of check_headers) that do not have the columns
+    that param_list needs (and their layout). Does nothing if all files have them.
+    '''
+    bad = checked[checked['missing'].map(len) > 0]
+    if len(bad) != 0:
+        lines = ['{f} ({l} layout): no columns {c}'.format(f=row.file, l=row.layout or 'unknown', c=', '.join(row.missing))
+                 for row in bad.head(10).itertuples()]
+        if len(bad) > 10:
+            lines.append('... and {n} other files'.format(n=len(bad) - 10))
+        raise ValueError('{n} of the {t} .csv files in "{r}" do not have the columns for {p}:\n'.format(
+                         n=len(bad), t=len(checked), r=root, p=param_list) + '\n'.join(lines))
+
+def validate_csv_files(root, file_list, param_list, n_threads=DEFAULT_IO_THREADS):
+    '''
+    Checks that all files in file_list have the columns that param_list needs, reading only their headers.
+    Raises a ValueError with the files that do not (and their layout), before anything is parsed.
+    Returns the output of check_csv_files.
+    '''
+    checked = check_csv_files(root, file_list, param_list, n_threads)
+    raise_missing_columns(checked, root, param_list)
+    return checked
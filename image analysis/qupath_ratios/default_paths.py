@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Default paths, in a file without imports of pandas or NumPy, so that batch_runner.py and cli.py can check
+a config file (and show --help) without waiting for those imports.
+"""
+
+import os
+
+# Folder of the cache of the .csv files (see slice_cache.py)
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'qupath_csv_reader')
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runs the analysis of CSV_reader.py for several tracers and several 'combine' dictionaries at once.
+
+The .csv files are read only once. For every tracer, the counts are converted to cell numbers (csv_to_dataframe)
+once, and for every 'combine' dictionary the hemispheres and subregions are summed and the ratios are calculated.
+One result set (a results file and a folder with raw numbers, like CSV_reader.py makes) is written per combination.
+
+Example:
+    combines = {'mPFC': {'IL': ['IL23', 'IL5', 'IL6'], 'PL': ['PL23', 'PL5', 'PL6'], 'AC': ['AC23', 'AC5', 'AC6']},
+                'mPFC-layers': {'IL23': ['IL23'], 'IL5': ['IL5'], 'IL6': ['IL6']}}
+    analyse_combinations(root, ['BLA', 'NRe'], combines, 'WT48', output_directory, recall, extinction, control, 4)
+writes WT48_results_mPFC_BLA.csv, WT48_results_mPFC-layers_BLA.csv, etc.
+"""
+
+from .QuPath import (list_csv_files, read_raw_counts, csv_to_dataframe, required_columns, combine_regions,
+                    write_results_to_csv, output_raw_numbers)
+from .ratio_engine import calculate_ratio_vectorized, get_chance_ratio_vectorized
+from .slice_cache import load_raw_counts, DEFAULT_CACHE_DIR
+from .slice_store import SliceStore
+
+#%%
+def make_param_list(tracer):
+    '''
+    Returns the list of parameters for a tracer, e.g. ['DAPI','cFos','BLA','area','BLA_cFos'].
+    '''
+    return ['DAPI', 'cFos', tracer, 'area', tracer + '_cFos']
+
+def analyse_counts(counts, file_list, tracer, combine, full_mouse_list, thres):
+    '''
+    Calculates the cFos ratio, double-positive ratio and chance ratio (with SEMs) for one tracer and one 'combine'.
+    counts is the output of csv_to_dataframe for the param_list of this tracer (see make_param_list).
+    Output: a dictionary with the counts (a SliceStore, under the key 'm_dict') and all ratio dataframes.
+    '''
+    param_list = make_param_list(tracer)
+    whole_regs = list(combine.keys())
+
+    table = combine_regions(counts, file_list, combine, param_list)
+    m_dict = SliceStore.from_table(table, file_list, param_list, whole_regs)
+
+    [cFos_ratio_df, cFos_SEM_df] = calculate_ratio_vectorized('cFos', 'DAPI', m_dict, full_mouse_list, whole_regs, thres)
+    [Doublepos_ratio_df, Doublepos_SEM_df] = calculate_ratio_vectorized(tracer+'_cFos', tracer, m_dict, full_mouse_list, whole_regs, thres)
+    [chance_df, chance_SEM_df] = get_chance_ratio_vectorized(tracer, m_dict, full_mouse_list, whole_regs, thres)
+
+    return {'m_dict': m_dict,
+            'cFos_ratio_df': cFos_ratio_df, 'cFos_SEM_df': cFos_SEM_df,
+            'Doublepos_ratio_df': Doublepos_ratio_df, 'Doublepos_SEM_df': Doublepos_SEM_df,
+            'chance_df': chance_df, 'chance_SEM_df': chance_SEM_df}
+
+#%%
+def analyse_combinations(root, tracers, combines, experiment, output_directory, recall, extinction, control, thres,
+                         cache_dir=DEFAULT_CACHE_DIR):
+    '''
+    Analyses the .csv files in 'root' for every tracer in 'tracers' and every 'combine' dictionary in 'combines'.
+    Inputs:
+        tracers: list of tracers, e.g. ['BLA', 'NRe'].
+        combines: dictionary with a name for each 'combine' dictionary, e.g. {'mPFC': {'IL': [...], ...}, ...}.
+                  The name is used as region_name in the names of the output files.
+        experiment, output_directory, recall, extinction, control: same as in CSV_reader.py.
+        thres: only consider regions where we have more than thres traced cells.
+        cache_dir: folder of the cache (see slice_cache.py). If None, the cache is not used.
+    Output: a dictionary with (tracer, name) as keys and the output of analyse_counts as values.
+    '''
+    # Read all files once
+    raw, file_list = read_counts(root, cache_dir)
+    return analyse_read_counts(raw, file_list, root, tracers, combines, experiment, output_directory,
+                               recall, extinction, control, thres)
+
+def read_counts(root, cache_dir=DEFAULT_CACHE_DIR):
+    '''
+    Reads the counts of all .csv files in 'root' (from the cache, if cache_dir is not None).
+    Output: the raw counts (see read_raw_counts) and the list of files.
+    '''
+    file_list = list_csv_files(root)
+    if cache_dir is None:
+        raw = read_raw_counts(root, file_list)
+    else:
+        raw = load_raw_counts(root, file_list, cache_dir)
+    return raw, file_list
+
+def analyse_read_counts(raw, file_list, root, tracers, combines, experiment, output_directory,
+                        recall, extinction, control, thres, counts_cache=None):
+    '''
+    Does the same as analyse_combinations, with counts that were already read (see read_counts).
+    counts_cache: a dictionary in which the counts of every tracer are kept, so that several experiments
+    with the same files (e.g. with other groups of mice) convert the counts only once. If None, nothing is kept.
+    '''
+    if counts_cache is None:
+        counts_cache = {}
+    full_mouse_list = recall + extinction + control
+    results = {}
+
+    for tracer in tracers:
+        param_list = make_param_list(tracer)
+        missing = [c for c in required_columns(param_list) if c not in raw.columns]
+        if len(missing) != 0:
+            print('WARNING: the .csv files in "{r}" have no columns {c}; tracer {t} is skipped.'.format(r=root, c=missing, t=tracer))
+            continue
+
+        # Convert counts to cell numbers once per tracer
+        if tracer not in counts_cache:
+            counts_cache[tracer] = csv_to_dataframe(raw, param_list)
+        counts = counts_cache[tracer]
+
+        for region_name, combine in combines.items():
+            result = analyse_counts(counts, file_list, tracer, combine, full_mouse_list, thres)
+            results[(tracer, region_name)] = result
+
+            output_file = experiment + '_results_' + region_name + '_' + tracer + '.csv'
+            title = experiment + ' ' + region_name + '->' + tracer
+            write_results_to_csv(output_directory, output_file, title, recall, extinction, control, tracer,
+                                 result['chance_df'], result['chance_SEM_df'],
+                                 result['cFos_ratio_df'], result['cFos_SEM_df'],
+                                 result['Doublepos_ratio_df'], result['Doublepos_SEM_df'])
+            output_raw_numbers(output_directory, result['m_dict'], tracer, region_name)
+
+    return results
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reads files ahead with a few threads, for folders on slow (network) storage.
+
+On a NAS, reading a small .csv file mostly means waiting for the network, so reading the files one after the other
+is slow even though the computer has nothing to do. prefetch_files reads the next files in n_threads threads while
+the current file is being parsed, and returns the files in the order of file_list, so the results are the same as
+when reading them one by one. At most max_ahead files are read ahead, so the memory used stays small
+whatever the number of files. With n_threads=1 (or 0, or None), the files are read one by one, without threads.
+
+The same is done for any function of a file (e.g. os.stat) with map_prefetched.
+
+Example:
+    for file, text in prefetch_files(root, file_list, n_threads=8):
+        data = pd.read_csv(io.StringIO(text), ...)
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_IO_THREADS = 8
+
+#%%
+def map_prefetched(function, items, n_threads=DEFAULT_IO_THREADS, max_ahead=None):
+    '''
+    Yields function(item) for every item in items, in the order of items, computed in n_threads threads
+    with at most max_ahead results ready or being computed (default: 4 per thread).
+    An error in function is raised when its result is next, like in a normal loop.
+    '''
+    if n_threads is None or n_threads <= 1:
+        for item in items:
+            yield function(item)
+        return
+    if max_ahead is None:
+        max_ahead = 4 * n_threads
+
+    items = iter(items)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=n_threads)
+    try:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= max_ahead:
+                break
+        while pending:
+            result = pending.popleft().result()
+            # Keep max_ahead reads going
+            for item in items:
+                pending.append(executor.submit(function, item))
+                break
+            yield result
+    finally:
+        # Also when the loop over the results is stopped early: do not start the reads that are still waiting
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+def read_text(path, encoding='latin1'):
+    '''
+    Returns the content of a text file.
+    '''
+    with open(path, encoding=encoding) as f:
+        return f.read()
+
+def prefetch_files(root, file_list, n_threads=DEFAULT_IO_THREADS, max_ahead=None, encoding='latin1'):
+    '''
+    Yields (file, text) for every file in file_list (located in the folder 'root'), in the order of file_list,
+    reading the next files in n_threads threads (see map_prefetched).
+    '''
+    texts = map_prefetched(lambda file: read_text(os.path.join(root, file), encoding), file_list, n_threads, max_ahead)
+    return zip(file_list, texts)
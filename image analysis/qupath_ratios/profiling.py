@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt-in timing of the stages of CSV_reader.py (importing, ratios, writing outputs).
+
+Nothing is measured unless profiling is switched on. While it is on, every stage (a function of QuPath.py,
+ratio_engine.py or slice_store.py that is marked with @profiled, or a block in a 'with profile_step(...)')
+records its wall time, the number of files and rows it processed and the peak memory, and the run report
+can be written to a .json file. Stages inside other stages are named 'outer/inner', e.g. 'import_files/read_csv'.
+
+Example:
+    with profile_run('run_report.json') as profile:
+        m_dict = import_files(root, combine, param_list)
+        [cFos_ratio_df, cFos_SEM_df] = calculate_ratio('cFos', 'DAPI', m_dict, full_mouse_list, whole_regs, 4)
+    profile.print_summary()
+
+Peak memory: 'max_rss_bytes' is the peak memory of the whole Python process so far (not available on Windows).
+With trace_memory=True, 'peak_traced_bytes' is the peak memory allocated by Python during the stage (tracemalloc),
+which is more precise but makes the run a few times slower.
+"""
+
+import contextlib
+import functools
+import inspect
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+# The profile that is recording (None if profiling is off)
+_active = None
+
+#%%
+def max_rss_bytes():
+    '''
+    Returns the peak memory of this process in bytes (None if it is not available).
+    '''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+class RunProfile:
+    '''
+    The measurements of one run: one entry per stage name (calls of the same stage are added up).
+    '''
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.started_tracing = False    # True if tracemalloc was started for this profile (and not by the caller)
+        self.stages = {}
+        self.stack = []
+        self.peaks = []     # peak traced memory so far of the stages in self.stack
+        self.started = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.start_time = time.perf_counter()
+        self.total_seconds = None
+
+    def stage_name(self, name):
+        return '/'.join(self.stack + [name])
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''
+        Measures the block inside the 'with'. Yields a dictionary in which the block can set 'files' and 'rows'.
+        '''
+        full_name = self.stage_name(name)
+        counts = {}
+        if self.trace_memory:
+            # Remember the peak of the outer stage before the peak is reset for this stage
+            if len(self.peaks):
+                self.peaks[-1] = max(self.peaks[-1], tracemalloc.get_traced_memory()[1])
+            self.peaks.append(0)
+            tracemalloc.reset_peak()
+        self.stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - start
+            self.stack.pop()
+            peak = None
+            if self.trace_memory:
+                peak = max(self.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if len(self.peaks):
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+            self.add(full_name, seconds, counts.get('files'), counts.get('rows'), peak)
+
+    def add(self, name, seconds, files=None, rows=None, peak=None):
+        '''
+        Adds one call of a stage.
+        '''
+        entry = self.stages.setdefault(name, {'stage': name, 'calls': 0, 'seconds': 0.0, 'files': None, 'rows': None,
+                                              'peak_traced_bytes': None, 'max_rss_bytes': None})
+        entry['calls'] = entry['calls'] + 1
+        entry['seconds'] = entry['seconds'] + seconds
+        if files is not None:
+            entry['files'] = (entry['files'] or 0) + files
+        if rows is not None:
+            entry['rows'] = (entry['rows'] or 0) + rows
+        if peak is not None:
+            entry['peak_traced_bytes'] = max(entry['peak_traced_bytes'] or 0, peak)
+        entry['max_rss_bytes'] = max_rss_bytes()
+
+    #%%
+    def report(self):
+        '''
+        Returns the report of the run as a dictionary (this is what write_report writes to the .json file).
+        '''
+        stages = []
+        for entry in self.stages.values():
+            entry = dict(entry)
+            seconds = entry['seconds']
+            entry['files_per_second'] = entry['files'] / seconds if entry['files'] is not None and seconds > 0 else None
+            entry['rows_per_second'] = entry['rows'] / seconds if entry['rows'] is not None and seconds > 0 else None
+            stages.append(entry)
+        total = self.total_seconds if self.total_seconds is not None else time.perf_counter() - self.start_time
+        return {'started': self.started, 'total_seconds': total,
+                'python': platform.python_version(), 'platform': platform.platform(),
+                'max_rss_bytes': max_rss_bytes(), 'stages': stages}
+
+    def write_report(self, file_name):
+        '''
+        Writes the report of the run to a .json file.
+        '''
+        with open(file_name, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def print_summary(self):
+        '''
+        Prints one line per stage, with its time, files/s and rows/s.
+        '''
+        report = self.report()
+        print('{s:<55} {c:>6} {t:>10} {f:>10} {r:>12}'.format(s='stage', c='calls', t='seconds', f='files/s', r='rows/s'))
+        for entry in report['stages']:
+            files = '' if entry['files_per_second'] is None else '{:.1f}'.format(entry['files_per_second'])
+            rows = '' if entry['rows_per_second'] is None else '{:.0f}'.format(entry['rows_per_second'])
+            print('{s:<55} {c:>6} {t:>10.4f} {f:>10} {r:>12}'.format(s=entry['stage'], c=entry['calls'],
+                                                                    t=entry['seconds'], f=files, r=rows))
+        print('total: {t:.3f} s'.format(t=report['total_seconds']))
+
+#%%
+def start_profiling(trace_memory=False):
+    '''
+    Switches profiling on and returns the new RunProfile.
+    '''
+    global _active
+    _active = RunProfile(trace_memory)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _active.started_tracing = True
+    return _active
+
+def stop_profiling(report_file=None):
+    '''
+    Switches profiling off, writes the report to report_file (if given) and returns the RunProfile.
+    '''
+    global _active
+    profile = _active
+    _active = None
+    if profile is not None:
+        profile.total_seconds = time.perf_counter() - profile.start_time
+        # Memory tracing that was already on before start_profiling stays on
+        if profile.started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if report_file is not None:
+            profile.write_report(report_file)
+    return profile
+
+@contextlib.contextmanager
+def profile_run(report_file=None, trace_memory=False):
+    '''
+    Profiles the block inside the 'with' (see the example at the top of this file).
+    '''
+    profile = start_profiling(trace_memory)
+    try:
+        yield profile
+    finally:
+        stop_profiling(report_file)
+
+@contextlib.contextmanager
+def profile_step(name):
+    '''
+    Measures a block as a stage if profiling is on, and does nothing otherwise.
+    Yields a dictionary in which 'files' and 'rows' can be set (it is not used if profiling is off).
+    '''
+    if _active is None:
+        yield {}
+    else:
+        with _active.stage(name) as counts:
+            yield counts
+
+def profiled(name, count=None):
+    '''
+    Decorator that measures every call of a function as the stage 'name' if profiling is on.
+    count(result, arguments) can return a dictionary with the number of 'files' and 'rows' of the call
+    (arguments is a dictionary with the arguments of the call, by name).
+    '''
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return function(*args, **kwargs)
+            with _active.stage(name) as counts:
+                result = function(*args, **kwargs)
+                if count is not None:
+                    arguments = signature.bind(*args, **kwargs).arguments
+                    counts.update(count(result, arguments))
+            return result
+        return wrapper
+    return decorator
+
+#%% Counts for the stages of CSV_reader.py
+def count_m_dict(m_dict):
+    '''
+    Returns the number of slices ('files') and rows (regions in a slice) of a mouse dictionary or a SliceStore.
+    '''
+    if hasattr(m_dict, 'n_slices'):
+        return {'files': int(sum(m_dict.n_slices)), 'rows': len(m_dict.mouse_codes)}
+    return {'files': sum(len(df_list) for df_list in m_dict.values()),
+            'rows': sum(len(df) for df_list in m_dict.values() for df in df_list)}
+
+def count_imported(m_dict, arguments):
+    '''
+    Counts the slices and rows of the mouse dictionary (or SliceStore) returned by an import function.
+    '''
+    return count_m_dict(m_dict)
+
+def count_ratio_input(result, arguments):
+    '''
+    Counts the slices and rows of the argument m_dict of a ratio function.
+    '''
+    return count_m_dict(arguments['m_dict'])
+
+def count_raw_counts(raw, arguments):
+    '''
+    Counts the files that were read (the argument file_list) and the rows of the raw counts.
+    '''
+    return {'files': len(arguments['file_list']), 'rows': len(raw)}
+
+def rows_of(argument):
+    '''
+    Returns a count function that counts the rows of the argument with this name.
+    '''
+    return lambda result, arguments: {'rows': len(arguments[argument])}
+
+def count_results(result, arguments):
+    '''
+    Counts one output file, and the rows of all dataframes that are written to it.
+    '''
+    dfs = [value for value in arguments.values() if hasattr(value, 'size') and hasattr(value, 'columns')]
+    return {'files': 1, 'rows': sum(len(df) for df in dfs)}
+
+def count_raw_numbers(result, arguments):
+    '''
+    Counts one output file per mouse of the argument m_dict, and all its rows.
+    '''
+    counts = count_m_dict(arguments['m_dict'])
+    return {'files': len(arguments['m_dict']), 'rows': counts['rows']}
+
+#%%
+class Progress:
+    '''
+    A quiet progress counter that rewrites one line ('Importing: 12/48') instead of printing a line per file.
+    The line is rewritten at most every 'interval' seconds, and nothing is printed if quiet is True.
+    '''
+    def __init__(self, total, label, quiet=False, interval=0.5):
+        self.total = total
+        self.label = label
+        self.quiet = quiet
+        self.interval = interval
+        self.done = 0
+        self.last_print = 0
+
+    def update(self, n=1):
+        self.done = self.done + n
+        if self.quiet:
+            return
+        now = time.perf_counter()
+        if now - self.last_print >= self.interval or self.done >= self.total:
+            self.last_print = now
+            end = '\n' if self.done >= self.total else ''
+            print('\r{l}: {d}/{t}'.format(l=self.label, d=self.done, t=self.total), end=end, flush=True)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vectorized versions of calculate_ratio and get_chance_ratio (in QuPath.py).
+
+calculate_ratio and get_chance_ratio loop over mice, concatenate the slices of every mouse, group them per mouse
+and write the results into the output dataframes one cell at a time. The functions in this file compute the ratios
+of all slices of all mice at once, take the mean and SEM for every (mouse, region) pair in a single groupby,
+and put the results into the region x mouse dataframes in one step.
+They take the same inputs and give the same outputs as the functions in QuPath.py.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .profiling import profiled, count_ratio_input
+from .slice_store import SliceStore
+
+#%%
+def as_store(m_dict):
+    '''
+    Returns m_dict as a SliceStore (m_dict can be a mouse dictionary or already a SliceStore).
+    '''
+    if isinstance(m_dict, SliceStore):
+        return m_dict
+    return SliceStore.from_dict(m_dict)
+
+def column(store, param):
+    '''
+    Returns the column 'param' of the store as floats.
+    '''
+    return store.columns[param].astype(float)
+
+def warn_left_out(names, what, list_name):
+    '''
+    Prints a warning with the mice or regions (names) that have ratios but are left out of the output.
+    '''
+    if len(names) != 0:
+        print('WARNING: {w} {n} have slices but are not in {l}, so they are left out of the ratios!'.format(
+              w=what, n=', '.join(str(name) for name in names), l=list_name))
+
+def grouped_mean_sem(values, keep, store, full_mouse_list, whole_regs):
+    '''
+    Takes the mean and SEM of 'values' (one value per row of the store) for every (mouse, region) pair,
+    using only the rows where keep is True.
+    Like in calculate_ratio, the SEM is the standard deviation (ddof=0) divided by the number of slices of the mouse.
+
+    Output: two dataframes (means and SEMs) with whole_regs as rows and full_mouse_list as columns.
+    Mice and regions that are not in full_mouse_list or whole_regs are left out, with a warning.
+    '''
+    mouse_codes = store.mouse_codes[keep]
+    region_codes = store.region_codes[keep]
+    grouped = pd.Series(values[keep]).groupby([mouse_codes, region_codes], sort=True)
+    means = grouped.mean()
+    stds = grouped.std(ddof=0)
+
+    group_mice = means.index.get_level_values(0).to_numpy()
+    group_regions = means.index.get_level_values(1).to_numpy()
+    sems = stds.to_numpy() / store.n_slices[group_mice]
+
+    # Position of every store region/mouse in the output (-1 if it is not in whole_regs/full_mouse_list)
+    region_pos = pd.Index(whole_regs).get_indexer(store.regions)[group_regions]
+    mouse_pos = pd.Index(full_mouse_list).get_indexer(store.mice)[group_mice]
+    found = (region_pos >= 0) & (mouse_pos >= 0)
+    warn_left_out([store.mice[m] for m in np.unique(group_mice[mouse_pos < 0])], 'mice', 'full_mouse_list')
+    warn_left_out([store.regions[r] for r in np.unique(group_regions[region_pos < 0])], 'regions', 'whole_regs')
+
+    mean_values = np.full((len(whole_regs), len(full_mouse_list)), np.nan)
+    sem_values = np.full((len(whole_regs), len(full_mouse_list)), np.nan)
+    mean_values[region_pos[found], mouse_pos[found]] = means.to_numpy()[found]
+    sem_values[region_pos[found], mouse_pos[found]] = sems[found]
+
+    return (pd.DataFrame(mean_values, index=whole_regs, columns=full_mouse_list),
+            pd.DataFrame(sem_values, index=whole_regs, columns=full_mouse_list))
+
+#%%
+@profiled('calculate_ratio_vectorized', count=count_ratio_input)
+def calculate_ratio_vectorized(num, den, m_dict, full_mouse_list, whole_regs, thres):
+    '''
+    Does the same as calculate_ratio, for all mice at once.
+    The average ratio num/den is taken over all slices in which a region appears and which have den above thres.
+    '''
+    store = as_store(m_dict)
+    num_values = column(store, num)
+    den_values = column(store, den)
+    keep = den_values > thres
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = num_values / den_values
+    return grouped_mean_sem(ratios, keep, store, full_mouse_list, whole_regs)
+
+@profiled('get_chance_ratio_vectorized', count=count_ratio_input)
+def get_chance_ratio_vectorized(tracer, m_dict, full_mouse_list, whole_regs, thres):
+    '''
+    Does the same as get_chance_ratio, for all mice at once.
+    The average chance ratio is taken over all slices in which a region appears and which have tracer count of at least thres.
+    '''
+    store = as_store(m_dict)
+    chance, keep = chance_ratio_per_slice(store, tracer, thres)
+    return grouped_mean_sem(chance, keep, store, full_mouse_list, whole_regs)
+
+def chance_ratio_per_slice(store, tracer, thres):
+    '''
+    Calculates the chance ratio of every row (region in a slice) of the store, like calculate_chance_ratio.
+    Also returns keep: True for the rows with tracer count of at least thres.
+    '''
+    doublepos = column(store, tracer + '_cFos')
+    DAPI = column(store, 'DAPI')
+    cFos = column(store, 'cFos')
+    traced = column(store, tracer)
+    keep = traced >= thres
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chance = (doublepos / DAPI) / ((cFos*traced) / (DAPI**2))
+    return chance, keep
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lazy queries for the ratios of one region, one group of mice, or a few slices.
+
+CSV_reader.py computes every ratio for every region and mouse. A CohortQuery holds the imported counts
+(a SliceStore or mouse dictionary), and cohort.query() returns a RatioQuery: a description of what is wanted
+(which mice, groups, regions or slices, which ratio, which threshold) that is only computed when the result is asked
+for, with .result() or .table(). Filters return a new query, so queries can be built up step by step:
+
+    cohort = CohortQuery(m_dict, groups={'extinction': extinction, 'control': control}, tracer='BLA')
+    IL_chance = cohort.query().group('extinction').regions('IL').ratio('chance').threshold(4)
+    [ratio_df, SEM_df] = IL_chance.result()
+    [ratio_df, SEM_df] = IL_chance.threshold(5).result()
+
+Only the rows of the asked (mouse, region) pairs are used. The per-row ratios of every ratio type, and the mean and
+standard deviation of every (mouse, region) pair for every threshold, are kept by the CohortQuery, so asking again
+(e.g. for other thresholds, like traced_cell_thresh_single_region and traced_cell_thresh_VMT, or for other mice)
+only computes what was not computed before. query.sweep(thresholds) computes a query for a whole list of thresholds
+in one pass (see threshold_sweep.py).
+
+Ratio types (like in CSV_reader.py):
+    'cFos':      cFos/DAPI, slices with DAPI above the threshold (calculate_ratio)
+    'doublepos': tracer_cFos/tracer, slices with tracer above the threshold (calculate_ratio)
+    'chance':    the chance ratio, slices with tracer at least the threshold (get_chance_ratio)
+    (num, den):  any ratio num/den, slices with den above the threshold
+The results are the same as those of calculate_ratio and get_chance_ratio. The SEM is divided by the number of slices
+of the mouse, or, when slices are selected with .slices(), by the number of selected slices of the mouse.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .ratio_engine import as_store, column, chance_ratio_per_slice
+from .threshold_sweep import sweep_aggregates, sweep_frames
+
+#%%
+class CohortQuery:
+    '''
+    The counts of a cohort, with the memory of everything that was computed. See the description at the top of this file.
+    Inputs:
+        m_dict: a mouse dictionary or a SliceStore.
+        groups: dictionary with a list of mice for every group, e.g. {'extinction': [...], 'control': [...]}.
+        tracer: 'BLA' or 'NRe' (default: the tracer in the parameters of the counts).
+    '''
+    def __init__(self, m_dict, groups=None, tracer=None):
+        self.store = as_store(m_dict)
+        self.groups = dict(groups or {})
+        if tracer is None:
+            tracers = [param[:-len('_cFos')] for param in self.store.param_list if param.endswith('_cFos')]
+            tracer = tracers[0] if len(tracers) else None
+        self.tracer = tracer
+
+        self._rows = None       # rows sorted by (mouse, region, slice), and where each (mouse, region) pair starts
+        self._values = {}       # ratio type -> (ratio, count that is compared with the threshold, strict) per row
+        self._aggregates = {}   # (ratio type, threshold, slices) -> mean, std, count and 'done' per (mouse, region) pair
+
+    def query(self):
+        '''
+        Returns a query for all mice (of the groups, if there are groups), all regions and the chance ratio.
+        '''
+        return RatioQuery(self)
+
+    #%%
+    def pair_rows(self):
+        '''
+        Returns the rows of the store sorted by (mouse, region, slice), and for every (mouse, region) pair
+        (pair = mouse code * number of regions + region code) the first and last+1 position in that order.
+        '''
+        if self._rows is None:
+            store = self.store
+            pairs = store.mouse_codes.astype(np.int64) * len(store.regions) + store.region_codes
+            order = np.lexsort((store.slice_ids, pairs))
+            bounds = np.searchsorted(pairs[order], np.arange(len(store.mice) * len(store.regions) + 1))
+            self._rows = (order, bounds)
+        return self._rows
+
+    def row_values(self, kind):
+        '''
+        Returns the ratio of every row for a ratio type, the count of every row that is compared with the threshold,
+        and whether the comparison is strict (count > threshold) or not (count >= threshold).
+        '''
+        key = kind if isinstance(kind, str) else tuple(kind)
+        if key not in self._values:
+            store = self.store
+            if kind == 'chance':
+                ratio, _ = chance_ratio_per_slice(store, self.tracer, 0)
+                self._values[key] = (ratio, column(store, self.tracer), False)
+            else:
+                num, den = {'cFos': ('cFos', 'DAPI'),
+                            'doublepos': (str(self.tracer) + '_cFos', self.tracer)}.get(kind, kind)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    ratio = column(store, num) / column(store, den)
+                self._values[key] = (ratio, column(store, den), True)
+        return self._values[key]
+
+    def rows_of_pairs(self, pairs, slices=None):
+        '''
+        Returns the rows of the given (mouse, region) pairs (only of the given slices, if slices is not None),
+        and the pair of every row.
+        '''
+        order, bounds = self.pair_rows()
+        starts, stops = bounds[pairs], bounds[pairs + 1]
+        sizes = stops - starts
+        # Each pair is a contiguous block in 'order'
+        positions = np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+        rows = order[positions]
+        pair_of_row = np.repeat(pairs, sizes)
+        if slices is not None:
+            selected = np.isin(self.store.slice_ids[rows], slices)
+            rows, pair_of_row = rows[selected], pair_of_row[selected]
+        return rows, pair_of_row
+
+    def aggregates(self, kind, thres, slices, pairs):
+        '''
+        Returns the mean, standard deviation (ddof=0) and number of used slices of the ratio for the given
+        (mouse, region) pairs, computing only the pairs that were not computed before for this ratio type,
+        threshold and selection of slices.
+        '''
+        key = (kind if isinstance(kind, str) else tuple(kind), thres, slices)
+        if key not in self._aggregates:
+            n_pairs = len(self.store.mice) * len(self.store.regions)
+            self._aggregates[key] = {'mean': np.full(n_pairs, np.nan), 'std': np.full(n_pairs, np.nan),
+                                     'count': np.zeros(n_pairs, dtype=np.int64), 'done': np.zeros(n_pairs, dtype=bool)}
+        memo = self._aggregates[key]
+
+        todo = pairs[~memo['done'][pairs]]
+        if len(todo) != 0:
+            rows, pair_of_row = self.rows_of_pairs(todo, slices)
+            ratio, count, strict = self.row_values(kind)
+            keep = count[rows] > thres if strict else count[rows] >= thres
+            grouped = pd.Series(ratio[rows][keep]).groupby(pair_of_row[keep], sort=True)
+            means = grouped.mean()
+            found = means.index.to_numpy()
+            memo['mean'][found] = means.to_numpy()
+            memo['std'][found] = grouped.std(ddof=0).to_numpy()
+            memo['count'][found] = grouped.size().to_numpy()
+            memo['done'][todo] = True
+        return memo['mean'][pairs], memo['std'][pairs], memo['count'][pairs]
+
+#%%
+class RatioQuery:
+    '''
+    A lazy query: which mice, regions and slices, which ratio and which threshold. Nothing is computed until
+    result() or table() is called. See the description at the top of this file.
+    '''
+    def __init__(self, cohort, mice=None, regions=None, slices=None, kind='chance', thres=4):
+        self.cohort = cohort
+        self._mice = mice
+        self._regions = regions
+        self._slices = slices
+        self.kind = kind
+        self.thres = thres
+
+    def copy(self, **changes):
+        settings = {'mice': self._mice, 'regions': self._regions, 'slices': self._slices,
+                    'kind': self.kind, 'thres': self.thres}
+        settings.update(changes)
+        return RatioQuery(self.cohort, **settings)
+
+    # Filters (each returns a new query)
+    def mice(self, *mice):
+        '''Only these mice (names, or lists of names).'''
+        return self.copy(mice=flatten(mice))
+
+    def group(self, *names):
+        '''Only the mice of these groups (in the order of the groups).'''
+        return self.copy(mice=[mouse for name in names for mouse in self.cohort.groups[name]])
+
+    def regions(self, *regions):
+        '''Only these whole regions (names, or lists of names).'''
+        return self.copy(regions=flatten(regions))
+
+    def slices(self, *slices):
+        '''Only these slices (slice numbers of each mouse: 1, 2, ...).'''
+        return self.copy(slices=tuple(sorted(set(int(s) for s in flatten(slices)))))
+
+    def ratio(self, kind, den=None):
+        '''The ratio type: 'cFos', 'doublepos', 'chance', or ratio(num, den) for any ratio num/den.'''
+        return self.copy(kind=kind if den is None else (kind, den))
+
+    def threshold(self, thres):
+        '''Only the slices with more (or, for the chance ratio, at least) thres cells.'''
+        return self.copy(thres=thres)
+
+    #%%
+    def selected_mice(self):
+        if self._mice is not None:
+            return list(self._mice)
+        if len(self.cohort.groups):
+            return [mouse for mice in self.cohort.groups.values() for mouse in mice]
+        return list(self.cohort.store.mice)
+
+    def selected_regions(self):
+        return list(self._regions) if self._regions is not None else list(self.cohort.store.regions)
+
+    def selected_pairs(self):
+        '''
+        Returns the selected mice and regions, the store codes of the mice, and which (region, mouse) combinations
+        are in the store ('found', regions x mice) with their pair codes.
+        A mouse or region that is selected twice (e.g. a mouse in two groups) is only used once, at its first place.
+        '''
+        store = self.cohort.store
+        mice, regions = list(dict.fromkeys(self.selected_mice())), list(dict.fromkeys(self.selected_regions()))
+        mouse_codes = pd.Index(store.mice).get_indexer(mice)
+        region_codes = pd.Index(store.regions).get_indexer(regions)
+        found = (region_codes[:, np.newaxis] >= 0) & (mouse_codes[np.newaxis, :] >= 0)
+        pairs = (mouse_codes[np.newaxis, :] * len(store.regions) + region_codes[:, np.newaxis])[found]
+        return mice, regions, mouse_codes, found, pairs
+
+    def slice_counts(self, mouse_codes):
+        '''
+        Returns the number of slices of every mouse (or the number of selected slices), to divide the SEM by.
+        '''
+        store = self.cohort.store
+        n_slices = np.full(len(mouse_codes), np.nan)
+        known = mouse_codes >= 0
+        if self._slices is None:
+            n_slices[known] = store.n_slices[mouse_codes[known]]
+        else:
+            n_slices[known] = [np.sum(np.isin(self._slices, np.arange(1, n + 1))) for n in store.n_slices[mouse_codes[known]]]
+        return n_slices
+
+    def compute(self):
+        '''
+        Computes the query. Returns the selected mice and regions and the mean, standard deviation, number of used
+        slices and SEM as arrays (regions x mice).
+        '''
+        mice, regions, mouse_codes, found, pairs = self.selected_pairs()
+        shape = (len(regions), len(mice))
+        mean, std, count = np.full(shape, np.nan), np.full(shape, np.nan), np.zeros(shape, dtype=np.int64)
+        mean[found], std[found], count[found] = self.cohort.aggregates(self.kind, self.thres, self._slices, pairs)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sem = std / self.slice_counts(mouse_codes)[np.newaxis, :]
+        return mice, regions, mean, std, count, sem
+
+    def result(self):
+        '''
+        Returns two dataframes (ratios and SEMs) with the regions as rows and the mice as columns,
+        like calculate_ratio and get_chance_ratio.
+        '''
+        mice, regions, mean, std, count, sem = self.compute()
+        return (pd.DataFrame(mean, index=regions, columns=mice),
+                pd.DataFrame(sem, index=regions, columns=mice))
+
+    def table(self):
+        '''
+        Returns a tidy dataframe with one row per (mouse, region), with the group, the ratio, its SEM
+        and the number of slices that were used.
+        '''
+        mice, regions, mean, std, count, sem = self.compute()
+        group_of = {mouse: name for name, group in self.cohort.groups.items() for mouse in group}
+        return pd.DataFrame({'mouse': np.tile(mice, len(regions)),
+                             'group': [group_of.get(mouse) for mouse in np.tile(mice, len(regions))],
+                             'region': np.repeat(regions, len(mice)),
+                             'ratio': mean.ravel(), 'SEM': sem.ravel(), 'n_slices_used': count.ravel()})
+
+    def sweep(self, thresholds):
+        '''
+        Computes the query for every threshold in thresholds in one pass (see threshold_sweep.py); the threshold
+        of the query itself is not used. Returns two dataframes (ratios and SEMs) with a (threshold, region) index
+        and the mice as columns. The results are not memoized.
+        '''
+        mice, regions, mouse_codes, found, pairs = self.selected_pairs()
+        rows, pair_of_row = self.cohort.rows_of_pairs(pairs, self._slices)
+        ratio, count, strict = self.cohort.row_values(self.kind)
+
+        # Number the selected pairs 0 ... len(pairs)-1, in the (region, mouse) order of 'found'
+        local = np.empty(len(self.cohort.store.mice) * len(self.cohort.store.regions), dtype=np.int64)
+        local[pairs] = np.arange(len(pairs))
+        mean, std, n_used = sweep_aggregates(ratio[rows], count[rows], strict, local[pair_of_row], len(pairs), thresholds)
+
+        # Pairs without any row are NaN (and not 0), like in result()
+        pair_regions, pair_mice = np.nonzero(found)
+        has_rows = np.bincount(local[pair_of_row], minlength=len(pairs)) > 0
+        pair_regions[~has_rows] = -1
+        return sweep_frames(mean, std, pair_regions, pair_mice, self.slice_counts(mouse_codes), regions, mice, thresholds)
+
+def flatten(items):
+    '''
+    Flattens arguments like ('IL', 'PL') or (['IL', 'PL'],) into a list.
+    '''
+    flat = []
+    for item in items:
+        if isinstance(item, (list, tuple, set, np.ndarray, pd.Index)):
+            flat.extend(item)
+        else:
+            flat.append(item)
+    return flat
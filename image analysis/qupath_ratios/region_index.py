@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A region index, made once from a 'combine' dictionary, that translates the region names of the QuPath .csv files
+(e.g. 'IL6 left', 'Re') to integer codes.
+
+find_regs_in_current_slice and sum_hemispheres used to split every region name and look for region+' left' and
+region+' right' in the index of every slice. A RegionIndex knows the code of every subregion and the whole regions
+it belongs to, and remembers the names it has already split, so all rows of one slice (or of all slices at once)
+are translated with a few array operations:
+- subregion code: the position of the subregion in index.subregions (-1 for regions that are not in 'combine');
+- hemisphere code: NO_HEMISPHERE ('Re'), LEFT ('Re left'), RIGHT ('Re right') or OTHER_HEMISPHERE (any other suffix).
+Rows of regions that are used with any other suffix (e.g. 'Re middle') raise a ValueError when hemispheres are summed.
+
+Example:
+    index = RegionIndex({'NRe': ['Re', 'Xi'], 'MD': ['MD']})
+    index.parse(['Re left', 'MD', 'Xi right', 'CM'])
+    -> subregion codes [0, 2, 1, -1], hemisphere codes [1, 0, 2, 0], regions ['Re', 'MD', 'Xi', 'CM']
+"""
+
+import numpy as np
+import pandas as pd
+
+NO_HEMISPHERE = 0
+LEFT = 1
+RIGHT = 2
+OTHER_HEMISPHERE = 3
+HEMISPHERE_CODES = {'': NO_HEMISPHERE, 'left': LEFT, 'right': RIGHT}
+
+#%%
+class RegionIndex:
+    '''
+    Integer codes for the subregions and whole regions of a 'combine' dictionary. See the description at the top of this file.
+    '''
+    def __init__(self, combine):
+        self.combine = combine
+        self.whole_regs = list(combine.keys())
+        self.subregions = list(dict.fromkeys(subreg for subregs in combine.values() for subreg in subregs))
+        self.subregion_codes = {subreg: i for i, subreg in enumerate(self.subregions)}
+
+        # Every (subregion, whole region) pair of 'combine', in the order of 'combine'.
+        # A subregion can be part of several whole regions (or appear twice in one whole region).
+        self.pair_subregion = np.array([self.subregion_codes[subreg] for subregs in combine.values() for subreg in subregs],
+                                       dtype=np.int64)
+        self.pair_whole = np.array([w for w, subregs in enumerate(combine.values()) for subreg in subregs], dtype=np.int64)
+
+        # Names that were split before: name -> (region, subregion code, hemisphere code)
+        self.names = {}
+
+    def parse_name(self, name):
+        '''
+        Splits one region name (e.g. 'IL6 left') into the region ('IL6'), its subregion code and its hemisphere code.
+        '''
+        if name not in self.names:
+            parts = str(name).split(maxsplit=1)
+            region = parts[0] if len(parts) else ''
+            hemisphere = HEMISPHERE_CODES.get(parts[1] if len(parts) > 1 else '', OTHER_HEMISPHERE)
+            self.names[name] = (region, self.subregion_codes.get(region, -1), hemisphere)
+        return self.names[name]
+
+    def parse(self, names):
+        '''
+        Translates the region names of a slice (or of many slices) into codes.
+        Only the distinct names are split (and only once for every RegionIndex); the rows get their codes with one lookup.
+        Output: subregion codes, hemisphere codes and regions (the names without hemisphere), one per name.
+        '''
+        codes, unique_names = pd.factorize(pd.Index(names, dtype=object))
+        parsed = [self.parse_name(name) for name in unique_names]
+        regions = np.array([p[0] for p in parsed], dtype=object)
+        subregions = np.array([p[1] for p in parsed], dtype=np.int64)
+        hemispheres = np.array([p[2] for p in parsed], dtype=np.int64)
+        return subregions[codes], hemispheres[codes], regions[codes]
+
+    def invalid_names(self, names):
+        '''
+        Returns the names (in order, with doubles) whose region is not one of the subregions in 'combine'.
+        '''
+        subregions, hemispheres, regions = self.parse(names)
+        return [name for name, code in zip(names, subregions) if code < 0]
+
+    def check_hemispheres(self, names, hemispheres, used):
+        '''
+        Raises a ValueError with the names of the used rows (used is True for them) whose hemisphere is not
+        'left', 'right' or nothing, since those rows would not be counted in any hemisphere.
+        '''
+        other = np.flatnonzero((hemispheres == OTHER_HEMISPHERE) & used)
+        if len(other) != 0:
+            unknown = list(dict.fromkeys(str(names[i]) for i in other))
+            raise ValueError('Unknown hemisphere in region names {n} (the region name can only be followed by "left" or "right").'.format(
+                             n=unknown[:10]))
+
+    #%%
+    def hemisphere_rows(self, slice_codes, group_codes, hemispheres):
+        '''
+        Returns True for the rows that are used when hemispheres are summed: if a region has a left and/or right
+        hemisphere in a slice, those rows are used, otherwise the row of the region itself (like in sum_hemispheres).
+        slice_codes and group_codes give the slice and the region (any integer code) of every row.
+        '''
+        lateral = (hemispheres == LEFT) | (hemispheres == RIGHT)
+        if len(lateral) == 0:
+            return lateral
+        group, _ = pd.factorize(pd.MultiIndex.from_arrays([slice_codes, group_codes]))
+        has_lateral = np.bincount(group, weights=lateral, minlength=group.max() + 1) > 0
+        return lateral | ((hemispheres == NO_HEMISPHERE) & ~has_lateral[group])
+
+    def combine_rows(self, slice_codes, names, values):
+        '''
+        Sums hemispheres and subregions into whole regions, for all slices at once.
+        Inputs: the slice code (an integer, e.g. the file position), the region name and the values of every row.
+        Output: slice codes, whole region codes (positions in whole_regs) and summed values,
+        sorted by slice and then in the order of the whole regions in 'combine'.
+        Regions that are not in 'combine' are left out.
+        '''
+        slice_codes = np.asarray(slice_codes, dtype=np.int64)
+        values = np.asarray(values, dtype=float)
+        subregions, hemispheres, regions = self.parse(names)
+        self.check_hemispheres(names, hemispheres, subregions >= 0)
+
+        keep = (subregions >= 0) & self.hemisphere_rows(slice_codes, subregions, hemispheres)
+        if not keep.any():
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, values.shape[1]))
+
+        # Sum hemispheres: one row per (slice, subregion)
+        hem = pd.DataFrame(values[keep]).groupby([slice_codes[keep], subregions[keep]], sort=True).sum()
+        hem_slices = hem.index.get_level_values(0).to_numpy()
+        hem_subregions = hem.index.get_level_values(1).to_numpy()
+
+        # Repeat every (slice, subregion) row once for every whole region the subregion belongs to
+        order = np.argsort(self.pair_subregion, kind='stable')
+        n_pairs = np.bincount(self.pair_subregion, minlength=len(self.subregions))
+        first_pair = np.concatenate([[0], np.cumsum(n_pairs)[:-1]])
+        repeats = n_pairs[hem_subregions]
+        rows = np.repeat(np.arange(len(hem)), repeats)
+        within = np.arange(len(rows)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        pairs = order[first_pair[hem_subregions][rows] + within]
+
+        # Sum subregions into whole regions (the whole region codes follow the order of 'combine')
+        whole = pd.DataFrame(hem.to_numpy()[rows]).groupby([hem_slices[rows], self.pair_whole[pairs]], sort=True).sum()
+        return (whole.index.get_level_values(0).to_numpy(), whole.index.get_level_values(1).to_numpy(),
+                whole.to_numpy(dtype=float))
+
+def as_region_index(combine):
+    '''
+    Returns combine as a RegionIndex (combine can be a 'combine' dictionary or already a RegionIndex).
+    '''
+    if isinstance(combine, RegionIndex):
+        return combine
+    return RegionIndex(combine)
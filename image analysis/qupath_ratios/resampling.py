@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bootstrap confidence intervals and permutation tests for the ratios of CSV_reader.py (e.g. the chance ratio),
+to compare groups of mice (e.g. extinction vs control).
+
+The ratio of a group is the mean over the mice of the group of the mean ratio of each mouse (like the columns of the
+results file of CSV_reader.py). Two kinds of resampling are done for every region at once:
+- bootstrap: the slices of every mouse are resampled with replacement, which gives a confidence interval
+  for the ratio of each group (and for the difference between two groups);
+- permutation test: the group labels of the mice are shuffled, which gives a p-value for the difference between
+  two groups.
+
+All resamples are drawn as arrays (n_resamples x rows) and reduced with NumPy, without making dataframes.
+The resamples are done in batches, each with its own random generator (made from 'seed'), so the results are the
+same for a given seed, whatever the number of worker processes (n_workers). The number of resamples per batch is
+chosen so that the arrays of a batch fit in memory_budget (or set with batch_size); the results also depend on it.
+
+Example:
+    store = import_files_compact(root, combine, param_list)
+    ci = bootstrap_chance_ratio(store, 'BLA', 4, {'extinction': extinction, 'control': control})
+    p = permutation_test_chance_ratio(store, 'BLA', 4, extinction, control)
+"""
+
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .ratio_engine import as_store, chance_ratio_per_slice, column
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024**2
+# Number of float64 arrays (resamples x rows) that exist at the same time in bootstrap_batch
+BOOTSTRAP_ARRAYS = 6
+
+#%%
+def slice_groups(store, values, keep):
+    '''
+    Sorts the values of the kept rows of the store by (mouse, region).
+    Output:
+        values: the sorted values.
+        starts, sizes: first row and number of rows of each (mouse, region) group.
+        mice, regions: the mouse code and region code of each group.
+    '''
+    mouse_codes = store.mouse_codes[keep]
+    region_codes = store.region_codes[keep]
+    values = values[keep]
+    order = np.lexsort((region_codes, mouse_codes))
+    mouse_codes, region_codes, values = mouse_codes[order], region_codes[order], values[order]
+
+    new_group = np.ones(len(values), dtype=bool)
+    new_group[1:] = (mouse_codes[1:] != mouse_codes[:-1]) | (region_codes[1:] != region_codes[:-1])
+    starts = np.flatnonzero(new_group)
+    sizes = np.diff(np.append(starts, len(values)))
+    return values, starts, sizes, mouse_codes[starts], region_codes[starts]
+
+def group_matrix(store, group_mice, group_regions, mouse_list):
+    '''
+    Returns a matrix (number of (mouse, region) groups x number of regions) with a 1 where the group belongs to
+    a mouse in mouse_list and to that region. Multiplying the mouse means with it sums them per region.
+    '''
+    in_list = np.isin(np.array(store.mice, dtype=object)[group_mice], list(mouse_list))
+    matrix = np.zeros((len(group_mice), len(store.regions)))
+    matrix[np.flatnonzero(in_list), group_regions[in_list]] = 1
+    return matrix
+
+def mean_of_mice(mouse_means, matrix):
+    '''
+    Takes the mean over mice (ignoring NaNs) for every region, for every resample.
+    mouse_means: array (resamples x groups), matrix: see group_matrix. Output: array (resamples x regions).
+    '''
+    valid = ~np.isnan(mouse_means)
+    sums = np.where(valid, mouse_means, 0.0) @ matrix
+    counts = valid.astype(float) @ matrix
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sums / counts
+
+def mouse_means_of(sample, starts):
+    '''
+    Takes the mean (ignoring NaNs) of every (mouse, region) group of the columns of sample (resamples x rows).
+    '''
+    valid = ~np.isnan(sample)
+    sums = np.add.reduceat(np.where(valid, sample, 0.0), starts, axis=1)
+    counts = np.add.reduceat(valid, starts, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sums / counts
+
+#%%
+def bootstrap_batch(values, starts, sizes, matrices, n_resamples, seed):
+    '''
+    Does n_resamples bootstrap resamples of the slices of every mouse.
+    Output: one array (resamples x regions) with the group mean for every matrix in matrices.
+    '''
+    rng = np.random.default_rng(seed)
+    group_of_row = np.repeat(np.arange(len(starts)), sizes)
+    # For every row, draw a random row of the same (mouse, region) group
+    draws = (rng.random((n_resamples, len(values))) * sizes[group_of_row]).astype(np.int64)
+    sample = values[starts[group_of_row] + draws]
+    mouse_means = mouse_means_of(sample, starts)
+    return [mean_of_mice(mouse_means, matrix) for matrix in matrices]
+
+def permutation_batch(mouse_values, n_a, n_permutations, seed):
+    '''
+    Shuffles the group labels of the mice n_permutations times.
+    mouse_values: array (regions x mice) with the mean of each mouse; the first n_a mice are group A in the data.
+    Output: array (permutations x regions) with the difference between the means of group A and group B.
+    '''
+    rng = np.random.default_rng(seed)
+    n_mice = mouse_values.shape[1]
+    # Random permutations of the mice; the first n_a mice of each permutation are group A
+    ranks = np.argsort(rng.random((n_permutations, n_mice)), axis=1)
+    in_a = np.zeros((n_permutations, n_mice))
+    np.put_along_axis(in_a, ranks[:, :n_a], 1, axis=1)
+    return permuted_difference(mouse_values, in_a)
+
+def permuted_difference(mouse_values, in_a):
+    '''
+    Difference between the mean of the mice in group A (in_a = 1) and the other mice, ignoring NaNs.
+    mouse_values: array (regions x mice), in_a: array (permutations x mice). Output: array (permutations x regions).
+    '''
+    valid = ~np.isnan(mouse_values)
+    filled = np.where(valid, mouse_values, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_a = (in_a @ filled.T) / (in_a @ valid.T)
+        mean_b = ((1 - in_a) @ filled.T) / ((1 - in_a) @ valid.T)
+    return mean_a - mean_b
+
+def batch_size_for_budget(bytes_per_resample, memory_budget):
+    '''
+    Returns the number of resamples per batch so that the arrays of a batch fit in memory_budget (at least 1).
+    '''
+    return max(1, int(memory_budget // max(bytes_per_resample, 1)))
+
+def run_batches(function, arguments, n_total, batch_size, seed, n_workers):
+    '''
+    Runs function(*arguments, n, seed) for batches of n resamples (n_total in total),
+    with one random seed per batch made from 'seed'. The batches are run in n_workers processes if n_workers > 1.
+    Returns the list of outputs, in the order of the batches.
+    '''
+    sizes = [min(batch_size, n_total - start) for start in range(0, n_total, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if n_workers is None or n_workers <= 1 or len(sizes) <= 1:
+        return [function(*arguments, n, s) for n, s in zip(sizes, seeds)]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(function, *arguments, n, s) for n, s in zip(sizes, seeds)]
+        return [future.result() for future in futures]
+
+#%%
+def bootstrap_ci(store, values, keep, groups, n_resamples=10000, ci=0.95, seed=0, n_workers=1, batch_size=None,
+                 memory_budget=DEFAULT_MEMORY_BUDGET):
+    '''
+    Bootstrap confidence intervals of the mean ratio of groups of mice.
+    Inputs:
+        store: a SliceStore; values: one value (e.g. the chance ratio) per row of the store;
+        keep: True for the rows that are used (e.g. the rows above the threshold).
+        groups: dictionary with a name and a list of mice for every group, e.g. {'extinction': [...], 'control': [...]}.
+        ci: size of the confidence interval.
+        batch_size: resamples per batch (default: as many as fit in memory_budget bytes, per worker).
+    Output: a dataframe with the regions as rows, and for every group the mean and the lower and upper bound of
+    the confidence interval. With two groups, the same is given for the difference (first group - second group).
+    '''
+    values, starts, sizes, group_mice, group_regions = slice_groups(store, values, keep)
+    names = list(groups.keys())
+    matrices = [group_matrix(store, group_mice, group_regions, groups[name]) for name in names]
+
+    result = pd.DataFrame(index=store.regions)
+    if len(values) == 0:
+        return result
+
+    # Observed group means
+    mouse_means = mouse_means_of(values[np.newaxis, :], starts)
+    observed = [mean_of_mice(mouse_means, matrix)[0] for matrix in matrices]
+
+    if batch_size is None:
+        batch_size = batch_size_for_budget(8 * BOOTSTRAP_ARRAYS * len(values), memory_budget)
+    batches = run_batches(bootstrap_batch, (values, starts, sizes, matrices), n_resamples, batch_size, seed, n_workers)
+    resampled = [np.concatenate([batch[i] for batch in batches]) for i in range(len(names))]
+
+    low, high = 50 * (1 - ci), 100 - 50 * (1 - ci)
+    # (np.nanpercentile warns for regions without any value in a group; their bounds are NaN)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for name, obs, boot in zip(names, observed, resampled):
+            result[name + ' mean'] = obs
+            result[name + ' CI low'] = np.nanpercentile(boot, low, axis=0)
+            result[name + ' CI high'] = np.nanpercentile(boot, high, axis=0)
+        if len(names) == 2:
+            difference = resampled[0] - resampled[1]
+            result['difference'] = observed[0] - observed[1]
+            result['difference CI low'] = np.nanpercentile(difference, low, axis=0)
+            result['difference CI high'] = np.nanpercentile(difference, high, axis=0)
+    return result
+
+def permutation_test(store, values, keep, group_a, group_b, n_permutations=10000, seed=0, n_workers=1, batch_size=None,
+                     memory_budget=DEFAULT_MEMORY_BUDGET):
+    '''
+    Permutation test for the difference between the mean ratio of the mice in group_a and group_b.
+    Inputs: store, values, keep, batch_size and memory_budget as in bootstrap_ci; group_a and group_b are lists of mice.
+    Output: a dataframe with the regions as rows and the columns 'mean A', 'mean B', 'difference' and 'p-value'
+    (two-sided; the fraction of permutations with a difference at least as large as the observed one).
+    '''
+    values, starts, sizes, group_mice, group_regions = slice_groups(store, values, keep)
+    mice = [mouse for mouse in list(group_a) + list(group_b) if mouse in store.mice]
+    n_a = len([mouse for mouse in group_a if mouse in store.mice])
+
+    # Mean of every mouse (columns) in every region (rows)
+    mouse_values = np.full((len(store.regions), len(mice)), np.nan)
+    if len(values) != 0:
+        mouse_means = mouse_means_of(values[np.newaxis, :], starts)[0]
+        mouse_pos = pd.Index(mice).get_indexer(np.array(store.mice, dtype=object)[group_mice])
+        found = mouse_pos >= 0
+        mouse_values[group_regions[found], mouse_pos[found]] = mouse_means[found]
+
+    in_a = np.zeros((1, len(mice)))
+    in_a[0, :n_a] = 1
+    observed = permuted_difference(mouse_values, in_a)[0]
+
+    if batch_size is None:
+        # Arrays (permutations x mice) for the ranks and labels, and (permutations x regions) for the means
+        batch_size = batch_size_for_budget(8 * (4 * len(mice) + 4 * len(store.regions)), memory_budget)
+    batches = run_batches(permutation_batch, (mouse_values, n_a), n_permutations, batch_size, seed, n_workers)
+    permuted = np.concatenate(batches)
+    # A small tolerance so that permutations equal to the observed labels always count
+    extreme = np.abs(permuted) >= np.abs(observed) - 1e-12
+    p_values = (1 + extreme.sum(axis=0)) / (1 + n_permutations)
+    p_values[np.isnan(observed)] = np.nan
+
+    valid = ~np.isnan(mouse_values)
+    filled = np.where(valid, mouse_values, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_a = filled[:, :n_a].sum(axis=1) / valid[:, :n_a].sum(axis=1)
+        mean_b = filled[:, n_a:].sum(axis=1) / valid[:, n_a:].sum(axis=1)
+    return pd.DataFrame({'mean A': mean_a, 'mean B': mean_b, 'difference': observed, 'p-value': p_values},
+                        index=store.regions)
+
+#%%
+def ratio_per_slice(store, num, den, thres):
+    '''
+    Calculates the ratio num/den of every row of the store, and keep = den above thres (like calculate_ratio).
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = column(store, num) / column(store, den)
+    return ratios, column(store, den) > thres
+
+def bootstrap_chance_ratio(store, tracer, thres, groups, **kwargs):
+    '''
+    Bootstrap confidence intervals of the chance ratio of groups of mice (see bootstrap_ci for the options).
+    store can be a SliceStore or a mouse dictionary.
+    '''
+    store = as_store(store)
+    chance, keep = chance_ratio_per_slice(store, tracer, thres)
+    return bootstrap_ci(store, chance, keep, groups, **kwargs)
+
+def permutation_test_chance_ratio(store, tracer, thres, group_a, group_b, **kwargs):
+    '''
+    Permutation test for the difference in chance ratio between two groups of mice (see permutation_test for the options).
+    store can be a SliceStore or a mouse dictionary.
+    '''
+    store = as_store(store)
+    chance, keep = chance_ratio_per_slice(store, tracer, thres)
+    return permutation_test(store, chance, keep, group_a, group_b, **kwargs)
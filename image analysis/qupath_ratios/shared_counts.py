@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shares the imported cell counts between processes through a memory-mapped file.
+
+When several processes (e.g. statistics or plotting jobs) analyse the same experiment, each of them would import the
+.csv files again and keep its own copy of the counts. Instead, the counts can be exported once with export_counts:
+the arrays of a SliceStore (see slice_store.py) are written one after the other into one binary file, with a small
+.json file next to it (the 'sidecar') with the names of the mice, regions and parameters and where each array starts.
+open_counts opens that file read-only with np.memmap, and returns a SliceStore whose arrays are views on the file:
+nothing is read or copied until the numbers are used, and all processes that open the same file share the same
+memory (the pages of the file in the cache of the operating system).
+
+The SliceStore of open_counts can be used like any SliceStore, e.g. with calculate_ratio_vectorized,
+get_chance_ratio_vectorized, the functions in resampling.py, or store['14025'] for the dataframes of a mouse.
+
+Example:
+    export_counts(import_files_compact(root, combine, param_list), 'WT48_counts.bin')
+    # in every worker process:
+    store = open_counts('WT48_counts.bin')
+    [cFos_ratio_df, cFos_SEM_df] = calculate_ratio_vectorized('cFos', 'DAPI', store, full_mouse_list, whole_regs, 4)
+"""
+
+import json
+import os
+
+import numpy as np
+
+from .ratio_engine import as_store
+from .slice_store import SliceStore
+
+SHARED_COUNTS_VERSION = 1
+ALIGNMENT = 64  # every array starts at a multiple of 64 bytes
+
+#%%
+def sidecar_name(file_name):
+    '''
+    Returns the name of the .json file with the labels of a counts file.
+    '''
+    return file_name + '.json'
+
+def export_counts(m_dict, file_name):
+    '''
+    Writes the counts of m_dict (a mouse dictionary or a SliceStore) to file_name (and its sidecar, file_name + '.json').
+    The files are written under a temporary name first, so that other processes never open half a file.
+    '''
+    store = as_store(m_dict)
+    arrays = [('mouse_codes', store.mouse_codes), ('slice_ids', store.slice_ids), ('region_codes', store.region_codes)]
+    arrays = arrays + [('column ' + param, store.columns[param]) for param in store.param_list]
+
+    layout = {}
+    offset = 0
+    tmp_name = file_name + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        for name, array in arrays:
+            array = np.ascontiguousarray(array)
+            padding = -offset % ALIGNMENT
+            f.write(b'\0' * padding)
+            offset = offset + padding
+            f.write(array.tobytes())
+            layout[name] = {'dtype': array.dtype.str, 'offset': offset}
+            offset = offset + array.nbytes
+
+    sidecar = {'version': SHARED_COUNTS_VERSION, 'n_rows': len(store.mouse_codes),
+               'mice': [str(mouse) for mouse in store.mice], 'regions': [str(region) for region in store.regions],
+               'param_list': store.param_list, 'n_slices': [int(n) for n in store.n_slices], 'arrays': layout}
+    with open(sidecar_name(file_name) + '.tmp', 'w') as f:
+        json.dump(sidecar, f, indent=1)
+
+    os.replace(tmp_name, file_name)
+    os.replace(sidecar_name(file_name) + '.tmp', sidecar_name(file_name))
+
+def open_counts(file_name):
+    '''
+    Opens a file written by export_counts, and returns a read-only SliceStore with memory-mapped arrays.
+    '''
+    with open(sidecar_name(file_name)) as f:
+        sidecar = json.load(f)
+    if sidecar.get('version') != SHARED_COUNTS_VERSION:
+        raise ValueError('"{f}" was written by another version of export_counts; export the counts again.'.format(f=file_name))
+
+    n_rows = sidecar['n_rows']
+    def mapped(name):
+        info = sidecar['arrays'][name]
+        if n_rows == 0:
+            # np.memmap cannot map zero bytes
+            return np.zeros(0, dtype=np.dtype(info['dtype']))
+        return np.memmap(file_name, dtype=np.dtype(info['dtype']), mode='r', offset=info['offset'], shape=(n_rows,))
+
+    columns = {param: mapped('column ' + param) for param in sidecar['param_list']}
+    return SliceStore(sidecar['mice'], sidecar['regions'], sidecar['param_list'], mapped('mouse_codes'),
+                      mapped('slice_ids'), mapped('region_codes'), columns, sidecar['n_slices'])
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the raw cell counts in the QuPath .csv files.
+
+When CSV_reader.py is run again on the same folder (e.g. with another 'combine', 'tracer' or threshold),
+the .csv files that did not change are loaded from the cache instead of being parsed again.
+Only new or modified files are read.
+
+There is one cache file per root folder, stored in cache_dir (default: ~/.cache/qupath_csv_reader).
+A file is considered unchanged if its size and modification time (and, with check='hash', its content)
+are the same as when it was cached. The cache stores the counts before csv_to_dataframe is applied,
+so 'combine', 'tracer' and the thresholds can be changed without invalidating it.
+When the cache folder gets larger than max_bytes, the least recently used cache files are deleted.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .csv_schema import read_headers, check_headers, raise_missing_columns, COUNT_COLUMNS, COLUMN_DTYPES
+from .default_paths import DEFAULT_CACHE_DIR
+from .prefetch import map_prefetched
+from .profiling import profiled, count_raw_counts
+from .QuPath import list_csv_files, read_raw_counts, make_slice_table, table_to_dict
+
+# Change this when the layout of the cache files changes, so that old cache files are not used.
+CACHE_VERSION = 2
+# Everything that influences how the .csv files are parsed (see read_raw_counts).
+PARSE_PARAMETERS = {'encoding': 'latin1', 'delimiter': ',', 'columns': COUNT_COLUMNS,
+                    'dtypes': {column: str(np.dtype(dtype)) for column, dtype in COLUMN_DTYPES.items()}}
+
+DEFAULT_MAX_BYTES = 1024**3
+
+#%%
+def cache_file_name(root, cache_dir):
+    '''
+    Returns the path of the cache file of the folder 'root'.
+    '''
+    key = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, key + '.pkl')
+
+def file_hash(path):
+    '''
+    Returns the sha1 hash of the content of a file.
+    '''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def file_stats(root, file_list, check):
+    '''
+    Returns a dataframe with size, modification time (and hash if check='hash') of each file in file_list.
+    '''
+    def stat(file):
+        st = os.stat(os.path.join(root, file))
+        return st.st_size, st.st_mtime_ns, file_hash(os.path.join(root, file)) if check == 'hash' else ''
+
+    # On network storage, every os.stat waits for the server, so they are done in a few threads (see prefetch.py)
+    sizes, mtimes, hashes = [], [], []
+    for size, mtime, h in map_prefetched(stat, file_list):
+        sizes.append(size)
+        mtimes.append(mtime)
+        hashes.append(h)
+    return pd.DataFrame({'size': np.array(sizes, dtype=np.int64),
+                         'mtime': np.array(mtimes, dtype=np.int64),
+                         'hash': np.array(hashes, dtype=object)},
+                        index=pd.Index(file_list, name='file', dtype=object))
+
+#%%
+def load_cache(path):
+    '''
+    Loads a cache file. Returns None if the file does not exist, is damaged, or was made with other parse parameters.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+    except FileNotFoundError:
+        # Also when another process deleted the file (see evict)
+        return None
+    except Exception:
+        print('WARNING: cache file "{f}" could not be read and is ignored.'.format(f=path))
+        return None
+    if entry.get('version') != CACHE_VERSION or entry.get('parse_parameters') != PARSE_PARAMETERS:
+        return None
+    return entry
+
+def save_cache(path, entry):
+    '''
+    Writes a cache file (first to a temporary file, so that an interrupted write never leaves a damaged cache).
+    The temporary file has a unique name, so that processes that write the same cache file at the same time
+    (e.g. the workers of batch_runner.py) do not write into each other's temporary file.
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def evict(cache_dir, max_bytes, keep=None):
+    '''
+    Deletes the least recently used cache files until the cache folder is smaller than max_bytes.
+    The cache file 'keep' (the one that is used right now) is never deleted.
+    Files that another process deleted in the meantime are skipped.
+    '''
+    if not os.path.isdir(cache_dir):
+        return
+    files = []
+    for f in os.listdir(cache_dir):
+        if f.endswith('.pkl'):
+            p = os.path.join(cache_dir, f)
+            try:
+                st = os.stat(p)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    for _, size, p in files:
+        if total <= max_bytes:
+            break
+        if keep is not None and os.path.abspath(p) == os.path.abspath(keep):
+            continue
+        total = total - size
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+
+def clear_cache(root=None, cache_dir=DEFAULT_CACHE_DIR):
+    '''
+    Deletes the cache file of the folder 'root', or all cache files if root is None.
+    '''
+    if root is not None:
+        paths = [cache_file_name(root, cache_dir)]
+    elif os.path.isdir(cache_dir):
+        paths = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir) if f.endswith('.pkl')]
+    else:
+        paths = []
+    for p in paths:
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+
+#%%
+@profiled('load_raw_counts', count=count_raw_counts)
+def load_raw_counts(root, file_list, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, check='mtime',
+                    param_list=None, progress=False):
+    '''
+    This function returns the same table as read_raw_counts(root, file_list),
+    but only reads the files that are new or changed since the last call; the other files come from the cache.
+    Inputs:
+        cache_dir: folder where the cache files are stored.
+        max_bytes: maximum total size of the cache folder.
+        check: 'mtime' (compare size and modification time) or 'hash' (also compare the content of the files).
+        param_list: if given, checks that all files have the columns for param_list (see csv_schema.py) before
+                    anything is read. The headers of unchanged files come from the cache, so only the headers of
+                    new and changed files are read.
+        progress: if True, the number of new and changed files read so far is shown.
+    '''
+    path = cache_file_name(root, cache_dir)
+    stats = file_stats(root, file_list, check)
+
+    entry = load_cache(path)
+    if entry is not None and entry.get('check') == check:
+        old_stats = entry['stats']
+        old_raw = entry['raw']
+        old_headers = entry['headers']
+    else:
+        old_stats = stats.iloc[:0]
+        old_raw = None
+        old_headers = {}
+
+    # Find the files that did not change since they were cached
+    common = stats.index.intersection(old_stats.index)
+    same = (stats.loc[common] == old_stats.loc[common]).all(axis=1)
+    unchanged = set(common[same.to_numpy(dtype=bool)])
+    changed_list = [file for file in file_list if file not in unchanged]
+
+    # Check the columns, reading only the headers of the new and changed files
+    new_headers = read_headers(root, changed_list)
+    headers = {file: new_headers[file] if file in new_headers else old_headers[file] for file in file_list}
+    if param_list is not None:
+        raise_missing_columns(check_headers(headers, param_list), root, param_list)
+
+    # Read the new and changed files
+    new_raw = read_raw_counts(root, changed_list, progress=progress)
+    columns = [c for c in new_raw.columns if c.startswith('Num ') or c == 'Area um^2']
+    new_raw = new_raw[columns]
+    # Index the new rows by file name instead of by position in changed_list
+    pos = new_raw.index.get_level_values('file').to_numpy(dtype=int)
+    names = np.array(changed_list, dtype=object)[pos]
+    new_raw.index = pd.MultiIndex.from_arrays([names, new_raw.index.get_level_values('Name')], names=['file', 'Name'])
+
+    if old_raw is not None and len(unchanged) > 0:
+        kept_raw = old_raw[old_raw.index.get_level_values('file').isin(unchanged)]
+        raw = pd.concat([kept_raw, new_raw], sort=False)
+    else:
+        raw = new_raw
+
+    # Update the cache if something changed (new, modified or deleted files)
+    if len(changed_list) > 0 or len(old_stats.index.difference(stats.index)) > 0 or entry is None:
+        save_cache(path, {'version': CACHE_VERSION, 'parse_parameters': PARSE_PARAMETERS, 'check': check,
+                          'root': os.path.abspath(root), 'stats': stats, 'raw': raw, 'headers': headers})
+    elif os.path.isfile(path):
+        os.utime(path)  # mark the cache file as recently used
+    evict(cache_dir, max_bytes, keep=path)
+
+    # Index the rows by the position of the file in file_list, in the order of file_list
+    positions = pd.Series(np.arange(len(file_list)), index=file_list)
+    file_pos = positions.loc[raw.index.get_level_values('file')].to_numpy()
+    raw = raw.set_axis(pd.MultiIndex.from_arrays([file_pos, raw.index.get_level_values('Name')], names=['file', 'Name']), axis=0)
+    order = np.argsort(file_pos, kind='stable')
+    return raw.iloc[order]
+
+def import_files_cached(root, combine, param_list, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, check='mtime'):
+    '''
+    This function does the same as import_files_batched, but uses the cache for files that did not change.
+    Output: m_dict, with the same layout as the output of import_files.
+    '''
+    file_list = list_csv_files(root)
+    raw = load_raw_counts(root, file_list, cache_dir, max_bytes, check, param_list)
+    table = make_slice_table(raw, file_list, combine, param_list)
+    return table_to_dict(table, file_list, param_list)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact storage of the cell counts of all slices of all mice.
+
+The mouse dictionary made by import_files holds one small pandas dataframe per slice. With thousands of slices,
+these dataframes take much more memory than the numbers in them. A SliceStore keeps the same numbers in a few
+contiguous NumPy arrays (one row per whole region per slice):
+    mouse_codes:  position of the mouse in store.mice
+    slice_ids:    number of the slice of that mouse (1, 2, ...)
+    region_codes: position of the whole region in store.regions
+    columns:      one array per parameter in param_list (integers for cell counts, floats for 'area')
+
+A SliceStore behaves like the mouse dictionary (store['14025'] is a list with one dataframe per slice,
+store.items() loops over mice), so it can be passed directly to calculate_ratio, get_chance_ratio
+and output_raw_numbers. The dataframes are only made when a mouse is accessed.
+"""
+
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+from .csv_schema import validate_csv_files
+from .profiling import profiled, count_imported
+from .QuPath import find_current_mice, list_csv_files, read_raw_counts, make_slice_table
+from .slice_cache import load_raw_counts, DEFAULT_CACHE_DIR
+
+#%%
+class SliceStore(Mapping):
+    '''
+    Cell counts of all slices, stored as NumPy arrays. See the description at the top of this file.
+    n_slices[i] is the number of slices (.csv files) of mouse i, including slices without any whole region.
+    '''
+    def __init__(self, mice, regions, param_list, mouse_codes, slice_ids, region_codes, columns, n_slices):
+        self.mice = list(mice)
+        self.regions = list(regions)
+        self.param_list = list(param_list)
+        self.mouse_codes = np.asarray(mouse_codes, dtype=np.int32)
+        self.slice_ids = np.asarray(slice_ids, dtype=np.int32)
+        self.region_codes = np.asarray(region_codes, dtype=np.int16 if len(self.regions) < 2**15 else np.int32)
+        self.columns = {param: np.ascontiguousarray(columns[param]) for param in self.param_list}
+        self.n_slices = np.asarray(n_slices, dtype=np.int32)
+
+        # Sort the rows by mouse and slice (keeping the order of the regions within a slice),
+        # and find where the rows of each slice start and stop.
+        order = np.lexsort((self.slice_ids, self.mouse_codes))
+        if not np.array_equal(order, np.arange(len(order))):
+            self.mouse_codes = self.mouse_codes[order]
+            self.slice_ids = self.slice_ids[order]
+            self.region_codes = self.region_codes[order]
+            self.columns = {param: values[order] for param, values in self.columns.items()}
+        slice_offsets = np.concatenate([[0], np.cumsum(self.n_slices)])
+        self._slice_bounds = np.searchsorted(slice_offsets[self.mouse_codes] + self.slice_ids - 1,
+                                             np.arange(slice_offsets[-1] + 1))
+        self._slice_offsets = slice_offsets
+        self._mouse_index = {mouse: i for i, mouse in enumerate(self.mice)}
+
+    @classmethod
+    def from_table(cls, table, file_list, param_list, whole_regs=None):
+        '''
+        Makes a SliceStore from a slice table (the output of make_slice_table).
+        whole_regs gives the order of the regions (e.g. list(combine.keys())); by default the order of appearance.
+        '''
+        mice = find_current_mice(file_list)
+        if whole_regs is None:
+            whole_regs = list(dict.fromkeys(table['region']))
+        mouse_codes = pd.Categorical(table['mouse'], categories=mice).codes
+        region_codes = pd.Categorical(table['region'], categories=whole_regs).codes
+        n_slices = pd.Series([file.split('_')[0] for file in file_list], dtype=object).value_counts().reindex(mice).to_numpy()
+        columns = {param: compact_column(table[param].to_numpy(dtype=float), param) for param in param_list}
+        return cls(mice, whole_regs, param_list, mouse_codes, table['slice'].to_numpy(), region_codes, columns, n_slices)
+
+    @classmethod
+    def from_dict(cls, m_dict):
+        '''
+        Makes a SliceStore from a mouse dictionary (the output of import_files).
+        '''
+        mice = list(m_dict.keys())
+        param_list = None
+        regions = {}
+        mouse_codes, slice_ids, region_names, values = [], [], [], []
+        for i, mouse in enumerate(mice):
+            for s, df in enumerate(m_dict[mouse]):
+                if param_list is None:
+                    param_list = list(df.columns)
+                mouse_codes.append(np.full(len(df), i))
+                slice_ids.append(np.full(len(df), s + 1))
+                region_names.extend(df.index)
+                values.append(df[param_list].to_numpy(dtype=float))
+        for region in region_names:
+            regions.setdefault(region, len(regions))
+        values = np.concatenate(values) if len(values) else np.zeros((0, len(param_list or [])))
+        columns = {param: compact_column(values[:, j], param) for j, param in enumerate(param_list or [])}
+        return cls(mice, list(regions), param_list or [],
+                   np.concatenate(mouse_codes) if len(mouse_codes) else [],
+                   np.concatenate(slice_ids) if len(slice_ids) else [],
+                   [regions[r] for r in region_names], columns,
+                   [len(m_dict[mouse]) for mouse in mice])
+
+    # Mapping interface: store[mouse] is a list of dataframes, one per slice (like the mouse dictionary)
+    def __getitem__(self, mouse):
+        i = self._mouse_index[mouse]
+        first, last = self._slice_offsets[i], self._slice_offsets[i + 1]
+        row_start, row_stop = self._slice_bounds[first], self._slice_bounds[last]
+        values = np.zeros((row_stop - row_start, len(self.param_list)))
+        for j, param in enumerate(self.param_list):
+            values[:, j] = self.columns[param][row_start:row_stop]
+
+        df_list = []
+        for k in range(first, last):
+            start, stop = self._slice_bounds[k] - row_start, self._slice_bounds[k + 1] - row_start
+            if stop > start:
+                regions = [self.regions[r] for r in self.region_codes[row_start + start:row_start + stop]]
+                df_list.append(pd.DataFrame(values[start:stop], index=regions, columns=self.param_list))
+            else:
+                df_list.append(pd.DataFrame(np.nan, index=[], columns=self.param_list))
+        return df_list
+
+    def __iter__(self):
+        return iter(self.mice)
+
+    def __len__(self):
+        return len(self.mice)
+
+    # Conversions
+    def to_dict(self):
+        '''
+        Returns the mouse dictionary (with one dataframe per slice), the same as import_files returns.
+        '''
+        return {mouse: self[mouse] for mouse in self.mice}
+
+    def to_table(self):
+        '''
+        Returns a tidy dataframe with columns mouse, slice, region and the parameters (mouse and region are categorical).
+        '''
+        table = pd.DataFrame({'mouse': pd.Categorical.from_codes(self.mouse_codes, categories=self.mice),
+                              'slice': self.slice_ids,
+                              'region': pd.Categorical.from_codes(self.region_codes, categories=self.regions)})
+        for param in self.param_list:
+            table[param] = self.columns[param]
+        return table
+
+    def nbytes(self):
+        '''
+        Returns the number of bytes used by the arrays of the store.
+        '''
+        arrays = [self.mouse_codes, self.slice_ids, self.region_codes, self.n_slices, self._slice_bounds, self._slice_offsets]
+        return sum(a.nbytes for a in arrays) + sum(a.nbytes for a in self.columns.values())
+
+def compact_column(values, param):
+    '''
+    Stores cell counts as 32-bit integers; 'area' (and any column with fractions or NaNs) stays a float column.
+    '''
+    if param != 'area' and np.all(np.isfinite(values)) and np.all(values == np.round(values)) \
+            and (len(values) == 0 or np.abs(values).max() < 2**31):
+        return values.astype(np.int32)
+    return values.astype(np.float64)
+
+#%%
+@profiled('import_files_compact', count=count_imported)
+def import_files_compact(root, combine, param_list, cache_dir=DEFAULT_CACHE_DIR, progress=False):
+    '''
+    This function does the same as import_files, but returns a SliceStore instead of a mouse dictionary.
+    cache_dir is the folder of the cache (see slice_cache.py); if None, the cache is not used.
+    If progress is True, the number of files read so far is shown.
+    '''
+    file_list = list_csv_files(root)
+    if cache_dir is None:
+        validate_csv_files(root, file_list, param_list)
+        raw = read_raw_counts(root, file_list, progress=progress)
+    else:
+        # (checks only the headers of files that are not in the cache)
+        raw = load_raw_counts(root, file_list, cache_dir, param_list=param_list, progress=progress)
+    table = make_slice_table(raw, file_list, combine, param_list)
+    return SliceStore.from_table(table, file_list, param_list, list(combine.keys()))
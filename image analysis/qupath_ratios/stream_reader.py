@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming import of very large QuPath .csv exports with bounded memory.
+
+Besides one (small) .csv file per image, QuPath can export merged measurement tables with the annotations of
+many images and millions of rows. Instead of loading such a file at once with pd.read_csv, the functions in this
+file read it in chunks, keep only the columns that csv_to_dataframe needs, and sum the counts per region
+(and per image, if the file has an 'Image' column) after every chunk. The size of the chunks is chosen so that
+the memory used stays below memory_budget, whatever the size of the file.
+
+In a merged table, every image is treated as one slice, named after the 'Image' column (e.g. '14025_01.vsi'),
+so the mouse name is the part of the image name before the first '_', just like for file names.
+"""
+
+import os
+
+import pandas as pd
+
+from .csv_schema import validate_csv_files, COUNT_COLUMNS, COLUMN_DTYPES
+from .QuPath import list_csv_files, make_slice_table, table_to_dict
+
+# The columns of the QuPath .csv files that are used by csv_to_dataframe
+STREAM_COLUMNS = ['Name'] + COUNT_COLUMNS
+IMAGE_COLUMN = 'Image'
+DEFAULT_MEMORY_BUDGET = 256 * 1024**2
+
+#%%
+def chunk_rows_for_budget(columns, memory_budget):
+    '''
+    Returns the number of rows per chunk so that a chunk (and the intermediate results made from it) fits in memory_budget.
+    Numbers take 8 bytes per value; names are counted as 100 bytes (a Python string plus a pointer).
+    '''
+    bytes_per_row = sum(100 if c in ('Name', IMAGE_COLUMN) else 8 for c in columns)
+    # Reading a chunk, filtering it and grouping it makes a few copies of it at the same time
+    return max(1000, int(memory_budget // (4 * bytes_per_row)))
+
+def stream_reduce_csv(path, memory_budget=DEFAULT_MEMORY_BUDGET):
+    '''
+    Reads one .csv file in chunks and sums the counts of all rows with the same region name
+    (and the same image, if the file has an 'Image' column). Rows without detections are left out,
+    just like in csv_to_dataframe.
+    Output: a dataframe indexed by (image, Name), with the columns of STREAM_COLUMNS that are in the file.
+    For files without an 'Image' column, image is an empty string.
+    '''
+    header = pd.read_csv(path, encoding = 'latin1', delimiter=',', nrows=0).columns
+    columns = [c for c in header if c in STREAM_COLUMNS or c == IMAGE_COLUMN]
+    keys = [IMAGE_COLUMN, 'Name'] if IMAGE_COLUMN in columns else ['Name']
+    chunk_rows = chunk_rows_for_budget(columns, memory_budget)
+
+    total = None
+    values = [c for c in columns if c not in keys]
+    # With fixed types, the counts are numbers also in empty chunks, and only the counts are summed
+    dtypes = dict(COLUMN_DTYPES, **{IMAGE_COLUMN: str})
+    reader = pd.read_csv(path, encoding = 'latin1', delimiter=',', usecols=columns, chunksize=chunk_rows,
+                         dtype={c: dtypes[c] for c in columns})
+    for chunk in reader:
+        chunk = chunk[chunk['Num Detections'] > 0]
+        sums = chunk.groupby(keys, sort=False)[values].sum()
+        if total is None:
+            total = sums
+        else:
+            # The running total only has one row per (image, region), so it stays small
+            total = pd.concat([total, sums]).groupby(level=keys, sort=False).sum()
+
+    if total is None:
+        total = pd.DataFrame(columns=values,
+                             index=pd.MultiIndex.from_arrays([[]] * len(keys), names=keys))
+    if IMAGE_COLUMN not in columns:
+        total.index = pd.MultiIndex.from_arrays([[''] * len(total), total.index], names=[IMAGE_COLUMN, 'Name'])
+    return total
+
+#%%
+def read_raw_counts_streaming(root, file_list, memory_budget=DEFAULT_MEMORY_BUDGET):
+    '''
+    This function does the same as read_raw_counts, but streams every file with stream_reduce_csv.
+    Output:
+        raw: a dataframe indexed by (file, Name), where 'file' is the position of the slice in slice_list.
+        slice_list: the names of the slices: the file names, or the image names for merged tables.
+    '''
+    parts = []
+    names = []
+    for file in file_list:
+        path = os.path.join(root, file)
+        reduced = stream_reduce_csv(path, memory_budget)
+        if len(reduced) == 0 and IMAGE_COLUMN not in pd.read_csv(path, encoding = 'latin1', nrows=0).columns:
+            # A file of one slice without detections is still a slice (like in import_files)
+            parts.append(reduced.droplevel(IMAGE_COLUMN))
+            names.append(file)
+        for image, part in reduced.groupby(level=IMAGE_COLUMN, sort=False):
+            parts.append(part.droplevel(IMAGE_COLUMN))
+            names.append(file if image == '' else str(image))
+
+    # Sort the slices like list_csv_files sorts files
+    order = sorted(range(len(names)), key=lambda i: int(''.join(filter(str.isdigit, names[i])) or 0))
+    slice_list = [names[i] for i in order]
+    if len(parts) == 0:
+        return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=['file', 'Name'])), slice_list
+    raw = pd.concat([parts[i] for i in order], keys=range(len(order)), names=['file', 'Name'], sort=False)
+    return raw, slice_list
+
+def import_files_streaming(root, combine, param_list, memory_budget=DEFAULT_MEMORY_BUDGET):
+    '''
+    This function does the same as import_files, but reads the .csv files in chunks (see stream_reduce_csv),
+    so that also very large (merged) QuPath exports can be imported with at most memory_budget bytes of memory.
+    Output: m_dict, with the same layout as the output of import_files.
+    '''
+    file_list = list_csv_files(root)
+    validate_csv_files(root, file_list, param_list)
+    raw, slice_list = read_raw_counts_streaming(root, file_list, memory_budget)
+    table = make_slice_table(raw, slice_list, combine, param_list)
+    return table_to_dict(table, slice_list, param_list)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ratios for many cell-count thresholds at once.
+
+calculate_ratio only uses the slices with den above a threshold, and get_chance_ratio the slices with at least thres
+traced cells, so checking how much the results depend on the threshold means running them again for every threshold.
+The functions in this file compute the means and SEMs for a whole list of thresholds in one pass:
+the thresholds are sorted, every row (region in a slice) is counted once, in the bin of the highest threshold it still
+passes, and cumulative sums over the bins give the count, sum and sum of squares of every (mouse, region) pair for
+every threshold. The sums are taken around the mean of the pair, so that the standard deviation stays accurate.
+
+The results are the same as those of calculate_ratio and get_chance_ratio for each threshold (up to rounding in the
+last digits, because the sums are taken in another order). They are returned as dataframes with a (threshold, region)
+index and the mice as columns, so sweep_df.loc[4] is the region x mouse dataframe for threshold 4.
+
+Example:
+    [ratio_df, SEM_df] = get_chance_ratio_sweep(tracer, m_dict, full_mouse_list, whole_regs, range(0, 51))
+    ratio_df.xs('IL', level='region')     # threshold x mouse, for region IL
+"""
+
+import numpy as np
+import pandas as pd
+
+from .ratio_engine import as_store, column, chance_ratio_per_slice
+
+#%%
+def sweep_aggregates(values, counts, strict, pairs, n_pairs, thresholds):
+    '''
+    Mean, standard deviation (ddof=0) and number of used rows of 'values' for every pair and every threshold.
+    A row is used for a threshold if its count is above the threshold (strict=True) or at least the threshold (strict=False).
+    NaN values are left out (like pandas does).
+    Inputs: one value, count and pair code (0 ... n_pairs-1) per row, and the list of thresholds.
+    Output: three arrays (n_pairs x number of thresholds), with the thresholds in the given order.
+    '''
+    thresholds = np.asarray(thresholds, dtype=float)
+    n_thres = len(thresholds)
+    order = np.argsort(thresholds, kind='stable')
+    sorted_thres = thresholds[order]
+
+    # The number of (sorted) thresholds that every row passes
+    passed = np.searchsorted(sorted_thres, counts, side='left' if strict else 'right')
+    passed[np.isnan(counts)] = 0
+
+    def cumulate(rows, weights=None):
+        # Sum the rows per (pair, number of thresholds passed), then add up from the highest threshold down:
+        # a row that passes p thresholds counts for thresholds 0 ... p-1.
+        bins = pairs[rows] * (n_thres + 1) + passed[rows]
+        table = np.bincount(bins, weights=weights, minlength=n_pairs * (n_thres + 1)).reshape(n_pairs, n_thres + 1)
+        return np.cumsum(table[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+    finite = np.isfinite(values)
+    # Shift every value by the mean of its pair, so that the sums of squares do not lose precision
+    n_finite = np.bincount(pairs[finite], minlength=n_pairs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.bincount(pairs[finite], weights=values[finite], minlength=n_pairs) / n_finite
+    shift[n_finite == 0] = 0
+    deviation = values[finite] - shift[pairs[finite]]
+
+    n = cumulate(finite)
+    s1 = cumulate(finite, deviation)
+    s2 = cumulate(finite, deviation**2)
+    n_plus_inf = cumulate(values == np.inf)
+    n_minus_inf = cumulate(values == -np.inf)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = shift[:, np.newaxis] + s1 / n
+        var = np.maximum(s2 / n - (s1 / n)**2, 0)
+    std = np.sqrt(var)
+
+    # Infinite ratios: the mean is infinite (or NaN with both signs), the standard deviation NaN
+    mean[(n_plus_inf > 0) & (n_minus_inf == 0)] = np.inf
+    mean[(n_minus_inf > 0) & (n_plus_inf == 0)] = -np.inf
+    mean[(n_plus_inf > 0) & (n_minus_inf > 0)] = np.nan
+    std[(n_plus_inf + n_minus_inf) > 0] = np.nan
+    count = (n + n_plus_inf + n_minus_inf).astype(np.int64)
+
+    # Put the thresholds back in the given order
+    inverse = np.empty(n_thres, dtype=np.int64)
+    inverse[order] = np.arange(n_thres)
+    return mean[:, inverse], std[:, inverse], count[:, inverse]
+
+def sweep_frames(mean, std, pair_regions, pair_mice, n_slices, regions, mice, thresholds):
+    '''
+    Puts the output of sweep_aggregates into two dataframes (ratios and SEMs) with a (threshold, region) index
+    and the mice as columns. pair_regions and pair_mice give the position in regions and mice of every pair
+    (-1 for pairs that are not shown); n_slices is the number of slices of every mouse (for the SEM).
+    '''
+    thresholds = list(thresholds)
+    shape = (len(thresholds), len(regions), len(mice))
+    mean_values, sem_values = np.full(shape, np.nan), np.full(shape, np.nan)
+    found = (pair_regions >= 0) & (pair_mice >= 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sem = std / np.asarray(n_slices, dtype=float)[pair_mice[found], np.newaxis]
+    mean_values[:, pair_regions[found], pair_mice[found]] = mean[found].T
+    sem_values[:, pair_regions[found], pair_mice[found]] = sem.T
+
+    index = pd.MultiIndex.from_product([thresholds, list(regions)], names=['threshold', 'region'])
+    return (pd.DataFrame(mean_values.reshape(-1, len(mice)), index=index, columns=list(mice)),
+            pd.DataFrame(sem_values.reshape(-1, len(mice)), index=index, columns=list(mice)))
+
+def sweep_store(values, counts, strict, store, full_mouse_list, whole_regs, thresholds):
+    '''
+    Runs sweep_aggregates on all rows of a SliceStore, with the (mouse, region) pairs as groups,
+    and returns the dataframes of sweep_frames for full_mouse_list and whole_regs.
+    '''
+    n_regions = len(store.regions)
+    pairs = store.mouse_codes.astype(np.int64) * n_regions + store.region_codes
+    n_pairs = len(store.mice) * n_regions
+    mean, std, count = sweep_aggregates(values, counts, strict, pairs, n_pairs, thresholds)
+
+    # Position of the region and mouse of every pair in the output
+    region_pos = np.tile(pd.Index(whole_regs).get_indexer(store.regions), len(store.mice))
+    mouse_pos = np.repeat(pd.Index(full_mouse_list).get_indexer(store.mice), n_regions)
+    # Pairs without any row are NaN (and not 0), like in calculate_ratio
+    has_rows = count.max(axis=1) > 0 if count.shape[1] else np.zeros(n_pairs, dtype=bool)
+    region_pos[~has_rows] = -1
+    n_slices = np.full(len(full_mouse_list), np.nan)
+    known = pd.Index(store.mice).get_indexer(full_mouse_list)
+    n_slices[known >= 0] = store.n_slices[known[known >= 0]]
+    return sweep_frames(mean, std, region_pos, mouse_pos, n_slices, whole_regs, full_mouse_list, thresholds)
+
+#%%
+def calculate_ratio_sweep(num, den, m_dict, full_mouse_list, whole_regs, thresholds):
+    '''
+    Does the same as calculate_ratio for every threshold in thresholds, in one pass.
+    Output: two dataframes (ratios and SEMs) with a (threshold, region) index and full_mouse_list as columns.
+    '''
+    store = as_store(m_dict)
+    den_values = column(store, den)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = column(store, num) / den_values
+    return sweep_store(ratios, den_values, True, store, full_mouse_list, whole_regs, thresholds)
+
+def get_chance_ratio_sweep(tracer, m_dict, full_mouse_list, whole_regs, thresholds):
+    '''
+    Does the same as get_chance_ratio for every threshold in thresholds, in one pass.
+    Output: two dataframes (ratios and SEMs) with a (threshold, region) index and full_mouse_list as columns.
+    '''
+    store = as_store(m_dict)
+    chance, _ = chance_ratio_per_slice(store, tracer, 0)
+    return sweep_store(chance, column(store, tracer), False, store, full_mouse_list, whole_regs, thresholds)
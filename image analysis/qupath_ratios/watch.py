@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Watch mode: keeps the results of CSV_reader.py up to date while QuPath is still writing .csv files.
+
+The QuPath script (qps-multiChannels_PositiveCells_Analysis.groovy) writes one .csv file per image, which can take
+hours for a whole project. A FolderWatcher looks at the folder 'root' every few seconds. When .csv files are added,
+changed or deleted, it reads only those files, recalculates the ratios only for the mice of those files (the other
+columns of the results stay the same), and rewrites the results file and the raw numbers of those mice.
+
+A file is only read when it was not modified for settle_time seconds, so that files that are still being written
+are not read half-way.
+
+Example (with the parameters of CSV_reader.py):
+    watcher = FolderWatcher(root, combine, tracer, experiment, region_name, output_directory,
+                            recall, extinction, control, traced_cell_thresh_single_region)
+    watcher.watch(interval=10)
+"""
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from .QuPath import list_csv_files, read_raw_counts, make_slice_table, write_results_to_csv, write_raw_numbers
+from .multi_analysis import make_param_list
+from .ratio_engine import calculate_ratio_vectorized, get_chance_ratio_vectorized
+from .slice_store import SliceStore
+
+#%%
+class FolderWatcher:
+    '''
+    Keeps the counts, ratios and output files of one folder up to date. See the description at the top of this file.
+    '''
+    def __init__(self, root, combine, tracer, experiment, region_name, output_directory,
+                 recall, extinction, control, thres, settle_time=5):
+        self.root = root
+        self.combine = combine
+        self.tracer = tracer
+        self.experiment = experiment
+        self.region_name = region_name
+        self.output_directory = output_directory
+        self.recall = recall
+        self.extinction = extinction
+        self.control = control
+        self.thres = thres
+        self.settle_time = settle_time
+
+        self.param_list = make_param_list(tracer)
+        self.whole_regs = list(combine.keys())
+        self.full_mouse_list = recall + extinction + control
+
+        self.stats = {}     # file -> (size, modification time) of the files that were read
+        self.raw = {}       # file -> raw counts of the file (the rows of read_raw_counts for that file)
+        self.m_dict = {}    # mouse -> list of dataframes (one per slice), like the output of import_files
+
+        # Results: same dataframes as in CSV_reader.py, all NaN until the mice are read
+        self.results = {}
+        for name in ['cFos', 'Doublepos', 'chance']:
+            self.results[name] = (pd.DataFrame(np.nan, index=self.whole_regs, columns=self.full_mouse_list),
+                                  pd.DataFrame(np.nan, index=self.whole_regs, columns=self.full_mouse_list))
+
+    #%%
+    def find_changes(self):
+        '''
+        Returns the files that are new or changed (and were not modified for settle_time seconds),
+        and the files that were read before but are deleted now.
+        '''
+        now = time.time()
+        file_list = list_csv_files(self.root)
+        changed = []
+        for file in file_list:
+            st = os.stat(os.path.join(self.root, file))
+            stat = (st.st_size, st.st_mtime_ns)
+            if self.stats.get(file) != stat and now - st.st_mtime >= self.settle_time:
+                changed.append(file)
+        removed = [file for file in self.stats if file not in file_list]
+        return changed, removed
+
+    def read_files(self, changed, removed):
+        '''
+        Reads the changed files and forgets the removed files.
+        '''
+        for file in removed:
+            del self.stats[file]
+            del self.raw[file]
+
+        raw = read_raw_counts(self.root, changed)
+        parts = dict(list(raw.groupby(level='file', sort=False))) if len(raw) else {}
+        for pos, file in enumerate(changed):
+            st = os.stat(os.path.join(self.root, file))
+            self.stats[file] = (st.st_size, st.st_mtime_ns)
+            if pos in parts:
+                self.raw[file] = parts[pos].droplevel('file')
+            else:
+                self.raw[file] = raw.iloc[:0].droplevel('file')
+
+    def import_mice(self, mice):
+        '''
+        Makes the slice store of the given mice from the files that were read.
+        Returns the store and the list of files of these mice (in the order of list_csv_files).
+        '''
+        file_list = [file for file in list_csv_files(self.root) if file in self.raw and file.split('_')[0] in mice]
+        parts = [self.raw[file] for file in file_list]
+        if len(parts) == 0 or all(len(part) == 0 for part in parts):
+            table = pd.DataFrame(columns=['mouse', 'slice', 'file', 'region'] + self.param_list)
+        else:
+            raw = pd.concat(parts, keys=range(len(parts)), names=['file', 'Name'], sort=False)
+            table = make_slice_table(raw, file_list, self.combine, self.param_list)
+        return SliceStore.from_table(table, file_list, self.param_list, self.whole_regs), file_list
+
+    #%%
+    def update(self):
+        '''
+        Reads new, changed and deleted files, recalculates the ratios of the mice of these files and rewrites the outputs.
+        Returns the list of mice that were updated (empty if nothing changed).
+        '''
+        changed, removed = self.find_changes()
+        if len(changed) == 0 and len(removed) == 0:
+            return []
+        self.read_files(changed, removed)
+
+        mice = list(dict.fromkeys(file.split('_')[0] for file in changed + removed))
+        store, file_list = self.import_mice(mice)
+
+        # Only the columns of the updated mice are recalculated
+        columns = [mouse for mouse in self.full_mouse_list if mouse in mice]
+        new_results = {
+            'cFos': calculate_ratio_vectorized('cFos', 'DAPI', store, columns, self.whole_regs, self.thres),
+            'Doublepos': calculate_ratio_vectorized(self.tracer+'_cFos', self.tracer, store, columns, self.whole_regs, self.thres),
+            'chance': get_chance_ratio_vectorized(self.tracer, store, columns, self.whole_regs, self.thres)}
+        for name, (ratio_df, SEM_df) in new_results.items():
+            self.results[name][0][columns] = ratio_df
+            self.results[name][1][columns] = SEM_df
+
+        # Update the mouse dictionary (keeping the mice in the order of the files)
+        for mouse in mice:
+            self.m_dict.pop(mouse, None)
+            if mouse in store:
+                self.m_dict[mouse] = store[mouse]
+        order = list(dict.fromkeys(file.split('_')[0] for file in list_csv_files(self.root) if file in self.raw))
+        self.m_dict = {mouse: self.m_dict[mouse] for mouse in order if mouse in self.m_dict}
+
+        self.write_outputs(mice)
+        return mice
+
+    def write_outputs(self, mice):
+        '''
+        Rewrites the results file, and the raw numbers files of the given mice.
+        '''
+        output_file = self.experiment + '_results_' + self.region_name + '_' + self.tracer + '.csv'
+        title = self.experiment + ' ' + self.region_name + '->' + self.tracer
+        write_results_to_csv(self.output_directory, output_file, title, self.recall, self.extinction, self.control, self.tracer,
+                             self.results['chance'][0], self.results['chance'][1],
+                             self.results['cFos'][0], self.results['cFos'][1],
+                             self.results['Doublepos'][0], self.results['Doublepos'][1])
+
+        raw_number_directory = os.path.join(self.output_directory, 'Raw_numbers'+'_'+self.region_name+'_'+self.tracer)
+        os.makedirs(raw_number_directory, exist_ok=True)
+        for mouse in mice:
+            file_name = os.path.join(raw_number_directory, mouse + '.csv')
+            if mouse in self.m_dict:
+                write_raw_numbers(file_name, mouse, self.m_dict[mouse])
+            elif os.path.isfile(file_name):
+                os.remove(file_name)
+
+    def watch(self, interval=10, max_updates=None):
+        '''
+        Calls update() every 'interval' seconds, until it is stopped (Ctrl+C) or after max_updates updates.
+        '''
+        n_updates = 0
+        try:
+            while max_updates is None or n_updates < max_updates:
+                mice = self.update()
+                if len(mice) != 0:
+                    n_updates = n_updates + 1
+                    print('{t}: updated mice {m}'.format(t=time.strftime('%H:%M:%S'), m=', '.join(mice)))
+                else:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            print('Stopped watching "{r}".'.format(r=self.root))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Binning raw photometry data, like BinTimePoints.R, but streaming.
+
+Aligns photometry times and averages the raw readings of the 1-site 2-color Fiber Photometry System
+(Doric Lenses, Canada) into 10 ms time bins, for the next steps in Igor. BinTimePoints.R loads every recording
+completely into memory; here every file is read in chunks of chunk_rows rows, and the bins of a chunk are written
+as soon as they are complete, so the memory used does not depend on the length of the recording.
+Many recordings are binned at the same time in n_workers processes.
+
+Input (all files in one folder, e.g. ../data/RawPhotometry_Input/):
+  - one raw Doric file per mouse per phase, with Time(s), the 405 nm and 465 nm readings and AIn-3
+    (only the first 6 columns are used, like in BinTimePoints.R)
+Output (in the folder binned_output, next to the input files):
+  - one file per input file, named InputFileName_binned.csv, with the same layout as the output of BinTimePoints.R:
+    - readings where AIn-3 is not above 0 (before the wire is connected to the mouse) are left out
+    - times start at 0 (the first reading that is kept)
+    - duplicated readings are left out
+    - all columns are averaged into 10 ms bins; Time(s) is the start of the bin; bins without readings are NA
+
+The times in a file must increase (as they do in Doric files), so that every bin is in one piece of the file.
+
+Usage: python bin_time_points.py [../data/RawPhotometry_Input] [--workers 4] [--chunk-rows 500000]
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+BIN_SIZE = 0.01             # s
+N_COLUMNS = 6               # like x[,1:6] in BinTimePoints.R
+TIME_COLUMN = 'Time(s)'
+CONNECTION_COLUMN = 'AIn-3'
+DEFAULT_CHUNK_ROWS = 500000
+
+#%%
+def binned_file_name(file_name):
+    '''
+    Returns the name of the output file of a raw file (InputFileName_binned.csv, without the 4 characters of '.csv').
+    '''
+    return os.path.basename(file_name)[:-4] + '_binned.csv'
+
+def bin_codes(times, bin_size=BIN_SIZE):
+    '''
+    Returns the bins of every time. Like in BinTimePoints.R, the bin k has the times from k*bin_size up to
+    (not including) bin_size + k*bin_size. Because of rounding, these limits do not always meet exactly, so a time
+    can be in two bins (k-1 and k) or in none.
+    Output: the last bin k that starts at or before every time, whether the time is in bin k,
+    and whether it is in bin k-1 too.
+    '''
+    codes = np.floor(times / bin_size).astype(np.int64)
+    # Correct the rounding of times / bin_size, so that the times are compared with the bin limits themselves
+    codes[times < codes * bin_size] -= 1
+    codes[times >= (codes + 1) * bin_size] += 1
+    in_bin = times < bin_size + codes * bin_size
+    in_previous = (codes > 0) & (times < bin_size + (codes - 1) * bin_size)
+    return codes, in_bin, in_previous
+
+def format_rows(values):
+    '''
+    Formats rows of numbers like write.csv in R (15 significant digits, NA for missing values).
+    '''
+    if len(values) == 0:
+        return ''
+    text = np.char.mod('%.15g', values)
+    text[np.isnan(values)] = 'NA'
+    return '\n'.join(','.join(row) for row in text) + '\n'
+
+#%%
+def bin_file(file_name, output_directory, chunk_rows=DEFAULT_CHUNK_ROWS, bin_size=BIN_SIZE):
+    '''
+    Bins one raw photometry file (see the description at the top of this file), and writes the result to
+    output_directory. Returns the name of the output file and the number of bins.
+    '''
+    header = pd.read_csv(file_name, nrows=0).columns[:N_COLUMNS]
+    if CONNECTION_COLUMN not in header:
+        raise ValueError('"{f}" has no column {c} in its first {n} columns.'.format(f=file_name, c=CONNECTION_COLUMN, n=N_COLUMNS))
+    time_pos = list(header).index(TIME_COLUMN) if TIME_COLUMN in header else 0
+    connection_pos = list(header).index(CONNECTION_COLUMN)
+
+    output_file = os.path.join(output_directory, binned_file_name(file_name))
+    tmp_file = output_file + '.tmp'
+    origin = None       # time of the first reading that is kept
+    carry = None        # readings of the last bins of the previous chunk, that were not written yet
+    next_bin = 0        # first bin that was not written yet
+    last_time = -np.inf
+
+    with open(tmp_file, 'w', newline='') as f:
+        f.write(','.join('"' + name + '"' for name in header) + '\n')
+        reader = pd.read_csv(file_name, usecols=range(len(header)), dtype=np.float64, chunksize=chunk_rows)
+        for chunk in reader:
+            values = chunk.to_numpy()
+            # Leave out the readings before the wire was connected
+            values = values[values[:, connection_pos] > 0]
+            if len(values) == 0:
+                continue
+            if np.any(np.diff(values[:, time_pos]) < 0) or values[0, time_pos] < last_time:
+                raise ValueError('The times in "{f}" do not increase.'.format(f=file_name))
+            last_time = values[-1, time_pos]
+            if origin is None:
+                origin = values[0, time_pos]
+            values[:, time_pos] = values[:, time_pos] - origin
+            if carry is not None:
+                values = np.concatenate([carry, values])
+
+            # The readings of the last bin can go on in the next chunk, and can also be in the bin before it
+            # (see bin_codes): only write the bins before those two, and keep their readings for the next chunk
+            codes = bin_codes(values[:, time_pos], bin_size)[0]
+            stop_bin = max(codes[-1] - 1, next_bin)
+            next_bin = write_bins(f, values, next_bin, stop_bin, time_pos, bin_size)
+            carry = values[np.searchsorted(codes, stop_bin):]
+
+        if carry is not None and len(carry):
+            last_bin = bin_codes(carry[:, time_pos], bin_size)[0][-1]
+            next_bin = write_bins(f, carry, next_bin, last_bin + 1, time_pos, bin_size)
+    os.replace(tmp_file, output_file)
+    return output_file, next_bin
+
+def write_bins(f, values, next_bin, stop_bin, time_pos, bin_size=BIN_SIZE):
+    '''
+    Averages the readings (rows of values, sorted by time) per bin, and writes the bins next_bin ... stop_bin-1 to f
+    (bins without readings are NA). Readings of other bins are not used. Returns stop_bin (the first bin that was not written).
+    '''
+    if stop_bin <= next_bin:
+        return next_bin
+    # Leave out duplicated readings (they have the same time, so they are in the same bin)
+    values = values[~pd.DataFrame(values).duplicated().to_numpy()]
+
+    # Every reading counts for its bin, and for the bin before it if it is in that bin too (see bin_codes)
+    codes, in_bin, in_previous = bin_codes(values[:, time_pos], bin_size)
+    values = np.concatenate([values[in_previous], values[in_bin]])
+    codes = np.concatenate([codes[in_previous] - 1, codes[in_bin]])
+    used = (codes >= next_bin) & (codes < stop_bin)
+    order = np.argsort(codes[used], kind='stable')
+    values, codes = values[used][order], codes[used][order]
+
+    bins = np.arange(next_bin, stop_bin)
+    means = np.full((len(bins), values.shape[1]), np.nan)
+    if len(codes) != 0:
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        sums = np.add.reduceat(values, starts, axis=0)
+        sizes = np.diff(np.r_[starts, len(codes)])
+        means[codes[starts] - next_bin] = sums / sizes[:, np.newaxis]
+    means[:, time_pos] = bins * bin_size
+    f.write(format_rows(means))
+    return stop_bin
+
+#%%
+def list_raw_files(path):
+    '''
+    Returns the sorted list of raw files in path (all files; like in BinTimePoints.R, there is no rule for file names).
+    '''
+    return sorted(os.path.join(path, file) for file in os.listdir(path)
+                  if os.path.isfile(os.path.join(path, file)) and not file.startswith('.'))
+
+def bin_folder(path, output_directory=None, n_workers=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    '''
+    Bins all raw files in path, in n_workers processes (default: the number of CPUs; with 1 worker, no processes
+    are started). The output goes to output_directory (default: path/binned_output).
+    Returns the names of the output files.
+    '''
+    if output_directory is None:
+        output_directory = os.path.join(path, 'binned_output')
+    os.makedirs(output_directory, exist_ok=True)
+    files = list_raw_files(path)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(files))
+
+    output_files = []
+    start = time.perf_counter()
+    if n_workers <= 1:
+        for file_name in files:
+            print('Binning: ' + os.path.basename(file_name))
+            output_files.append(bin_file(file_name, output_directory, chunk_rows)[0])
+    else:
+        # Note: on Windows and macOS, call bin_folder from within an "if __name__ == '__main__':" block.
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(bin_file, file_name, output_directory, chunk_rows): file_name for file_name in files}
+            for future in as_completed(futures):
+                output_file, n_bins = future.result()
+                output_files.append(output_file)
+                print('Binned: {f} ({n} bins)'.format(f=os.path.basename(futures[future]), n=n_bins))
+    print('{n} files binned in {t:.1f} s'.format(n=len(output_files), t=time.perf_counter() - start))
+    return output_files
+
+#%%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Averages raw Doric photometry files into 10 ms bins (like BinTimePoints.R).')
+    parser.add_argument('path', nargs='?', default='../data/RawPhotometry_Input', help='folder with the raw files')
+    parser.add_argument('--output', help='output folder (default: path/binned_output)')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: the number of CPUs)')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS, help='number of rows read at once')
+    args = parser.parse_args()
+
+    bin_folder(args.path, args.output, args.workers, args.chunk_rows)
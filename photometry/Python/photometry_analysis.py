@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Photometry-freezing analysis, like the Igor processing and PhotometryAnalysis.R, in one Python step.
+
+1. dF/F (like '1.7 Hz filter_bsl Normalization on all.txt' in Igor), from the output of bin_time_points.py:
+   - delete the first 600 points (initial exponential decay)
+   - low-pass filter at 1.7 Hz with a Hanning window (2.5 Hz reject band, 500 coefficients)
+   - dF = 100*(F - Fo)/Fo, where Fo is the median of the first 23360 points
+   The result is written like the files in Photometry_Input/Igor_output (time_ext, dF_405, dF_465).
+2. Freezing alignment (like PhotometryAnalysis.R), from the dF/F files and the TSE freezing files:
+   - PhotFreezeTable.csv: the dF/F with freeze (any freezing bout) and freeze_cut (bouts of at least minfreeze s)
+   - freezetrace_dF465.csv and freezetrace_dF405.csv: the dF/F in a window of +-2 s around the end of every
+     freezing bout of at least minfreeze s, with the average and SE of all windows
+   Freezing in the first tcutoff s is left out. The plots of PhotometryAnalysis.R are not made.
+
+The windows of all bouts of all recordings are taken from one long array of all traces at once (see
+extract_windows), instead of one by one. The output files have the same layout as those of PhotometryAnalysis.R.
+Note: PhotometryAnalysis.R writes the 465 nm windows into freezetrace_dF405.csv as well; here that file has the
+405 nm windows.
+
+File names (like PhotometryAnalysis.R):
+  - dF/F files: mouse_phase#_phaseName_..._binned_..._dF.txt, e.g. 10005_phase2_Ext6_1_binned_0.01_dF.txt
+  - freezing files: any file name with 'freez' and the phase name, e.g. freezing_Ext6_cutoff0.5.txt
+
+Usage: python photometry_analysis.py [../data] [--binned ../data/RawPhotometry_Input/binned_output]
+"""
+
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from bin_time_points import BIN_SIZE
+
+# Igor processing
+N_SKIP = 600            # points deleted at the start
+F_PASS = 0.0166667      # end of the pass band (fraction of the sampling rate: 1.7 Hz at 100 Hz)
+F_REJECT = 0.025        # start of the reject band (2.5 Hz at 100 Hz)
+N_COEFS = 500           # number of filter coefficients
+N_BASELINE = 23360      # Fo is the median of the first N_BASELINE points
+
+# Freezing parameters
+TCUTOFF = 60            # remove the first 60 seconds of the experiment
+MINFREEZE = 1.5         # minimum freezing length (s)
+MAXFREEZE = np.inf      # maximum freezing length (s)
+WINDOW = 2              # window around the end of freezing (s)
+ANIMAL_FIXES = {9554: 95540}    # animal numbers that are wrong in the freezing files
+
+#%% dF/F
+def lowpass_coefficients(f_pass=F_PASS, f_reject=F_REJECT, n_coefs=N_COEFS):
+    '''
+    Returns the coefficients of a low-pass FIR filter (windowed sinc with a Hanning window), with the cut-off
+    halfway between the end of the pass band and the start of the reject band (fractions of the sampling rate).
+    '''
+    cutoff = (f_pass + f_reject) / 2
+    x = np.arange(n_coefs) - (n_coefs - 1) / 2
+    coefs = 2 * cutoff * np.sinc(2 * cutoff * x) * np.hanning(n_coefs)
+    return coefs / coefs.sum()
+
+def lowpass_filter(values, coefs):
+    '''
+    Filters values with the FIR coefficients coefs, centred (no delay), with the values mirrored at both ends.
+    '''
+    n = len(coefs)
+    padded = np.pad(values, (n // 2, n - 1 - n // 2), mode='symmetric')
+    return np.convolve(padded, coefs[::-1], mode='valid')
+
+def dF_over_F(signal, coefs=None, n_baseline=N_BASELINE):
+    '''
+    Returns 100*(F - Fo)/Fo, with F the low-pass filtered signal and Fo the median of its first n_baseline points.
+    '''
+    if coefs is None:
+        coefs = lowpass_coefficients()
+    filtered = lowpass_filter(signal, coefs)
+    Fo = np.median(filtered[:n_baseline])
+    return 100 * (filtered - Fo) / Fo
+
+def binned_to_dF(file_name, n_skip=N_SKIP):
+    '''
+    Computes the dF/F of a binned file (the output of bin_time_points.py or BinTimePoints.R).
+    Output: a dataframe with the columns time_ext, dF_405 and dF_465 (like the output of Igor).
+    '''
+    binned = pd.read_csv(file_name, na_values='NA', float_precision='round_trip').iloc[n_skip:]
+    coefs = lowpass_coefficients()
+    return pd.DataFrame({'time_ext': binned['Time(s)'].to_numpy(),
+                         'dF_405': dF_over_F(binned['AIn-1 - Demodulated(Lock-In)'].to_numpy(), coefs),
+                         'dF_465': dF_over_F(binned['AIn-2 - Demodulated(Lock-In)'].to_numpy(), coefs)})
+
+def dF_file_name(binned_file):
+    '''
+    Returns the name of the dF/F file of a binned file, e.g. 10005_phase2_Ext6_1_binned.csv -> 10005_phase2_Ext6_1_binned_0.01_dF.txt
+    '''
+    return os.path.basename(binned_file)[:-4] + '_{b:g}_dF.txt'.format(b=BIN_SIZE)
+
+def write_dF(table, file_name):
+    '''
+    Writes a dF/F table as a tab-delimited text file, like Igor does.
+    '''
+    table.to_csv(file_name, sep='\t', index=False, float_format='%.16g', lineterminator='\n')
+
+#%% Freezing
+def read_freezing(file_names):
+    '''
+    Reads TSE freezing files (tab-delimited, with decimal commas; the column names are on the second line).
+    Output: one dataframe with the freezing bouts of all files.
+    '''
+    tables = [pd.read_csv(file_name, sep='\t', skiprows=[0, 2], decimal=',', encoding='latin1',
+                          float_precision='round_trip') for file_name in file_names]
+    freezing = pd.concat(tables, ignore_index=True)
+    freezing['Animal'] = freezing['Animal'].replace(ANIMAL_FIXES)
+    return freezing
+
+def select_bouts(freezing, animal, phase, tcutoff=TCUTOFF, minfreeze=MINFREEZE, maxfreeze=MAXFREEZE):
+    '''
+    Returns the freezing bouts of one animal in one phase (e.g. 'phase2') that start after tcutoff s,
+    and those of them that last from minfreeze s up to (not including) maxfreeze s.
+    '''
+    phase_number = re.sub('[a-z]', '', phase.lower())
+    freeze = freezing[(freezing['Animal'].astype(str) == str(animal)) & (freezing['Phase'].astype(str) == phase_number)]
+    freeze = freeze[freeze['Time from [s]'] >= tcutoff]
+    freeze_cut = freeze[(freeze['Dur. [s]'] >= minfreeze) & (freeze['Dur. [s]'] < maxfreeze)]
+    return freeze, freeze_cut
+
+def freeze_flags(times, starts, ends):
+    '''
+    Returns 1 for every time that is in at least one bout (start <= time <= end), and 0 otherwise.
+    '''
+    # +1 at the first time of every bout, -1 after its last time: the running sum counts the bouts a time is in
+    changes = np.zeros(len(times) + 1, dtype=np.int64)
+    np.add.at(changes, np.searchsorted(times, starts, side='left'), 1)
+    np.add.at(changes, np.searchsorted(times, ends, side='right'), -1)
+    return (np.cumsum(changes[:-1]) > 0).astype(np.int64)
+
+def extract_windows(times, traces, events, window=WINDOW, bin_size=BIN_SIZE):
+    '''
+    Extracts the trace around every event in one go, for any number of recordings.
+    Inputs:
+        times: list with the (increasing) times of every recording
+        traces: list with, for every recording, an array (points x signals) with the traces
+        events: list with the event times (e.g. ends of freezing) of every recording
+    Output: for every recording, an array (bouts x points x signals) with the traces from event-window up to
+    event+window. Like in PhotometryAnalysis.R, only windows with all 2*window/bin_size + 1 points are kept
+    (windows at the start or end of the recording, or with missing points, are left out).
+    '''
+    n_points = int(round(2 * window / bin_size)) + 1
+    offsets = np.cumsum([0] + [len(t) for t in times])
+    all_traces = np.concatenate([np.asarray(trace, dtype=float).reshape(len(t), -1) for t, trace in zip(times, traces)])
+
+    # The first and last+1 point of every window, as a position in all_traces
+    starts, stops, recording = [], [], []
+    for i, (t, event) in enumerate(zip(times, events)):
+        event = np.asarray(event, dtype=float)
+        starts.append(offsets[i] + np.searchsorted(t, event - window, side='left'))
+        stops.append(offsets[i] + np.searchsorted(t, event + window, side='right'))
+        recording.append(np.full(len(event), i))
+    starts, stops, recording = np.concatenate(starts), np.concatenate(stops), np.concatenate(recording)
+    keep = (stops - starts) == n_points
+
+    # All windows at once: a strided view of all_traces (no copy), indexed with the starts of the windows
+    if len(all_traces) >= n_points:
+        views = np.lib.stride_tricks.sliding_window_view(all_traces, n_points, axis=0)
+        windows = views[starts[keep]].transpose(0, 2, 1)
+    else:
+        windows = np.zeros((0, n_points, all_traces.shape[1]))
+    return [windows[recording[keep] == i] for i in range(len(times))]
+
+#%% Output
+def format_value(value, digits=15):
+    if isinstance(value, str):
+        return '"' + value + '"'
+    if np.isnan(value):
+        return 'NA'
+    return '%.*g' % (digits, value)
+
+def write_csv_like_R(table, file_name, row_names=False):
+    '''
+    Writes a dataframe like write.csv in R: quoted column names, 15 significant digits, NA for missing values,
+    and (with row_names=True) the row numbers 1, 2, ... as first column.
+    '''
+    columns = list(table.columns)
+    values = table.to_numpy(dtype=float)
+    lines = [','.join(([format_value('')] if row_names else []) + [format_value(c) for c in columns])]
+    for i, row in enumerate(values):
+        lines.append(','.join(([format_value(str(i + 1))] if row_names else []) + [format_value(v) for v in row]))
+    with open(file_name, 'w', newline='') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def window_stats(windows, window=WINDOW, single_name='photWindows'):
+    '''
+    Returns the windows (bouts x points) as a table like freezingStats in PhotometryAnalysis.R:
+    seconds, X1 ... Xn (one column per bout), average and SE.
+    With one bout, R names its column after the matrix of windows (single_name), and its SE is NA.
+    '''
+    n_bouts, n_points = windows.shape
+    stats = pd.DataFrame({'seconds': -window + np.arange(n_points) * (2 * window / (n_points - 1))})
+    if n_bouts == 1:
+        stats[single_name] = windows[0]
+    else:
+        for j in range(n_bouts):
+            stats['X' + str(j + 1)] = windows[j]
+    stats['average'] = windows.mean(axis=0)
+    if n_bouts == 1:
+        stats['SE'] = np.nan
+    else:
+        stats['SE'] = windows.std(axis=0, ddof=1) / np.sqrt(n_bouts)
+    return stats
+
+#%% Batch
+def parse_dF_name(file_name):
+    '''
+    Returns animal, phase number and phase name of a dF/F file, e.g. 10005_phase2_Ext6_1_binned_0.01_dF.txt -> ('10005', 'phase2', 'Ext6')
+    '''
+    parts = os.path.basename(file_name).split('_')
+    return parts[0], parts[1], parts[2]
+
+def analyse_folder(directory, tcutoff=TCUTOFF, minfreeze=MINFREEZE, maxfreeze=MAXFREEZE, window=WINDOW):
+    '''
+    Runs the freezing alignment for all dF/F files in directory/Photometry_Input/Igor_output, with the freezing files
+    in directory/Photometry_Input/TSE_freezingOutput, and writes the output to directory/Photometry_Output.
+    Returns the names of the files that were written.
+    '''
+    input_dir = os.path.join(directory, 'Photometry_Input')
+    output_dir = os.path.join(directory, 'Photometry_Output')
+    os.makedirs(output_dir, exist_ok=True)
+    photometry_dir = os.path.join(input_dir, 'Igor_output')
+    freezing_dir = os.path.join(input_dir, 'TSE_freezingOutput')
+    dF_files = sorted(f for f in os.listdir(photometry_dir) if f[:1].isdigit() and 'binned' in f)
+    freezing_files = sorted(f for f in os.listdir(freezing_dir) if 'freez' in f)
+
+    # Read all recordings and their freezing bouts
+    recordings = []
+    for dF_file in dF_files:
+        animal, phase, phase_name = parse_dF_name(dF_file)
+        matching = [os.path.join(freezing_dir, f) for f in freezing_files if phase_name.lower() in f.lower()]
+        if len(matching) == 0:
+            print('WARNING: no freezing file for {f}; it is skipped.'.format(f=dF_file))
+            continue
+        freeze, freeze_cut = select_bouts(read_freezing(matching), animal, phase, tcutoff, minfreeze, maxfreeze)
+        table = pd.read_csv(os.path.join(photometry_dir, dF_file), sep='\t', float_precision='round_trip')
+        times = table['time_ext'].to_numpy()
+        table['freeze'] = freeze_flags(times, freeze['Time from [s]'].to_numpy(), freeze['Time to [s]'].to_numpy())
+        table['freeze_cut'] = freeze_flags(times, freeze_cut['Time from [s]'].to_numpy(), freeze_cut['Time to [s]'].to_numpy())
+        recordings.append((animal + '_' + phase + '_' + phase_name, table, freeze_cut['Time to [s]'].to_numpy()))
+
+    # The windows around the end of all freezing bouts of all recordings
+    windows = extract_windows([table['time_ext'].to_numpy() for _, table, _ in recordings],
+                              [table[['dF_465', 'dF_405']].to_numpy() for _, table, _ in recordings],
+                              [ends for _, _, ends in recordings], window)
+
+    output_files = []
+    for (name, table, ends), recording_windows in zip(recordings, windows):
+        file_name = os.path.join(output_dir, name + '_PhotFreezeTable.csv')
+        write_csv_like_R(table, file_name)
+        output_files.append(file_name)
+        if len(recording_windows) == 0:
+            print('WARNING: {n} has no complete window around the end of freezing.'.format(n=name))
+            continue
+        # (names of the tables of windows in PhotometryAnalysis.R, used as column name when there is one bout)
+        for k, (signal, windows_name) in enumerate([('dF465', 'photWindows'), ('dF405', 'Windows405')]):
+            file_name = os.path.join(output_dir, name + '_freezetrace_' + signal + '.csv')
+            write_csv_like_R(window_stats(recording_windows[:, :, k], window, windows_name), file_name, row_names=True)
+            output_files.append(file_name)
+        print('{n}: {b} freezing bouts'.format(n=name, b=len(recording_windows)))
+    return output_files
+
+def binned_folder_to_dF(binned_dir, output_dir):
+    '''
+    Computes the dF/F of all binned files in binned_dir, and writes them to output_dir (see dF_file_name).
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    for file in sorted(os.listdir(binned_dir)):
+        if file.endswith('_binned.csv'):
+            write_dF(binned_to_dF(os.path.join(binned_dir, file)), os.path.join(output_dir, dF_file_name(file)))
+            print('dF/F: ' + file)
+
+#%%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aligns photometry (dF/F) and freezing data, like PhotometryAnalysis.R.')
+    parser.add_argument('directory', nargs='?', default='../data', help='folder with Photometry_Input')
+    parser.add_argument('--binned', help='first compute the dF/F of the binned files in this folder '
+                                         '(written to Photometry_Input/Igor_output)')
+    args = parser.parse_args()
+
+    if args.binned:
+        binned_folder_to_dF(args.binned, os.path.join(args.directory, 'Photometry_Input', 'Igor_output'))
+    analyse_folder(args.directory)